@@ -94,6 +94,7 @@ function Agent:build(name, mods)
     elseif name == 'pre_hid' then
         local enc, lut = self:build_encoder(self.opts.hidsz)
         if lut then mods['encoder_lut'] = lut end
+        mods.enc = enc
         mods.pre_hid = enc(self:get('obs', mods))
         if self.opts.recurrent then
             local hid2hid = nn.Linear(self.opts.hidsz, self.opts.hidsz)(self:get('prev_hid', mods))
@@ -113,13 +114,16 @@ function Agent:build(name, mods)
     elseif name:sub(1, 10) == 'pre_action' then
         local nactions = self.opts.nactions_byname[name:sub(5)]
         assert(nactions > 0)
+        local linear
         if nactions == 1 then
             -- make continuous action
-            mods[name] = nn.Linear(self.opts.hidsz, 2)(self:get('hidstate', mods))
+            linear = nn.Linear(self.opts.hidsz, 2)
+            mods[name] = linear(self:get('hidstate', mods))
         else
-            mods[name] = nn.LogSoftMax()(
-                nn.Linear(self.opts.hidsz, nactions)(self:get('hidstate', mods)))
+            linear = nn.Linear(self.opts.hidsz, nactions)
+            mods[name] = nn.LogSoftMax()(linear(self:get('hidstate', mods)))
         end
+        mods[name:sub(5) .. '_linear'] = linear
     elseif name:sub(1, 6) == 'action' then
         -- sample action
         local nactions = self.opts.nactions_byname[name]
@@ -235,6 +239,12 @@ function Agent:forward(obs, t, active)
         end
     end
     if #state.input == 1 then state.input = state.input[1] end
+    -- actions already taken by the env workers, see RllabBridge:batch_rollout
+    local replay = self.replay and self.replay[t]
+    for i = 1, #self.opts.action_names do
+        local mod = self.model_clones[self.t].mods[self.opts.action_names[i]].data.module
+        mod.replay = replay and replay[i]
+    end
     state.out = self.model_clones[self.t]:forward(state.input)
     state.active = active
     local a = {}
@@ -338,6 +348,26 @@ function Agent:backward(t, reward)
     state.gradInputs = self.model_clones[t]:backward(state.input, gradOutput)
 end
 
+-- weights of the model for rollout in rllab_worker.py, which runs the
+-- same feed-forward model with numpy
+function Agent:rollout_params()
+    return {self:rollout_mind_params(self.model.mods)}
+end
+
+function Agent:rollout_mind_params(mods)
+    local function linear(m)
+        return {m.weight, m.bias}
+    end
+    local p = {enc = linear(mods.enc), layers = {}, heads = {}}
+    for l = 2, self.opts.nlayers do
+        p.layers[l-1] = linear(mods.linear_layers[l-1])
+    end
+    for i = 1, #self.opts.action_names do
+        p.heads[i] = linear(mods[self.opts.action_names[i] .. '_linear'])
+    end
+    return p
+end
+
 function Agent:show_stat()
 end
 
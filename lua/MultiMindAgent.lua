@@ -38,9 +38,9 @@ function MultiMindAgent:build(name, mods)
         end
     elseif name:sub(1, 6) == 'action' then
         -- add sampler after
-        mods[name] = nn.LogSoftMax()(
-            nn.Linear(self.opts.hidsz, self.opts.nactions_byname[name])(self:get('hidstate', mods))
-            )
+        local linear = nn.Linear(self.opts.hidsz, self.opts.nactions_byname[name])
+        mods[name .. '_linear'] = linear
+        mods[name] = nn.LogSoftMax()(linear(self:get('hidstate', mods)))
         mods.outputs[#mods.outputs+1] = name
     else
         parent.build(self, name, mods)
@@ -257,6 +257,14 @@ function MultiMindAgent:set_value_target(reward)
 
 end
 
+function MultiMindAgent:rollout_params()
+    local params = {}
+    for m = 1, self.nminds do
+        params[m] = self:rollout_mind_params(self.model.mods.mind_mods[m])
+    end
+    return params
+end
+
 function MultiMindAgent:show_stat()
     parent.show_stat(self)
     print('mind: ' .. self.states[self.t].mind[1])
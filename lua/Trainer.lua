@@ -15,6 +15,20 @@ local function print_sorted_bykeys(t)
 end
 
 
+-- runs in a thread: an episode with the given parameters
+local function episode_job(opts, paramx)
+    for k, v in pairs(opts) do
+        g_worker.opts[k] = v
+    end
+    for i = 1, #paramx do
+        g_worker.agent.paramx[i]:copy(paramx[i])
+    end
+    local stat = g_worker:run_episode()
+    -- the Lua GC does not count the memory of tensors, see Trainer:train
+    collectgarbage("collect")
+    return g_worker.agent.paramdx, stat
+end
+
 local Trainer = torch.class('Trainer')
 
 function Trainer:__init(opts)
@@ -47,21 +61,162 @@ function Trainer:init_workers()
                 function() end, self.opts)
         end
         if self.opts.sc_count_alpha > 0 then
-            -- TODO: ore x scv x barracks x depot x marines
-            self.state_counts = self.state_counts or torch.zeros(41, 41, 41, 41, 20)
-            for w = 1, self.opts.nworker do
-                self.workers:addjob(w,
-                    function(state_counts)
-                        g_worker.state_counts = state_counts
-                    end,
-                    function() end, self.state_counts
-                )
-            end
+            self.state_counts = self.state_counts or StateCounts{shared = true}
+            self:share_state_counts()
         end
         self.workers:synchronize()
     end
 end
 
+function Trainer:share_state_counts()
+    -- the threads get the tensors of the table, not a copy
+    for w = 1, self.opts.nworker do
+        self.workers:addjob(w,
+            function(state_counts)
+                g_worker.state_counts = state_counts
+            end,
+            function() end, self.state_counts
+        )
+    end
+end
+
+function Trainer:grow_state_counts()
+    -- only while the threads are idle
+    if self.state_counts:needs_grow() then
+        self.state_counts:grow()
+        self:share_state_counts()
+        self.workers:synchronize()
+    end
+end
+
+function Trainer:reduce_grads(grads)
+    -- Averages the gradients of the threads into the paramdx of
+    -- worker_local and returns its squared norm. Every thread reduces one
+    -- shard of the parameters, see reduce_shard, so the main thread only
+    -- adds up nworker numbers.
+    local sq = 0
+    for w = 1, self.opts.nworker do
+        self.workers:addjob(w,
+            function(grads, out, w, n)
+                return reduce_shard(grads, out, w, n)
+            end,
+            function(s) sq = sq + s end,
+            grads, self.worker_local.agent.paramdx, w, self.opts.nworker
+        )
+    end
+    self.workers:synchronize()
+    return sq
+end
+
+function Trainer:squared_norm(params)
+    local sq = 0
+    for _, x in pairs(params) do
+        sq = sq + x:dot(x)
+    end
+    return sq
+end
+
+function Trainer:update_param(stat, grad_sq)
+    -- applies the gradient in the paramdx of worker_local, grad_sq is its
+    -- squared norm if known
+    if self.opts.max_grad_norm > 0 then
+        local grad_norm = math.sqrt(grad_sq or
+            self:squared_norm(self.worker_local.agent.paramdx))
+        stat.max_grad_norm = stat.max_grad_norm or 0
+        stat.max_grad_norm = math.max(stat.max_grad_norm, grad_norm)
+        if grad_norm > self.opts.max_grad_norm then
+            for _, x in pairs(self.worker_local.agent.paramdx) do
+                x:div(grad_norm / self.opts.max_grad_norm)
+            end
+        end
+    end
+    self.worker_local.agent:update_param()
+end
+
+function Trainer:train_async(stat)
+    -- The episodes of an epoch without waiting for all threads after each
+    -- batch (--async_staleness >= 0). All threads run episodes all the
+    -- time, each starting its next one with the latest parameters as soon
+    -- as it returns. As in train, an update averages the gradients of
+    -- nworker episodes, and there are nbatches of them, so both modes use
+    -- the same learning rate. Unlike in train, an episode may run on
+    -- parameters a few updates old: a gradient of parameters more than
+    -- async_staleness updates old is dropped and its episode run again,
+    -- and staleness of the applied ones is logged as its mean and max.
+    -- The state counts can only grow while the threads are idle, so when
+    -- an update finds them full, no episode is started until the running
+    -- ones return.
+    local agent = self.worker_local.agent
+    local total = self.opts.nbatches * self.opts.nworker
+    local free = {}
+    for w = 1, self.opts.nworker do
+        free[w] = w
+    end
+    self.param_version = self.param_version or 0
+    local snapshot, snapshot_version
+    local running, applied, count = 0, 0, 0
+    local grow = false
+    stat.staleness, stat.staleness_max, stat.stale_dropped = 0, 0, 0
+    while applied < total do
+        if grow and running == 0 then
+            self:grow_state_counts()
+            grow = false
+        end
+        while #free > 0 and applied + running < total and not grow do
+            local w = table.remove(free)
+            if snapshot_version ~= self.param_version then
+                -- threads copy from it later, so it must not change
+                snapshot = {}
+                for i, x in ipairs(agent.paramx) do
+                    snapshot[i] = x:clone()
+                end
+                snapshot_version = self.param_version
+            end
+            local version = snapshot_version
+            running = running + 1
+            self.workers:addjob(w, episode_job,
+                function(paramdx, s)
+                    running = running - 1
+                    table.insert(free, w)
+                    local staleness = self.param_version - version
+                    if staleness > self.opts.async_staleness then
+                        stat.stale_dropped = stat.stale_dropped + 1
+                        return
+                    end
+                    stat.staleness = stat.staleness + staleness
+                    stat.staleness_max = math.max(stat.staleness_max, staleness)
+                    merge_stat(stat, s)
+                    if count == 0 then
+                        agent:zero_grads()
+                    end
+                    for i = 1, #paramdx do
+                        agent.paramdx[i]:add(paramdx[i])
+                    end
+                    applied = applied + 1
+                    count = count + 1
+                    if count == self.opts.nworker then
+                        for i = 1, #agent.paramdx do
+                            agent.paramdx[i]:div(count)
+                        end
+                        self:update_param(stat)
+                        self.param_version = self.param_version + 1
+                        count = 0
+                        grow = self.state_counts ~= nil and
+                            self.state_counts:needs_grow()
+                    end
+                    if self.opts.show then xlua.progress(applied, total) end
+                end,
+                self.opts, snapshot
+            )
+        end
+        self.workers:dojob()
+    end
+    stat.staleness = stat.staleness / total
+    if self.state_counts then
+        self:grow_state_counts()
+    end
+end
+
 function Trainer:set_hardness(h)
     self.worker_local.factory:set_hardness(h)
     if self.opts.nworker > 1 then
@@ -97,26 +252,27 @@ function Trainer:train(N)
             h = math.min(1, math.max(0, h))
             self:set_hardness(h)
         end
-        for k = 1, self.opts.nbatches do
+        local async = self.opts.async_staleness >= 0 and self.opts.nworker > 1
+        if async then
+            self:train_async(stat)
+        end
+        for k = 1, async and 0 or self.opts.nbatches do
             if self.opts.show then xlua.progress(k, self.opts.nbatches) end
+            local grad_sq
             if self.opts.nworker > 1 then
-                self.worker_local.agent:zero_grads()
+                local grads = {}
+                if self.opts.grad_reduce ~= 'shard' then
+                    self.worker_local.agent:zero_grads()
+                end
                 for w = 1, self.opts.nworker do
-                    self.workers:addjob(w,
-                        function(opts, paramx)
-                            for k, v in pairs(opts) do
-                                g_worker.opts[k] = v
-                            end
-                            for i = 1, #paramx do
-                                g_worker.agent.paramx[i]:copy(paramx[i])
-                            end
-                            local stat = g_worker:run_episode()
-                            collectgarbage("collect")
-                            return g_worker.agent.paramdx, stat
-                        end,
+                    self.workers:addjob(w, episode_job,
                         function(paramdx, s)
-                            for i = 1, #paramdx do
-                                self.worker_local.agent.paramdx[i]:add(paramdx[i])
+                            if self.opts.grad_reduce == 'shard' then
+                                grads[w] = paramdx
+                            else
+                                for i = 1, #paramdx do
+                                    self.worker_local.agent.paramdx[i]:add(paramdx[i])
+                                end
                             end
                             merge_stat(stat, s)
                         end,
@@ -124,38 +280,28 @@ function Trainer:train(N)
                     )
                 end
                 self.workers:synchronize()
-                for i = 1, #self.worker_local.agent.paramdx do
-                    self.worker_local.agent.paramdx[i]:div(self.opts.nworker)
+                if self.opts.grad_reduce == 'shard' then
+                    grad_sq = self:reduce_grads(grads)
+                else
+                    for i = 1, #self.worker_local.agent.paramdx do
+                        self.worker_local.agent.paramdx[i]:div(self.opts.nworker)
+                    end
+                end
+                if self.state_counts then
+                    self:grow_state_counts()
                 end
+                -- the tensors of an episode (model states, results of the
+                -- env workers) are small userdata to the Lua GC, which would
+                -- let their storages pile up between collections
                 collectgarbage("collect")
             else
                 local s = self.worker_local:run_episode()
                 merge_stat(stat, s)
             end
 
-            if self.opts.max_grad_norm > 0 then
-                local grad_norm = 0
-                for _, x in pairs(self.worker_local.agent.paramdx) do
-                    grad_norm = grad_norm + torch.pow(x, 2):sum()
-                end
-                grad_norm = math.sqrt(grad_norm)
-                stat.max_grad_norm = stat.max_grad_norm or 0
-                stat.max_grad_norm = math.max(stat.max_grad_norm, grad_norm)
-                if grad_norm > self.opts.max_grad_norm then
-                    for _, x in pairs(self.worker_local.agent.paramdx) do
-                        x:div(grad_norm / self.opts.max_grad_norm)
-                    end
-                end
-            end
-
-            self.worker_local.agent:update_param()
-        end
-
-        stat.param_norm = 0
-        for _, x in pairs(self.worker_local.agent.paramdx) do
-            stat.param_norm = stat.param_norm + torch.pow(x, 2):sum()
+            self:update_param(stat, grad_sq)
         end
-        stat.param_norm = math.sqrt(stat.param_norm)
+        stat.param_norm = math.sqrt(self:squared_norm(self.worker_local.agent.paramdx))
 
         for k, v in pairs(stat) do
             if string.sub(k, 1, 5) == 'count' then
@@ -168,6 +314,9 @@ function Trainer:train(N)
             end
         end
         stat.value_cost = stat.value_cost / stat.value_count
+        if self.opts.rllab and self.opts.rllab_profile then
+            self:add_profile_stat(stat)
+        end
         
         local sc_actions = {'action_move', 'action_mine', 'action_train',
             'action_build'}
@@ -278,6 +427,32 @@ function Trainer:train(N)
     end
 end
 
+function Trainer:add_profile_stat(stat)
+    -- time spent by the env workers in each command, in us per call
+    local prof = {}
+    merge_stat(prof, self.worker_local.env_bridge:get_profile())
+    if self.opts.nworker > 1 then
+        for w = 1, self.opts.nworker do
+            self.workers:addjob(w,
+                function()
+                    return g_worker.env_bridge:get_profile()
+                end,
+                function(p)
+                    merge_stat(prof, p)
+                end)
+        end
+        self.workers:synchronize()
+    end
+    for name, p in pairs(prof) do
+        stat['bridge_' .. name .. '_calls'] = p.count
+        for _, phase in pairs({'decode', 'execute', 'encode'}) do
+            stat['bridge_' .. name .. '_' .. phase .. '_us'] = p[phase] / p.count
+        end
+    end
+    -- histograms are kept in the log
+    stat.bridge_profile = prof
+end
+
 function Trainer:plot()
     local stat = self.log[#self.log]
     plot_stat(self.log, {'reward','reward_self_play', 'reward_test_task'})
@@ -332,7 +507,9 @@ function Trainer:save(path)
     f.optim_state = self.worker_local.agent.optim_state
     f.log = self.log
     f.opts = self.opts
-    f.state_counts = self.state_counts
+    if self.state_counts then
+        f.state_counts = self.state_counts:state()
+    end
     torch.save(path, f)
 end
 
@@ -345,7 +522,9 @@ function Trainer:load(path)
     self.log = f.log
     if f.state_counts then
         if self.state_counts then
-            self.state_counts:copy(f.state_counts)
+            self.state_counts:load(f.state_counts)
+            self:share_state_counts()
+            self.workers:synchronize()
         else
             print('W: state count ignored')
         end
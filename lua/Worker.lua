@@ -18,16 +18,59 @@ function Worker:__init(opts)
         self.vocab, self.ivocab = game_util.init_vocab()
         self.opts.nwords = #self.ivocab
         local factory = game_util.init_factory(opts, self.vocab)
-        self.env_bridge = MazeBridge(factory, self.opts)
+        if self.opts.maze_vec then
+            paths.dofile('games/VecMazeBridge.lua')
+            self.env_bridge = VecMazeBridge(factory, self.opts, self.vocab, self.ivocab)
+        else
+            self.env_bridge = MazeBridge(factory, self.opts)
+        end
     end
     if self.opts.nminds > 1 then
         self.agent = MultiMindAgent(self.opts)
     else
         self.agent = Agent(self.opts)
     end
+    if self.opts.rllab and self.opts.rllab_pipeline then
+        self:init_lanes()
+    end
+    if self.opts.rllab_rollout then
+        assert(self.opts.rllab, 'rllab_rollout needs rllab')
+        assert(not self.opts.recurrent and not self.opts.mind_target
+            and self.opts.nminds <= 2, 'rllab_rollout only runs feed-forward models')
+        assert(not self.opts.rllab_pipeline, 'rllab_rollout does not run in lanes')
+    end
     self.test_run = false
 end
 
+function Worker:init_lanes()
+    -- Two halves of the batch, each run by a view of self.agent (see
+    -- lane_agent), so updates and the trainer keep working with
+    -- self.agent only. The first lane uses the clones of self.agent, which
+    -- are idle in a lanes episode, and only the second one has clones of
+    -- its own. Building them draws from the torch generator, which is
+    -- restored so lanes do not change the random stream.
+    assert(self.opts.batch_size > 1, 'rllab_pipeline needs batch_size > 1')
+    self.lanes = {}
+    for l, env in ipairs(self.env_bridge:lanes(2)) do
+        local agent = self:lane_agent()
+        if l == 1 then
+            agent.model_clones = self.agent.model_clones
+        else
+            local rng = torch.getRNGState()
+            agent:build_model_clones(self.opts.max_steps+1)
+            torch.setRNGState(rng)
+        end
+        self.lanes[l] = {env = env, agent = agent}
+    end
+end
+
+function Worker:lane_agent()
+    -- Reads go to self.agent, so its model, parameters, gradients and
+    -- methods are used, while what a lane sets during an episode (clones,
+    -- states, stat, size, batch...) stays in the view.
+    return setmetatable({}, {__index = self.agent})
+end
+
 function Worker:forward(batch, t)
     local obs, active, reward
     obs = self.env_bridge:batch_input(batch)
@@ -52,12 +95,20 @@ function Worker:run_episode()
         end
     end
 
+    if self.lanes and not self.test_run then
+        return self:run_episode_lanes(batch)
+    end
+
     -- reset agent
     self.agent.size = self.opts.batch_size * self.opts.nagents
     self.agent.stat = {}
     self.agent.states = {}
     self.agent:zero_grads()
     self.agent.batch = batch -- TODO: bit hacky?
+    self.agent.replay = nil
+    if self.opts.rllab_rollout and not self.test_run then
+        self.agent.replay = self.env_bridge:batch_rollout(batch, self.agent)
+    end
 
     local rewards = {}
     local reward_sum = torch.zeros(self.agent.size)
@@ -94,6 +145,67 @@ function Worker:run_episode()
         self.agent:backward(t, rewards[t])
     end
 
+    return self:episode_stat(batch, reward_sum, success, {self.agent})
+end
+
+-- Same as run_episode, but the batch is split into lanes and the model
+-- runs on one lane while the envs of the other are stepped.
+function Worker:run_episode_lanes(batch)
+    self.agent:zero_grads()
+    for _, lane in pairs(self.lanes) do
+        local agent = lane.agent
+        lane.batch = lane.env:batch_init(batch)
+        agent.size = #lane.batch * self.opts.nagents
+        agent.stat = {}
+        agent.states = {}
+        agent.batch = lane.batch
+        lane.rewards = {}
+        lane.reward_sum = torch.zeros(agent.size)
+    end
+
+    for t = 1, self.opts.max_steps + 1 do
+        for _, lane in ipairs(self.lanes) do
+            local env, agent = lane.env, lane.agent
+            if t > 1 then
+                -- the step sent at t-1 ran while the model was busy with
+                -- the other lane
+                env:batch_sync()
+                env:batch_update(lane.batch, lane.active)
+                local reward = env:batch_reward(lane.batch, lane.active)
+                lane.reward_sum:add(reward)
+                if agent.states[t-1].reward_internal then
+                    reward:add(agent.states[t-1].reward_internal)
+                end
+                lane.rewards[t-1] = reward
+            end
+            local obs = env:batch_input(lane.batch)
+            lane.active = env:batch_active(lane.batch)
+            local action = agent:forward(obs, t, lane.active)
+            if t <= self.opts.max_steps then
+                env:batch_act(lane.batch, action, lane.active)
+            end
+        end
+    end
+
+    local reward_terminal = self.env_bridge:batch_terminal_reward(batch)
+    local success = self.env_bridge:batch_success(batch)
+    local reward_sum = torch.zeros(self.opts.batch_size * self.opts.nagents)
+    local agents = {}
+    for _, lane in pairs(self.lanes) do
+        local agent = lane.agent
+        local lo = lane.env.lo * self.opts.nagents + 1
+        agent.reward_terminal = reward_terminal:narrow(1, lo, agent.size)
+        reward_sum:narrow(1, lo, agent.size):copy(lane.reward_sum):add(agent.reward_terminal)
+        for t = self.opts.max_steps, 1, -1 do
+            agent:backward(t, lane.rewards[t])
+        end
+        table.insert(agents, agent)
+    end
+
+    return self:episode_stat(batch, reward_sum, success, agents)
+end
+
+function Worker:episode_stat(batch, reward_sum, success, agents)
     local stat = {}
     reward_sum = reward_sum:view(self.opts.batch_size, self.opts.nagents)
     if self.opts.coop then
@@ -121,7 +233,11 @@ function Worker:run_episode()
         end
     end
 
-    for k,v in pairs(self.agent.stat) do
+    local agent_stat = {}
+    for _, agent in pairs(agents) do
+        merge_stat(agent_stat, agent.stat)
+    end
+    for k,v in pairs(agent_stat) do
         stat[k] = v
     end
     return stat
@@ -0,0 +1,96 @@
+"""Per-step cost of SPSwimmerGather with and without the cache of
+SPGatherEnv (observation of the swimmer, torso position, orientation and
+sensor readings, computed once per physics state).
+
+The uncached env recomputes every quantity where it is used, as
+SPGatherEnv did before the cache. Both envs run the same episodes from
+the same seed and random actions (Alice switching with probability 0.02)
+under the rules of SelfPlayEnvs, and their observations are checked to
+be equal. Shown are the time of a step and how many times the swimmer
+observation and the torso position are taken from MuJoCo per step. Needs
+rllab and MuJoCo.
+
+    python3 benchmarks/bench_gather_obs.py --nsteps 5000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+LUA_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, LUA_DIR)
+sys.path.insert(0, os.path.join(LUA_DIR, 'rllab'))
+sys.path.insert(0, BENCH_DIR)
+from bench_pool import env_opts, random_action
+
+
+def counted(env, counts):
+    # counts the MuJoCo queries of the inner env
+    def wrap(name, f):
+        def wrapper(*args, **kwargs):
+            counts[name] += 1
+            return f(*args, **kwargs)
+        return wrapper
+    inner = env.inner_env
+    for name in ['get_current_obs', 'get_body_com']:
+        setattr(inner, name, wrap(name, getattr(inner, name)))
+
+
+def run(physics, opts, actions, seed):
+    from envs.self_play import SelfPlayEnvs
+
+    class Envs(SelfPlayEnvs):
+        PHYSICS = physics
+    env = Envs(opts, [seed])
+    counts = dict(get_current_obs=0, get_body_com=0)
+    counted(env.envs[0], counts)
+    idx = np.zeros(1, dtype='int64')
+    obs = [env.reset()[0]]
+    t, elapsed = 0, 0
+    for action in actions:
+        start = time.time()
+        o, _, done, _ = env.step(action[None], idx)
+        elapsed += time.time() - start
+        obs.append(o)
+        t += 1
+        if done[0] or t == opts['max_steps']:
+            obs.append(env.reset()[0])
+            t = 0
+    nsteps = len(actions)
+    return (np.concatenate(obs), elapsed / nsteps,
+            dict((k, v / float(nsteps)) for k, v in counts.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nsteps', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    try:
+        from envs.sp_swimmer_gather_env import SPSwimmerGatherEnv
+    except ImportError as e:
+        print('skipped, {}'.format(e))
+        return
+
+    class UncachedEnv(SPSwimmerGatherEnv):
+        def cached(self, key, compute):
+            return compute()
+
+    opts = env_opts('SPSwimmerGather')
+    np.random.seed(args.seed)
+    actions = random_action(opts, args.nsteps)
+    obs, t_cached, n_cached = run(SPSwimmerGatherEnv, opts, actions, args.seed)
+    ref, t_ref, n_ref = run(UncachedEnv, opts, actions, args.seed)
+    print('same observations: {}'.format(np.allclose(obs, ref)))
+    print('per step:        {:>10} {:>10}'.format('uncached', 'cached'))
+    print('  time (ms)      {:10.3f} {:10.3f}'.format(t_ref * 1e3, t_cached * 1e3))
+    for k in ['get_current_obs', 'get_body_com']:
+        print('  {:15} {:10.2f} {:10.2f}'.format(k, n_ref[k], n_cached[k]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Throughput of the SwimmerGather sensor model, checked against the
+original per-object loop.
+
+Random scenes are generated with the default SPGatherEnv settings (8
+apples, 8 bombs on the spawn grid, robot anywhere in the arena). Before
+timing, the readings of sensor_readings_loop (SPGatherEnv.get_readings,
+a single env) and of sensor_readings (SPGatherEnv.batch_obs, all envs
+stepped) are compared with the loop SPGatherEnv.get_readings used to
+have, and with each other, which must agree to the bit. Needs numpy only.
+
+    python3 benchmarks/bench_gather_sensor.py --batch_size 16 --objects 16
+
+With few objects a single env is dominated by numpy call overhead, which
+is why a single env keeps a loop; the vectorized form wins from about 25
+objects per env, or when the envs of a worker are done in one call.
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+LUA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(LUA_DIR, 'rllab'))
+from envs.gather_utils import APPLE, sensor_readings, sensor_readings_loop, \
+    pad_objects
+
+N_BINS = 10
+SENSOR_RANGE = 6.
+SENSOR_SPAN = math.pi
+
+
+def reference_readings(objects, robot_x, robot_y, ori):
+    # SPGatherEnv.get_readings before vectorization
+    apple_readings = np.zeros(N_BINS)
+    bomb_readings = np.zeros(N_BINS)
+    sorted_objects = sorted(
+        objects, key=lambda o:
+        (o[0] - robot_x) ** 2 + (o[1] - robot_y) ** 2)[::-1]
+    bin_res = SENSOR_SPAN / N_BINS
+    for ox, oy, typ in sorted_objects:
+        dist = ((oy - robot_y) ** 2 + (ox - robot_x) ** 2) ** 0.5
+        if dist > SENSOR_RANGE:
+            continue
+        angle = math.atan2(oy - robot_y, ox - robot_x) - ori
+        angle = angle % (2 * math.pi)
+        if angle > math.pi:
+            angle = angle - 2 * math.pi
+        if angle < -math.pi:
+            angle = angle + 2 * math.pi
+        half_span = SENSOR_SPAN * 0.5
+        if abs(angle) > half_span:
+            continue
+        bin_number = int((angle + half_span) / bin_res)
+        intensity = 1.0 - dist / SENSOR_RANGE
+        if typ == APPLE:
+            apple_readings[bin_number] = intensity
+        else:
+            bomb_readings[bin_number] = intensity
+    return apple_readings, bomb_readings
+
+
+def random_scene(rng):
+    cells = np.array([(x, y) for x in range(-6, 6, 2) for y in range(-6, 6, 2)
+                      if x ** 2 + y ** 2 >= 4])
+    n = rng.randint(0, 17)
+    objects = np.zeros((n, 3))
+    objects[:, :2] = cells[rng.permutation(len(cells))[:n]]
+    objects[:, 2] = rng.permutation(16)[:n] >= 8
+    return objects, rng.uniform(-7, 7, 2), rng.uniform(-10, 10)
+
+
+def same(x, y):
+    # same bins lit, intensities equal up to rounding of sqrt vs ** 0.5
+    return np.array_equal(x > 0, y > 0) and np.allclose(x, y, rtol=0, atol=1e-12)
+
+
+def check(nscenes, batch_size, rng):
+    scenes = [random_scene(rng) for _ in range(nscenes)]
+    ref = [reference_readings([tuple(o) for o in objects], xy[0], xy[1], ori)
+           for objects, xy, ori in scenes]
+    loop = [sensor_readings_loop(objects, xy, ori, N_BINS, SENSOR_RANGE, SENSOR_SPAN)
+            for objects, xy, ori in scenes]
+    for (objects, xy, ori), (apple, bomb), (la, lb) in zip(scenes, ref, loop):
+        assert same(la, apple) and same(lb, bomb)
+        a, b = sensor_readings(objects, xy, ori, N_BINS, SENSOR_RANGE, SENSOR_SPAN)
+        assert np.array_equal(a, la) and np.array_equal(b, lb)
+    for k in range(0, nscenes, batch_size):
+        batch = scenes[k:k+batch_size]
+        a, b = sensor_readings(
+            pad_objects([s[0] for s in batch]), [s[1] for s in batch],
+            [s[2] for s in batch], N_BINS, SENSOR_RANGE, SENSOR_SPAN)
+        for i in range(len(batch)):
+            assert np.array_equal(a[i], loop[k + i][0])
+            assert np.array_equal(b[i], loop[k + i][1])
+    return nscenes
+
+
+def timeit(f, n):
+    t = time.time()
+    for _ in range(n):
+        f()
+    return n / (time.time() - t)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--objects', type=int, default=16)
+    parser.add_argument('--check', type=int, default=20000)
+    parser.add_argument('--iters', type=int, default=2000)
+    args = parser.parse_args()
+    rng = np.random.RandomState(0)
+
+    print('readings match on {} scenes'.format(check(args.check, args.batch_size, rng)))
+
+    # timed scene: objects spread over the sensor range of the robot
+    objects = np.zeros((args.objects, 3))
+    objects[:, :2] = rng.uniform(-SENSOR_RANGE, SENSOR_RANGE, (args.objects, 2))
+    objects[:, 2] = np.arange(args.objects) % 2
+    xy, ori = np.zeros(2), rng.uniform(-10, 10)
+    tuples = [tuple(o) for o in objects]
+    padded = pad_objects([objects] * args.batch_size)
+    xys = np.zeros((args.batch_size, 2))
+    oris = rng.uniform(-10, 10, args.batch_size)
+    ref = timeit(lambda: reference_readings(tuples, xy[0], xy[1], ori), args.iters)
+    loop = timeit(lambda: sensor_readings_loop(
+        objects, xy, ori, N_BINS, SENSOR_RANGE, SENSOR_SPAN), args.iters)
+    vec = timeit(lambda: sensor_readings(
+        objects, xy, ori, N_BINS, SENSOR_RANGE, SENSOR_SPAN), args.iters)
+    bat = args.batch_size * timeit(lambda: sensor_readings(
+        padded, xys, oris, N_BINS, SENSOR_RANGE, SENSOR_SPAN), args.iters)
+    print('old loop   : {:9.0f} obs/sec'.format(ref))
+    print('loop       : {:9.0f} obs/sec ({:.1f}x)'.format(loop, loop / ref))
+    print('vectorized : {:9.0f} obs/sec ({:.1f}x)'.format(vec, vec / ref))
+    print('batched {:<3d}: {:9.0f} obs/sec ({:.1f}x)'.format(
+        args.batch_size, bat, bat / ref))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Cost of placing the objects of a SwimmerGather test episode.
+
+Compares the rejection sampling SPGatherEnv.reset used to do with layouts
+drawn in bulk on the precomputed spawn grid, after checking that the
+layouts are valid (distinct cells, away from the robot) and cover all
+cells. Needs numpy only.
+
+    python3 benchmarks/bench_gather_spawn.py
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+LUA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(LUA_DIR, 'rllab'))
+from envs.gather_utils import APPLE, BOMB, spawn_cells, spawn_layouts
+
+
+def reference_layout(n_apples, n_bombs, activity_range, robot_object_spacing):
+    # SPGatherEnv.reset before the spawn grid
+    objects = []
+    existing = set()
+    while len(objects) < n_apples + n_bombs:
+        x = np.random.randint(int(-activity_range / 2), int(activity_range / 2)) * 2
+        y = np.random.randint(int(-activity_range / 2), int(activity_range / 2)) * 2
+        if x ** 2 + y ** 2 < robot_object_spacing ** 2:
+            continue
+        if (x, y) in existing:
+            continue
+        typ = APPLE if len(objects) < n_apples else BOMB
+        objects.append((x, y, typ))
+        existing.add((x, y))
+    return objects
+
+
+def check(layouts, cells, args):
+    for objects in layouts:
+        assert len(set(map(tuple, objects[:, :2]))) == len(objects)
+        assert np.all((objects[:, :2] ** 2).sum(1) >= args.spacing ** 2)
+        assert np.all(objects[:args.apples, 2] == APPLE)
+        assert np.all(objects[args.apples:, 2] == BOMB)
+    used = set(map(tuple, layouts[:, :, :2].reshape(-1, 2)))
+    assert used == set(map(tuple, cells))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--apples', type=int, default=8)
+    parser.add_argument('--bombs', type=int, default=8)
+    parser.add_argument('--range', type=float, default=6.)
+    parser.add_argument('--spacing', type=float, default=2.)
+    parser.add_argument('--reservoir', type=int, default=64)
+    parser.add_argument('--n', type=int, default=5000)
+    args = parser.parse_args()
+    np.random.seed(0)
+
+    cells = spawn_cells(args.range, args.spacing)
+    check(spawn_layouts(cells, args.apples, args.bombs, 1000), cells, args)
+    print('{} cells, layouts valid'.format(len(cells)))
+
+    t = time.time()
+    for _ in range(args.n):
+        reference_layout(args.apples, args.bombs, args.range, args.spacing)
+    ref = (time.time() - t) / args.n
+    t = time.time()
+    for _ in range(args.n // args.reservoir):
+        cells = spawn_cells(args.range, args.spacing)
+        spawn_layouts(cells, args.apples, args.bombs, args.reservoir)
+    bulk = (time.time() - t) / (args.n // args.reservoir * args.reservoir)
+    print('rejection sampling : {:7.1f} us/reset'.format(ref * 1e6))
+    print('reservoir of {:<5d} : {:7.1f} us/reset ({:.0f}x)'.format(
+        args.reservoir, bulk * 1e6, ref / bulk))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""SPMountainCarVec (envs/vec_mountain_car.py) against the Box2D
+SPMountainCar: env steps per second through rllab_worker over batch sizes,
+and how close the numpy cart follows the Box2D one.
+
+Both envs start from the same seeds in test mode (nminds 1), and are
+driven two ways:
+
+- the same random forces, with the RMS difference of [xpos, xvel] over
+  envs and the first --horizon steps. Box2D pushes the cart over the
+  segments of its track, so single steps differ by a noise that adds up,
+  and trajectories are only compared in RMS, against RMS_TOLERANCE.
+- a force of gain * sign(xvel), which swings the cart up to the goal,
+  with the mean number of steps to reach it, which must be within
+  STEPS_TOLERANCE of the Box2D env at each gain of PUMP_GAINS.
+
+The Box2D parts need rllab and Box2D, and are skipped with a message
+without them.
+
+    python3 benchmarks/bench_mountain_car.py --batch_size 16 64 256
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+LUA_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(LUA_DIR, 'rllab'))
+sys.path.insert(0, BENCH_DIR)
+from bench_pool import bench, env_opts
+
+# of [xpos, xvel]; the cart swings within about 0.06 and 0.26 in RMS
+# under random forces
+RMS_TOLERANCE = (0.03, 0.1)
+PUMP_GAINS = [1., 0.85]
+STEPS_TOLERANCE = 0.2
+
+
+def make_envs(size, seed):
+    from envs.sp_mountain_car import SPMountainCarEnvs
+    from envs.vec_mountain_car import VecSPMountainCarEnv
+    opts = env_opts('SPMountainCar')
+    opts['nminds'] = 1
+    seeds = [seed + i for i in range(size)]
+    return SPMountainCarEnvs(opts, seeds), VecSPMountainCarEnv(opts, seeds)
+
+
+def run(env, policy, nsteps):
+    # [xpos, xvel] of every env at each step, nan once it is done, and the
+    # step it was done at
+    obs = env.reset()[0]
+    size = len(obs)
+    states = np.full((nsteps + 1, size, 2), np.nan)
+    states[0] = obs[:, :2]
+    steps = np.full(size, nsteps + 1)
+    idx = np.arange(size)
+    for t in range(nsteps):
+        if len(idx) == 0:
+            break
+        action = np.stack([policy(t, idx, obs[idx]), np.zeros(len(idx))], 1)
+        obs[idx], _, done, _ = env.step(action, idx)
+        states[t + 1, idx] = obs[idx, :2]
+        steps[idx[done]] = t + 1
+        idx = idx[~done]
+    return states, steps
+
+
+def check(size, horizon, seed):
+    ok = True
+    forces = np.random.RandomState(seed).uniform(-1, 1, (horizon, size))
+    res = [run(env, lambda t, idx, obs: forces[t, idx], horizon)[0]
+           for env in make_envs(size, seed)]
+    # steps after either env is done do not count
+    rms = np.sqrt(np.nanmean((res[0] - res[1]) ** 2, axis=(0, 1)))
+    good = np.all(rms <= RMS_TOLERANCE)
+    ok &= good
+    print('random forces, {} steps: rms |box2d - vec| of [xpos, xvel] '
+          '{:.3f} {:.3f} (tolerance {} {}): {}'.format(
+              horizon, rms[0], rms[1], RMS_TOLERANCE[0], RMS_TOLERANCE[1],
+              'ok' if good else 'FAILED'))
+    for gain in PUMP_GAINS:
+        res = [run(env, lambda t, idx, obs: gain * np.sign(obs[:, 1]), 1000)[1].mean()
+               for env in make_envs(size, seed)]
+        good = abs(res[1] - res[0]) <= STEPS_TOLERANCE * res[0]
+        ok &= good
+        print('force {} * sign(xvel): steps to the goal box2d {:.1f} vec {:.1f} '
+              '(tolerance {:.0%}): {}'.format(gain, res[0], res[1], STEPS_TOLERANCE,
+                                              'ok' if good else 'FAILED'))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, nargs='+', default=[16, 64, 256])
+    parser.add_argument('--nsteps', type=int, default=20000)
+    parser.add_argument('--horizon', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    for size in args.batch_size:
+        res = []
+        for env_name in ['SPMountainCar', 'SPMountainCarVec']:
+            try:
+                res.append(bench(env_name, 0, size, args.nsteps))
+            except ImportError as e:
+                print('{}: skipped, {}'.format(env_name, e))
+                res.append(None)
+        line = 'batch {:4d}: vec {:10.0f} steps/sec'.format(size, res[1])
+        if res[0] is not None:
+            line += ', box2d {:9.0f} steps/sec ({:.1f}x)'.format(res[0], res[1] / res[0])
+        print(line)
+
+    try:
+        check(max(args.batch_size), args.horizon, args.seed)
+    except ImportError as e:
+        print('check: skipped, {}'.format(e))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Env steps per second of rllab_worker against --rllab_pool size.
+
+Drives rllab_worker directly (no Lua, no ZMQ) with random actions, the way
+RllabBridge would: envs that are done become inactive and the batch is
+reset after max_steps or once every env is done. Needs rllab (and MuJoCo
+for SPSwimmerGather).
+
+    python3 benchmarks/bench_pool.py --env SPMountainCar --pool 0 1 2 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+LUA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, LUA_DIR)
+sys.path.insert(0, os.path.join(LUA_DIR, 'rllab'))
+
+
+# options of the experiments in README.md
+def env_opts(env_name):
+    opts = dict(
+        rllab_normalize_rllab=False, rllab_cont_action=True,
+        rllab_cont_limit=1, nminds=2, sp_mode='reverse', sp_test_rate=0.1,
+        sp_test_rate_bysteps=False, sp_reward_coeff=0.01,
+        sp_reward_bob_step=False, sp_loc_only=False, sp_test_max_steps=0)
+    if env_name in ('SPMountainCar', 'SPMountainCarVec'):
+        opts.update(rllab_in_dim=6, naction_heads=2, max_steps=500,
+                    sp_state_thres=0.2)
+    elif env_name == 'SPSwimmer':
+        opts.update(rllab_in_dim=13, naction_heads=2, max_steps=200,
+                    rllab_cont_limit=50, nminds=1)
+    elif env_name == 'SPSwimmerGather':
+        opts.update(rllab_in_dim=48, naction_heads=3, max_steps=200,
+                    rllab_cont_limit=50, sp_state_thres=0.3, sp_loc_only=True,
+                    sp_test_max_steps=166)
+    else:
+        raise RuntimeError("wrong env name")
+    return opts
+
+
+def random_action(opts, size):
+    limit = opts['rllab_cont_limit']
+    action = np.random.uniform(-limit, limit, (size, opts['naction_heads']))
+    if opts['nminds'] > 1:
+        # the last head switches between Alice and Bob
+        action[:, -1] = np.random.uniform(size=size) < 0.02
+    return action.astype('float32')
+
+
+def bench(env_name, pool, batch_size, nsteps):
+    import rllab_worker
+    opts = env_opts(env_name)
+    opts['rllab_pool'] = pool
+    rllab_worker.init(env_name, batch_size, opts, 1)
+    count = 0
+    t = time.time()
+    while count < nsteps:
+        rllab_worker.reset()
+        active = np.ones(batch_size, dtype='float32')
+        for _ in range(opts['max_steps']):
+            done = rllab_worker.step(random_action(opts, batch_size), active, 1)[2]
+            count += int(active.sum())
+            active[np.array(done)] = 0
+            if active.sum() == 0:
+                break
+        rllab_worker.finish_episode()
+    t = time.time() - t
+    if pool > 0:
+        rllab_worker.envs.close()
+    return count / t
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--env', nargs='+', default=['SPMountainCar', 'SPSwimmerGather'])
+    parser.add_argument('--pool', type=int, nargs='+', default=[0, 1, 2, 4, 8])
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--nsteps', type=int, default=20000)
+    args = parser.parse_args()
+    for env_name in args.env:
+        base = None
+        for pool in args.pool:
+            sps = bench(env_name, pool, args.batch_size, args.nsteps)
+            base = base or sps
+            print('{:16s} pool {:2d}: {:9.0f} steps/sec ({:.2f}x)'.format(
+                env_name, pool, sps, sps / base))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Time Lua waits for the reset of rllab_worker with and without
+--rllab_prereset.
+
+Drives rllab_worker directly with random actions as bench_pool.py does,
+and sleeps --train_ms after each finished episode, for the backward pass
+and update of Lua during which the background reset runs. Shown are the
+time of the reset command and of a whole episode, training included.
+Needs rllab (and MuJoCo for SPSwimmerGather).
+
+    python3 benchmarks/bench_prereset.py --env SPSwimmerGather --train_ms 50
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+from bench_pool import env_opts, random_action
+
+
+def bench(env_name, prereset, pool, batch_size, episodes, train_ms):
+    import rllab_worker
+    opts = env_opts(env_name)
+    opts.update(rllab_pool=pool, rllab_prereset=prereset)
+    rllab_worker.init(env_name, batch_size, opts, 1)
+    t_reset = 0
+    t = time.time()
+    for _ in range(episodes):
+        start = time.time()
+        rllab_worker.reset()
+        t_reset += time.time() - start
+        active = np.ones(batch_size, dtype='float32')
+        for _ in range(opts['max_steps']):
+            done = rllab_worker.step(random_action(opts, batch_size), active, 1)[2]
+            active[np.array(done)] = 0
+            if active.sum() == 0:
+                break
+        rllab_worker.finish_episode()
+        time.sleep(train_ms / 1e3)
+    t = time.time() - t
+    return t_reset / episodes, t / episodes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--env', nargs='+', default=['SPMountainCar', 'SPSwimmerGather'])
+    parser.add_argument('--pool', type=int, default=0)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--episodes', type=int, default=20)
+    parser.add_argument('--train_ms', type=float, default=50)
+    args = parser.parse_args()
+    for env_name in args.env:
+        for prereset in [False, True]:
+            t_reset, t_episode = bench(env_name, prereset, args.pool, args.batch_size,
+                                       args.episodes, args.train_ms)
+            print('{:16s} prereset {:d}: reset {:8.2f} ms, episode {:8.1f} ms'.format(
+                env_name, prereset, t_reset * 1e3, t_episode * 1e3))
+
+
+if __name__ == '__main__':
+    main()
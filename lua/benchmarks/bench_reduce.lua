@@ -0,0 +1,114 @@
+-- Time to average the gradients of nworker threads into the main thread,
+-- as Trainer:train does between batches, with --grad_reduce main (each
+-- thread's gradients added by the main thread) and shard (reduce_shard in
+-- every thread). Gradients are random tensors shaped like the parameters
+-- of an MLP, and jobs return at once, so the times are the turnaround of
+-- a batch without its episodes. Run from lua/:
+--
+--     th benchmarks/bench_reduce.lua -nworker 2,4,8,16,32 -hidsz 256
+
+require 'torch'
+paths.dofile('../util.lua')
+local threads = require('threads')
+threads.Threads.serialization('threads.sharedserialize')
+
+local cmd = torch.CmdLine()
+cmd:option('-nworker', '2,4,8,16', 'comma separated thread counts')
+cmd:option('-in_dim', 48)
+cmd:option('-hidsz', 50)
+cmd:option('-nlayers', 2)
+cmd:option('-nactions', 9)
+cmd:option('-iters', 50)
+local opts = cmd:parse(arg or {})
+
+local function params()
+    local sizes = {}
+    local d = opts.in_dim
+    for l = 1, opts.nlayers do
+        table.insert(sizes, {opts.hidsz, d})
+        table.insert(sizes, {opts.hidsz})
+        d = opts.hidsz
+    end
+    table.insert(sizes, {opts.nactions, d})
+    table.insert(sizes, {opts.nactions})
+    local p = {}
+    for i, sz in ipairs(sizes) do
+        p[i] = torch.FloatTensor(torch.LongStorage(sz)):normal()
+    end
+    return p
+end
+
+local function squared_norm(params)
+    local sq = 0
+    for _, x in pairs(params) do
+        sq = sq + x:dot(x)
+    end
+    return sq
+end
+
+local function bench(n)
+    local pool = threads.Threads(n, function()
+        require 'torch'
+        dofile('util.lua')
+    end)
+    pool:specific(true)
+    for w = 1, n do
+        pool:addjob(w, function(p) g_grads = p end, function() end, params())
+    end
+    pool:synchronize()
+    local out = params()
+
+    local function gather(f)
+        for w = 1, n do
+            pool:addjob(w, function() return g_grads end, function(g) f(w, g) end)
+        end
+        pool:synchronize()
+    end
+
+    local function main()
+        for i = 1, #out do out[i]:zero() end
+        gather(function(w, g)
+            for i = 1, #g do out[i]:add(g[i]) end
+        end)
+        for i = 1, #out do out[i]:div(n) end
+        return squared_norm(out)
+    end
+
+    local function shard()
+        local grads = {}
+        gather(function(w, g) grads[w] = g end)
+        local sq = 0
+        for w = 1, n do
+            pool:addjob(w,
+                function(grads, out, w, n) return reduce_shard(grads, out, w, n) end,
+                function(s) sq = sq + s end,
+                grads, out, w, n)
+        end
+        pool:synchronize()
+        return sq
+    end
+
+    local res = {}
+    local ref
+    for _, mode in ipairs{'main', 'shard'} do
+        local f = mode == 'main' and main or shard
+        f()
+        local timer = torch.Timer()
+        for _ = 1, opts.iters do f() end
+        res[mode] = timer:time().real / opts.iters * 1e3
+        ref = ref or out[1]:clone()
+        res[mode .. '_diff'] = (out[1] - ref):abs():max()
+    end
+    pool:terminate()
+    return res
+end
+
+local nparams = 0
+for _, x in pairs(params()) do nparams = nparams + x:nElement() end
+print(string.format('%d parameters', nparams))
+for s in string.gmatch(opts.nworker, '%d+') do
+    local n = tonumber(s)
+    local r = bench(n)
+    print(string.format('nworker %3d  main %8.3f ms  shard %8.3f ms  (%.2fx, max diff %.1e)',
+        n, r.main, r.shard, r.main / r.shard, r.shard_diff))
+end
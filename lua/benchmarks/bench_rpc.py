@@ -0,0 +1,124 @@
+"""Per-step overhead of the bridge protocols.
+
+Runs worker.py in a subprocess and drives it from a python REQ socket that
+sends exactly the bytes bridge.lua would send for RllabBridge:batch_act,
+once through the old e/x protocol (one x round trip per keyword argument
+followed by eval) and once through bridge.call. The env step itself is a
+cheap synthetic one so that only the protocol overhead is measured.
+
+    python3 benchmarks/bench_rpc.py --batch_size 16 --obs_dim 48
+"""
+import argparse
+import os
+import struct
+import subprocess
+import sys
+import time
+
+import numpy as np
+import zmq
+
+LUA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, LUA_DIR)
+import rpc
+from rpc import command
+
+
+# synthetic env with the same call signature and result layout as rllab_worker
+@command
+def init(size, obs_dim):
+    global obs, reward, done, mind
+    obs = np.random.randn(int(size), int(obs_dim)).astype('float32')
+    reward = np.zeros(int(size))
+    done = np.zeros(int(size), dtype='bool')
+    mind = np.ones(int(size), dtype='int64')
+
+@command
+def step(action, active, steps):
+    return (obs, reward, done, mind)
+
+
+def lua_serialize(x):
+    # mirrors serialize() in bridge.lua
+    if isinstance(x, np.ndarray):
+        data = struct.pack('q', x.ndim)
+        for d in x.shape:
+            data += struct.pack('q', d)
+        data += struct.pack('q', x.size) + x.astype('double').tobytes() + b'\0'
+        return b'TENSOR_BYTES' + struct.pack('q', len(data)) + data
+    return str(x).encode()
+
+
+def old_step(conn, action, active, steps):
+    for k, v in [('action', action), ('active', active), ('steps', steps)]:
+        conn.send(b'x' + k.encode() + b'=' + lua_serialize(v))
+        conn.recv()
+    conn.send(b'estep(action, active, steps)')
+    return conn.recv()
+
+
+def call(conn, *args):
+    frames = rpc.encode(list(args))
+    frames[0] = b'c' + frames[0]
+    conn.send_multipart(frames)
+    return conn.recv_multipart()
+
+
+def new_step(conn, action, active, steps):
+    return call(conn, 'step', action, active, steps)
+
+
+def timeit(f, n):
+    f()
+    t = time.time()
+    for _ in range(n):
+        f()
+    return (time.time() - t) / n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--obs_dim', type=int, default=48)
+    parser.add_argument('--naction_heads', type=int, default=3)
+    parser.add_argument('--iters', type=int, default=1000)
+    args = parser.parse_args()
+
+    context = zmq.Context()
+    probe = context.socket(zmq.REP)
+    port = probe.bind_to_random_port('tcp://127.0.0.1')
+    probe.close()
+    server = subprocess.Popen([sys.executable, 'worker.py', str(port)],
+                              cwd=LUA_DIR, stdout=subprocess.DEVNULL)
+    conn = context.socket(zmq.REQ)
+    conn.connect('tcp://localhost:{}'.format(port))
+    try:
+        conn.send(b'a')
+        assert conn.recv() == b'connected'
+        conn.send('ximport sys; sys.path.append({!r})'.format(
+            os.path.dirname(os.path.abspath(__file__))).encode())
+        conn.recv()
+        conn.send(b'xfrom bench_rpc import *')
+        conn.recv()
+        call(conn, 'init', args.batch_size, args.obs_dim)
+
+        action = np.random.randn(args.batch_size, args.naction_heads)
+        active = np.ones(args.batch_size, dtype='float32')
+        old_bytes = len(old_step(conn, action, active, 1))
+        new_bytes = sum(len(f) for f in new_step(conn, action, active, 1))
+        t_old = timeit(lambda: old_step(conn, action, active, 1), args.iters)
+        t_new = timeit(lambda: new_step(conn, action, active, 1), args.iters)
+    finally:
+        server.kill()
+        server.wait()
+
+    print('batch_size {} obs_dim {}'.format(args.batch_size, args.obs_dim))
+    print('e/x protocol : {:8.1f} us/step'.format(t_old * 1e6))
+    print('bridge.call  : {:8.1f} us/step'.format(t_new * 1e6))
+    print('saved        : {:8.1f} us/step ({:.1f}x)'.format(
+        (t_old - t_new) * 1e6, t_old / t_new))
+    print('reply size   : {} -> {} bytes'.format(old_bytes, new_bytes))
+
+
+if __name__ == '__main__':
+    main()
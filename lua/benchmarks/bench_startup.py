@@ -0,0 +1,168 @@
+"""Time to the first env step of --nworker Lua threads, and where the
+import time of an env worker goes.
+
+Starts the env workers the way bridge.lua does, one worker.py per thread
+(cold) or one env_server.py for all of them (shared, --rllab_shared_server),
+and takes every client from connecting to its first step, as RllabBridge
+would: import rllab_worker, init, reset and step. 'warm' is the shared
+server as Trainer meets it: the client of the main thread has taken its
+first step, so the env modules are imported, and the --nworker clients of
+the threads arrive together and are timed. The server keeps --spares
+shards forked ahead. The import profile is `python3 -X importtime` of
+rllab_worker and the env, summed by top-level package.
+
+    python3 benchmarks/bench_startup.py --env SPSwimmerGather --nworker 16
+    python3 benchmarks/bench_startup.py --modes warm --spares 1 16
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import zmq
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+LUA_DIR = os.path.dirname(BENCH_DIR)
+RLLAB_DIR = os.path.join(LUA_DIR, 'rllab')
+sys.path.insert(0, LUA_DIR)
+sys.path.insert(0, BENCH_DIR)
+import rpc
+from bench_pool import env_opts, random_action
+
+
+def import_profile(env_name, top):
+    code = ('import sys; sys.path[:0] = [{!r}, {!r}]; import rllab_worker; '
+            'rllab_worker.env_class({!r})').format(LUA_DIR, RLLAB_DIR, env_name)
+    t = time.time()
+    p = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                       cwd=LUA_DIR, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.PIPE, universal_newlines=True)
+    wall = time.time() - t
+    packages = {}
+    error = None
+    for line in p.stderr.splitlines():
+        m = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)', line)
+        if m:
+            package = m.group(4).split('.')[0]
+            packages[package] = packages.get(package, 0) + int(m.group(1))
+        elif line.strip():
+            error = line.strip()
+    print('import of rllab_worker and {}: {:.2f}s{}'.format(
+        env_name, wall, '' if p.returncode == 0 else ', failed: ' + str(error)))
+    for package, us in sorted(packages.items(), key=lambda x: -x[1])[:top]:
+        print('  {:<24} {:8.3f}s'.format(package, us / 1e6))
+
+
+def start(mode, nworker, env_name, spares, context, procs):
+    # the endpoints of the clients, as bridge.start / bridge.connect
+    def endpoint():
+        fd, path = tempfile.mkstemp(suffix='.ipc')
+        os.close(fd)
+        os.remove(path)
+        return 'ipc://' + path
+    if mode in ('shared', 'warm'):
+        endpoints = [endpoint()] * nworker
+        cmds = [['env_server.py', endpoints[0], '--spares', str(spares), env_name]]
+    else:
+        endpoints = [endpoint() for _ in range(nworker)]
+        cmds = [['worker.py', e] for e in endpoints]
+    for cmd in cmds:
+        procs.append(subprocess.Popen([sys.executable] + cmd, cwd=LUA_DIR,
+                                      stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL))
+    conns = []
+    for e in endpoints:
+        conn = context.socket(zmq.REQ)
+        conn.connect(e)
+        conns.append(conn)
+    return conns
+
+
+def rpc_call(*args):
+    # the frames of bridge.call(...)
+    frames = rpc.encode(list(args))
+    frames[0] = b'c' + frames[0]
+    return frames
+
+
+def run_stages(conns, stages, times, t):
+    # the stages of all clients, each sent to all before receiving from any
+    for name, requests in stages:
+        for msg in requests:
+            for c in conns:
+                c.send_multipart(msg if isinstance(msg, list) else [msg])
+            replies = [c.recv_multipart() for c in conns]
+        times[name] = time.time() - t
+        if name in ('reset', 'step') and any(
+                rpc.decode(r) is None for r in replies):
+            times['error'] = name + ' failed, is rllab installed?'
+            break
+
+
+def first_step(mode, spares, args):
+    # seconds from starting the processes, or from the first step of the
+    # main thread when warm, until each stage is done for every client,
+    # stages of all clients run concurrently
+    opts = env_opts(args.env)
+    context = zmq.Context()
+    procs = []
+    times = {}
+    t = time.time()
+    try:
+        nclient = args.nworker + (mode == 'warm')
+        conns = start(mode, nclient, args.env, spares, context, procs)
+        action = random_action(opts, args.batch_size)
+        stages = [
+            ('connect', [b'a']),
+            ('import', [
+                'ximport sys; sys.path.append({!r})'.format(RLLAB_DIR).encode(),
+                b'xfrom rllab_worker import *']),
+            ('init', [rpc_call('init', args.env, args.batch_size, opts, 1)]),
+            ('reset', [rpc_call('reset')]),
+            ('step', [rpc_call('step', action, np.ones(args.batch_size), 1)]),
+        ]
+        if mode == 'warm':
+            run_stages(conns[:1], stages, {}, t)
+            t = time.time()
+        run_stages(conns[mode == 'warm':], stages, times, t)
+        for c in conns:
+            c.close(linger=0)
+    finally:
+        for p in procs:
+            p.kill()
+            p.wait()
+        context.term()
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--env', default='SPSwimmerGather')
+    parser.add_argument('--nworker', type=int, default=16)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--modes', nargs='+', default=['cold', 'shared'],
+                        choices=['cold', 'shared', 'warm'])
+    parser.add_argument('--spares', type=int, nargs='+', default=[1],
+                        help='spare shards of the server, each is run')
+    parser.add_argument('--top', type=int, default=10,
+                        help='packages shown in the import profile')
+    args = parser.parse_args()
+
+    import_profile(args.env, args.top)
+    for mode in args.modes:
+        for spares in (args.spares if mode != 'cold' else [0]):
+            times = first_step(mode, spares, args)
+            error = times.pop('error', None)
+            print('{:<7} {} workers{}: {}{}'.format(
+                mode, args.nworker, ', {} spares'.format(spares) if spares else '',
+                ', '.join('{} {:.3f}s'.format(k, v)
+                          for k, v in sorted(times.items(), key=lambda x: x[1])),
+                ', ' + error if error else ''))
+
+
+if __name__ == '__main__':
+    main()
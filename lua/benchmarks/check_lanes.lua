@@ -0,0 +1,96 @@
+-- Checks that --rllab_pipeline gives the same episodes as the sequential
+-- path. A Worker is built with and without lanes from the same torch seed,
+-- so both have the same parameters and env seeds, and each runs episodes
+-- from the same seed. Rewards, stats and the gradients of the model must
+-- be equal, gradients up to rounding. Each Worker starts its own
+-- rllab_worker. Runs SPMountainCarVec, which needs numpy only. Run from
+-- lua/:
+--
+--     th benchmarks/check_lanes.lua -nminds 2 -episodes 3
+
+require 'torch'
+require 'sys'
+paths.dofile('../util.lua')
+paths.dofile('../Worker.lua')
+
+local cmd = torch.CmdLine()
+cmd:option('-batch_size', 8)
+cmd:option('-episodes', 3)
+cmd:option('-max_steps', 50)
+cmd:option('-hidsz', 50)
+cmd:option('-nlayers', 2)
+cmd:option('-nminds', 2)
+cmd:option('-nactions', 5, 'of the first head, which moves the car')
+cmd:option('-sp_mode', 'repeat')
+cmd:option('-seed', 1)
+local args = cmd:parse(arg or {})
+
+local function make_opts(pipeline)
+    local opts = {
+        hidsz = args.hidsz, nonlin = 'tanh', init_std = 0.2, init_hid = 0.1,
+        encoder_lut = false, recurrent = false, nlayers = args.nlayers,
+        nagents = 1, coop = false, max_steps = args.max_steps, max_info = 0,
+        mode = 'pg', ac_freq = 1, optim = 'rmsprop', lrate = 3e-3, alpha = 0.1,
+        batch_size = args.batch_size, entropy_reg = 0, constant_baseline = -1,
+        momentum = 0, wdecay = 0, rmsprop_alpha = 0.97, rmsprop_eps = 1e-6,
+        rllab = true, rllab_env = 'SPMountainCarVec', rllab_in_dim = 6,
+        rllab_reward_coeff = 1, rllab_steps = 1, rllab_cont_action = true,
+        rllab_cont_limit = 1, rllab_normalize = false,
+        rllab_normalize_rllab = false, rllab_save_image = '',
+        rllab_transport = 'ipc', rllab_pool = 0, rllab_pipeline = pipeline,
+        rllab_rollout = false, rllab_prereset = false,
+        rllab_shared_server = false, rllab_record = '',
+        rllab_record_episodes = 1000, rllab_profile = false, sc = false,
+        show = false, hand = false, debug = false, plot = false,
+        nminds = args.nminds, mind_reward_separate = false,
+        minds_share_enc = false, mind_target = false,
+        sp_mode = args.sp_mode, sp_test_rate = 0.1,
+        sp_test_rate_bysteps = false, sp_test_entr_zero = false,
+        sp_reward_bob_step = false, sp_state_thres = 0.2,
+        sp_reward_coeff = 0.01, sp_loc_only = false, sp_test_max_steps = 0,
+    }
+    -- a head moving the car and Alice's switch, as in main.lua
+    opts.nactions = 0
+    opts.naction_heads = 2
+    opts.action_names = {'action1', 'action2'}
+    opts.nactions_byname = {action1 = args.nactions, action2 = 2}
+    return opts
+end
+
+local function run(pipeline)
+    torch.manualSeed(args.seed)
+    local worker = Worker(make_opts(pipeline))
+    local res = {}
+    for ep = 1, args.episodes do
+        torch.manualSeed(args.seed + ep)
+        local stat = worker:run_episode()
+        local grads = {}
+        for i, dx in ipairs(worker.agent.paramdx) do
+            grads[i] = dx:clone()
+        end
+        res[ep] = {stat = stat, grads = grads}
+    end
+    return res
+end
+
+local seq, lanes = run(false), run(true)
+local errors = 0
+for ep = 1, args.episodes do
+    local a, b = seq[ep], lanes[ep]
+    for k, v in pairs(a.stat) do
+        if type(v) == 'number' and math.abs(v - (b.stat[k] or 0)) > 1e-6 then
+            print(string.format('episode %d: stat %s %g vs %g', ep, k, v, b.stat[k] or 0))
+            errors = errors + 1
+        end
+    end
+    for i = 1, #a.grads do
+        -- the lanes sum the gradient of the batch in another order
+        local d = (a.grads[i] - b.grads[i]):abs():max() / (a.grads[i]:abs():max() + 1e-8)
+        if d > 1e-5 then
+            print(string.format('episode %d: gradient %d differs by %g (relative)', ep, i, d))
+            errors = errors + 1
+        end
+    end
+end
+print(string.format('%d episodes of %d envs, nminds %d: %s', args.episodes,
+    args.batch_size, args.nminds, errors == 0 and 'same' or errors .. ' differences'))
@@ -0,0 +1,223 @@
+-- Checks the numpy SPLightKey games of --maze_vec (games/vec_lightkey.py)
+-- against the Lua games. Every episode a batch of Lua games is made and
+-- their layouts are loaded into the numpy games, then both take the same
+-- random actions, and observations, active games, minds, rewards,
+-- terminal rewards, success and stats are compared. Observations with
+-- -encoder_lut are compared as sorted rows, since words of a cell come in
+-- another order. Random Alice, swamps and the switch of compete mode draw
+-- from torch in the Lua games, so the actions of a random Alice and the
+-- torch.uniform draws of every Lua game are recorded at each step and the
+-- numpy games replay them. The time of a step of the batch is shown for
+-- both. Run from lua/, in every mode, with random Alice and swamps:
+--
+--     th benchmarks/check_lightkey.lua -sp_mode repeat -encoder_lut
+--     th benchmarks/check_lightkey.lua -sp_mode reverse -sp_rand_alice 1 -nswamp 3
+--     th benchmarks/check_lightkey.lua -sp_mode repeat -sp_rand_alice 1 -nswamp 3
+--     th benchmarks/check_lightkey.lua -sp_mode compete -nswamp 3
+
+require 'torch'
+paths.dofile('../util.lua')
+local game_util = paths.dofile('../games/init.lua')
+paths.dofile('../games/VecMazeBridge.lua')
+
+local cmd = torch.CmdLine()
+cmd:option('-games_config_path', 'games/config/sp_lightkey.lua')
+cmd:option('-batch_size', 32)
+cmd:option('-episodes', 20)
+cmd:option('-max_steps', 30)
+cmd:option('-visibility', 1)
+cmd:option('-encoder_lut', false)
+cmd:option('-encoder_lut_size', 50)
+cmd:option('-sp_mode', 'reverse', 'reverse | repeat | compete')
+cmd:option('-sp_test_rate', 0.2)
+cmd:option('-sp_reward_bob_step', false)
+cmd:option('-sp_rand_alice', 0, '1=randomize actions of alice')
+cmd:option('-nswamp', 0, 'swamps of a game')
+cmd:option('-nminds', 2)
+cmd:option('-stop_prob', 0.05, 'probability of the stop action')
+cmd:option('-seed', 1)
+local opts = cmd:parse(arg or {})
+opts.game = ''
+opts.nagents = 1
+opts.nactions = 6
+opts.max_info = 0
+opts.rllab_transport = 'ipc'
+torch.manualSeed(opts.seed)
+
+local vocab, ivocab = game_util.init_vocab()
+opts.nwords = #ivocab
+-- as Agent:build_encoder
+opts.encoder_lut_nil = ((2 * opts.visibility + 1)^2 + opts.max_info) * opts.nwords + 1
+local factory = game_util.init_factory(opts, vocab)
+factory.helpers.SPLightKey.nswamp = opts.nswamp
+local maze = MazeBridge(factory, opts)
+local vec = VecMazeBridge(factory, opts, vocab, ivocab)
+
+-- the game acting and, for the step, the action a random Alice takes and
+-- the torch.uniform draw of each Lua game (2 for none, never below a
+-- probability)
+local current
+local alice_actions = torch.zeros(opts.batch_size)
+local draws = torch.Tensor(opts.batch_size)
+local ndraws = torch.zeros(opts.batch_size)
+local uniform = torch.uniform
+torch.uniform = function(...)
+    local u = uniform(...)
+    if current then
+        draws[current] = u
+        ndraws[current] = ndraws[current] + 1
+    end
+    return u
+end
+
+local function record(g, i)
+    local act = g.act
+    g.act = function(self, ...)
+        current = i
+        act(self, ...)
+        current = nil
+    end
+    local act_orig = g.agent.act_orig
+    g.agent.act_orig = function(self, action_id)
+        alice_actions[i] = action_id
+        act_orig(self, action_id)
+    end
+end
+
+local function layout(g)
+    -- what VecSPLightKey.load takes, 1-based
+    local l = {height = g.map.height, width = g.map.width,
+        test_mode = g.test_mode, corners = g.enable_corners == 1,
+        blocks = {}, water = {}, swamps = {},
+        agent = {g.agent.loc.y, g.agent.loc.x},
+        rand_switch_t = g.agent.rand_switch_t}
+    for _, e in pairs(g.items) do
+        local loc = e.loc and {e.loc.y, e.loc.x}
+        if e.type == 'block' then
+            table.insert(l.blocks, loc)
+        elseif e.type == 'water' then
+            table.insert(l.water, loc)
+        elseif e.type == 'swamp' then
+            table.insert(l.swamps, loc)
+        elseif e.type == 'goal' then
+            l.goal = loc
+        elseif e.type == 'door' then
+            l.door = loc
+        end
+    end
+    for _, key in pairs{'switch', 'lamp'} do
+        local e = g[key]
+        if e then
+            l[key] = {e.loc.y, e.loc.x, e.attr._c}
+        end
+    end
+    return l
+end
+
+local errors = {}
+local shown = 0
+local function check(name, ep, t, i, a, b, batch)
+    if a ~= b then
+        errors[name] = (errors[name] or 0) + 1
+        if shown < 5 then
+            shown = shown + 1
+            print(string.format('%s differs in episode %d, step %d, game %d: %s vs %s',
+                name, ep, t, i, tostring(a), tostring(b)))
+            if batch then
+                batch[i].map:print_ascii()
+            end
+        end
+    end
+end
+
+local function same_rows(a, b)
+    if opts.encoder_lut then
+        a, b = a:sort(), b:sort()
+    end
+    return a:equal(b)
+end
+
+local stat_keys = {'test_task_count', 'self_play_count', 'switch_t',
+    'switch_dist', 'lock', 'lamp', 'door_cross', 'swamp'}
+local probs = torch.ones(opts.nactions)
+probs[5] = opts.stop_prob * (opts.nactions - 1) / (1 - opts.stop_prob)
+local time_lua, time_vec, steps = 0, 0, 0
+
+for ep = 1, opts.episodes do
+    local batch = maze:batch_init(opts.batch_size)
+    local layouts = {}
+    for i, g in pairs(batch) do
+        layouts[i] = layout(g)
+        record(g, i)
+    end
+    local vbatch = vec:batch_init(opts.batch_size, layouts)
+    for t = 1, opts.max_steps do
+        local timer = torch.Timer()
+        local obs = maze:batch_input(batch)
+        local active = maze:batch_active(batch)
+        time_lua = time_lua + timer:time().real
+        local vobs = vec:batch_input(vbatch):typeAs(obs)
+        local vactive = vec:batch_active(vbatch)
+        for i = 1, opts.batch_size do
+            check('obs', ep, t, i, same_rows(obs[i]:clone(), vobs[i]:clone()), true, batch)
+            check('active', ep, t, i, active[i], vactive[i])
+            check('mind', ep, t, i, batch[i].current_mind, vbatch[i].current_mind)
+        end
+        if active:sum() == 0 then break end
+
+        local action = torch.multinomial(probs, opts.batch_size, true):view(-1, 1)
+        alice_actions:zero()
+        draws:fill(2)
+        ndraws:zero()
+        timer:reset()
+        maze:batch_act(batch, action, active)
+        maze:batch_update(batch, active)
+        local reward = maze:batch_reward(batch, active)
+        time_lua = time_lua + timer:time().real
+        for i = 1, opts.batch_size do
+            check('draws', ep, t, i, ndraws[i] <= 1, true)
+        end
+        vec:replay(alice_actions, draws)
+        timer:reset()
+        vec:batch_act(vbatch, action, active)
+        local vreward = vec:batch_reward(vbatch, active)
+        time_vec = time_vec + timer:time().real
+        steps = steps + 1
+        for i = 1, opts.batch_size do
+            check('reward', ep, t, i, reward[i], vreward[i])
+        end
+    end
+
+    local reward = maze:batch_terminal_reward(batch)
+    local vreward = vec:batch_terminal_reward(vbatch)
+    local success = maze:batch_success(batch)
+    local vsuccess = vec:batch_success(vbatch)
+    for i, g in pairs(batch) do
+        local vg = vbatch[i]
+        check('terminal reward', ep, 0, i, reward[i], vreward[i])
+        check('success', ep, 0, i, success[i], vsuccess[i])
+        check('type', ep, 0, i, g.type, vg.type)
+        for m = 1, math.max(2, opts.nminds) do
+            check('terminal reward mind' .. m, ep, 0, i,
+                g:get_terminal_reward_mind(m), vg:get_terminal_reward_mind(m))
+        end
+        for _, k in pairs(stat_keys) do
+            check('stat ' .. k, ep, 0, i, g.stat[k], vg.stat[k])
+        end
+        check('stat alice_actions', ep, 0, i,
+            g.stat.alice_actions:float():equal(vg.stat.alice_actions:float()), true)
+    end
+end
+
+print(string.format('%d episodes of %d games, sp_mode %s, encoder_lut %s, sp_rand_alice %d, nswamp %d',
+    opts.episodes, opts.batch_size, opts.sp_mode, tostring(opts.encoder_lut),
+    opts.sp_rand_alice, opts.nswamp))
+if next(errors) then
+    for k, n in pairs(errors) do
+        print(string.format('  %s: %d differences', k, n))
+    end
+else
+    print('  no differences')
+end
+print(string.format('step of the batch: lua %.3f ms, numpy %.3f ms (with the round trip)',
+    time_lua / steps * 1e3, time_vec / steps * 1e3))
@@ -0,0 +1,211 @@
+"""Benchmarks of the python half of the system, as JSON.
+
+Runs without Lua or a GPU and covers
+  codec     worker.serialize / parseTensors (the e/x protocol) and
+            rpc.encode / rpc.decode (bridge.call) over tensor sizes and
+            counts, in MB/s of tensor data
+  listener  round trips to worker.py in a subprocess from a python REQ
+            socket standing in for bridge.lua, over tcp and ipc
+  envs      reset, step and get_stat throughput of the self-play envs
+            through rllab_worker, with random actions
+
+Env benchmarks that cannot run (rllab or MuJoCo missing) are reported
+with an "error" instead of numbers. Results go to stdout, and to --out
+if given, so runs can be compared across changes.
+
+    python3 benchmarks/suite.py --out bench.json
+    python3 benchmarks/suite.py --only codec listener
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import zmq
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+LUA_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, LUA_DIR)
+sys.path.insert(0, os.path.join(LUA_DIR, 'rllab'))
+sys.path.insert(0, BENCH_DIR)
+import rpc
+from rpc import command
+from bench_rpc import lua_serialize, call
+from bench_pool import env_opts, random_action
+
+ENVS = ['SPMountainCar', 'SPSwimmer', 'SPSwimmerGather']
+
+
+# served by the listener benchmark
+@command
+def echo(*args):
+    return args
+
+
+def rate(f, min_time):
+    # calls per second of f, running it for at least min_time seconds
+    f()
+    n = 0
+    t = time.time()
+    while True:
+        f()
+        n += 1
+        elapsed = time.time() - t
+        if elapsed >= min_time:
+            return n / elapsed
+
+
+def bench_codec(args):
+    # imported here, as the listener benchmark imports this module into the
+    # worker.py process where worker is __main__
+    import worker
+    results = []
+    for size in args.sizes:
+        for count in args.counts:
+            tensors = [np.random.randn(size) for _ in range(count)]
+            mb = 8. * size * count / 1e6
+            lua_msg = b'{' + b','.join(lua_serialize(t) for t in tensors) + b'}'
+            frames = rpc.encode(tensors)
+            frames = [frames[0]] + [f.tobytes() for f in frames[1:]]
+            res = dict(size=size, count=count)
+            res['serialize'] = mb * rate(
+                lambda: worker.serialize(tensors), args.min_time)
+            res['parseTensors'] = mb * rate(
+                lambda: worker.parseTensors(lua_msg), args.min_time)
+            res['rpc.encode'] = mb * rate(
+                lambda: rpc.encode(tensors), args.min_time)
+            res['rpc.decode'] = mb * rate(
+                lambda: rpc.decode(frames), args.min_time)
+            results.append(res)
+    return results
+
+
+def bench_listener(args):
+    results = []
+    for transport in args.transports:
+        for res in bench_transport(transport, args):
+            res['transport'] = transport
+            results.append(res)
+    return results
+
+
+def bench_transport(transport, args):
+    # connects the way bridge.init does for the transport
+    context = zmq.Context()
+    if transport == 'tcp':
+        probe = context.socket(zmq.REP)
+        port = probe.bind_to_random_port('tcp://127.0.0.1')
+        probe.close()
+        address = str(port)
+        endpoint = 'tcp://localhost:{}'.format(port)
+    else:
+        fd, path = tempfile.mkstemp(suffix='.ipc')
+        os.close(fd)
+        os.remove(path)
+        address = endpoint = 'ipc://' + path
+    server = subprocess.Popen([sys.executable, 'worker.py', address],
+                              cwd=LUA_DIR, stdout=subprocess.DEVNULL)
+    conn = context.socket(zmq.REQ)
+    conn.connect(endpoint)
+
+    def send(msg):
+        conn.send(msg)
+        return conn.recv()
+
+    results = []
+    try:
+        assert send(b'a') == b'connected'
+        send('ximport sys; sys.path.append({!r})'.format(BENCH_DIR).encode())
+        send(b'xfrom suite import echo')
+        results.append(dict(command='ping', us=1e6 / rate(
+            lambda: send(b'a'), args.min_time)))
+        results.append(dict(command='eval', us=1e6 / rate(
+            lambda: send(b'e1'), args.min_time)))
+        for size in args.sizes:
+            x = np.random.randn(size)
+            lua_x = lua_serialize(x)
+            results.append(dict(command='eval echo', size=size, us=1e6 / rate(
+                lambda: (send(b'xx=' + lua_x), send(b'ex')), args.min_time)))
+            results.append(dict(command='call echo', size=size, us=1e6 / rate(
+                lambda: call(conn, 'echo', x), args.min_time)))
+    finally:
+        server.kill()
+        server.wait()
+        conn.close()
+        context.term()
+        if transport == 'ipc' and os.path.exists(path):
+            os.remove(path)
+    return results
+
+
+def bench_env(env_name, args):
+    import rllab_worker
+    opts = env_opts(env_name)
+    opts['rllab_pool'] = 0
+    size = args.batch_size
+    res = dict(env=env_name, batch_size=size)
+    t = time.time()
+    rllab_worker.init(env_name, size, opts, 1)
+    res['init_sec'] = time.time() - t
+    res['reset_per_sec'] = size * rate(rllab_worker.reset, args.min_time)
+    active = np.ones(size, dtype='float32')
+
+    def step():
+        rllab_worker.step(random_action(opts, size), active, 1)
+    rllab_worker.reset()
+    res['step_per_sec'] = size * rate(step, args.min_time)
+    res['get_stat_per_sec'] = size * rate(rllab_worker.get_stat, args.min_time)
+    return res
+
+
+def bench_envs(args):
+    results = []
+    for env_name in args.envs:
+        try:
+            results.append(bench_env(env_name, args))
+        except Exception as e:
+            results.append(dict(env=env_name, error='{}: {}'.format(type(e).__name__, e)))
+    return results
+
+
+BENCHMARKS = dict(codec=bench_codec, listener=bench_listener, envs=bench_envs)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--only', nargs='+', default=sorted(BENCHMARKS),
+                        choices=sorted(BENCHMARKS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[16, 1024, 65536])
+    parser.add_argument('--counts', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--transports', nargs='+', default=['tcp', 'ipc'],
+                        choices=['tcp', 'ipc'])
+    parser.add_argument('--envs', nargs='+', default=ENVS)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--min_time', type=float, default=0.5,
+                        help='seconds each measurement runs for')
+    parser.add_argument('--out', default='')
+    args = parser.parse_args()
+
+    report = dict(
+        time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        host=platform.node(),
+        python=platform.python_version(),
+        numpy=np.__version__,
+        zmq=zmq.zmq_version(),
+        args=vars(args))
+    for name in args.only:
+        report[name] = BENCHMARKS[name](args)
+    out = json.dumps(report, indent=2, sort_keys=True)
+    print(out)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(out + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,7 @@ local stringx = require('pl.stringx')
 local bridge = {}
 
 local zmq = require('lzmq')
+local ffi = require('ffi')
 
 
 local function byte2tensor(bytes)
@@ -83,6 +84,127 @@ local function serialize(arg)
   end
 end
 
+-- Typed binary encoding used by bridge.call, see rpc.py for the layout.
+-- buf collects the header, tensor data goes to frames as raw bytes of
+-- its own type.
+local tensor_codes = {
+  ['torch.FloatTensor'] = 'f',
+  ['torch.DoubleTensor'] = 'd',
+  ['torch.ByteTensor'] = 'B',
+  ['torch.CharTensor'] = 'b',
+  ['torch.ShortTensor'] = 'h',
+  ['torch.IntTensor'] = 'i',
+  ['torch.LongTensor'] = 'q',
+}
+local tensor_types = {
+  f = 'Float', d = 'Double', B = 'Byte', b = 'Char',
+  h = 'Short', i = 'Int', q = 'Long',
+}
+
+local function pack(arg, buf, frames)
+  if arg == nil then
+    buf[#buf+1] = 'n'
+  elseif type(arg) == "boolean" then
+    buf[#buf+1] = (arg and 'T' or 'F')
+  elseif type(arg) == "number" then
+    if arg == math.floor(arg) and math.abs(arg) < 2^53 then
+      buf[#buf+1] = 'i' .. struct.pack('l', arg)
+    else
+      buf[#buf+1] = 'd' .. struct.pack('d', arg)
+    end
+  elseif type(arg) == "string" then
+    buf[#buf+1] = 's' .. struct.pack('l', #arg)
+    buf[#buf+1] = arg
+  elseif type(arg) == "table" then
+    if arg[1] ~= nil and arg[0] == nil and arg[-1] == nil then
+      buf[#buf+1] = 'l' .. struct.pack('l', #arg)
+      for i = 1, #arg do
+        pack(arg[i], buf, frames)
+      end
+    else
+      local n = 0
+      for k, v in pairs(arg) do n = n + 1 end
+      buf[#buf+1] = 'm' .. struct.pack('l', n)
+      for k, v in pairs(arg) do
+        pack(k, buf, frames)
+        pack(v, buf, frames)
+      end
+    end
+  elseif type(arg) == 'userdata' and string.find(arg:type(), "Tensor") then
+    if not tensor_codes[arg:type()] then
+      arg = arg:double()
+    end
+    arg = arg:contiguous()
+    local size = {arg:dim()}
+    for i = 1, arg:dim() do
+      size[#size+1] = arg:size(i)
+    end
+    buf[#buf+1] = 't' .. tensor_codes[arg:type()]
+      .. struct.pack(string.rep('l', #size), unpack(size))
+    if arg:nElement() > 0 then
+      frames[#frames+1] = ffi.string(arg:data(), arg:nElement() * arg:elementSize())
+    else
+      frames[#frames+1] = ''
+    end
+  else
+    error("Cannot serialize this type")
+  end
+end
+
+local function unpack_value(msg, pos, frames)
+  local tag = msg:sub(pos, pos)
+  pos = pos + 1
+  if tag == 'n' then
+    return nil, pos
+  elseif tag == 'T' then
+    return true, pos
+  elseif tag == 'F' then
+    return false, pos
+  elseif tag == 'i' then
+    return struct.unpack('l', msg, pos)
+  elseif tag == 'd' then
+    return struct.unpack('d', msg, pos)
+  elseif tag == 's' then
+    local n
+    n, pos = struct.unpack('l', msg, pos)
+    return msg:sub(pos, pos+n-1), pos + n
+  elseif tag == 'l' or tag == 'm' then
+    local n
+    n, pos = struct.unpack('l', msg, pos)
+    local tbl = {}
+    for i = 1, n do
+      if tag == 'l' then
+        tbl[i], pos = unpack_value(msg, pos, frames)
+      else
+        local k
+        k, pos = unpack_value(msg, pos, frames)
+        tbl[k], pos = unpack_value(msg, pos, frames)
+      end
+    end
+    return tbl, pos
+  elseif tag == 't' then
+    local ttype = tensor_types[msg:sub(pos, pos)]
+    local dim
+    dim, pos = struct.unpack('l', msg, pos + 1)
+    local size = torch.LongStorage(dim)
+    for i = 1, dim do
+      size[i], pos = struct.unpack('l', msg, pos)
+    end
+    local tensor = torch[ttype .. 'Tensor'](size)
+    local data = frames[frames.next]
+    frames.next = frames.next + 1
+    if tensor:nElement() > 0 then
+      -- view the frame as a storage and copy it once into the tensor
+      local ptr = tonumber(ffi.cast('intptr_t', ffi.cast('const char *', data)))
+      local view = torch[ttype .. 'Storage'](tensor:nElement(), ptr)
+      tensor:storage():copy(view)
+    end
+    return tensor, pos
+  else
+    error("Cannot deserialize tag " .. tag)
+  end
+end
+
 function bridge.get_free_port()
   -- TCP ports linger 2 minutes after they're closed, kind of annoying
   while true do
@@ -98,19 +220,42 @@ function bridge.get_free_port()
   end
 end
 
-function bridge.init()
-  local port = bridge.get_free_port()
-  os.execute(string.format("python3 worker.py %d &", port))
+function bridge.start(transport, script, args)
+  -- Starts a python server, worker.py unless script is given, with args
+  -- after the endpoint on its command line, and returns the endpoint. The
+  -- default ipc transport goes through a unix socket, which needs no free
+  -- port and skips the TCP stack. 'tcp' uses a random free port as before.
+  script = script or 'worker.py'
+  args = args and (' ' .. args) or ''
+  local endpoint
+  if transport == 'tcp' then
+    local port = bridge.get_free_port()
+    os.execute(string.format("python3 %s %d%s &", script, port, args))
+    endpoint = "tcp://localhost:" .. port
+  else
+    local path = os.tmpname()
+    os.remove(path)
+    endpoint = "ipc://" .. path .. ".ipc"
+    os.execute(string.format("python3 %s %s%s &", script, endpoint, args))
+  end
+  return endpoint
+end
 
+function bridge.connect(endpoint)
   local context = zmq.context()
   local requester, err = context:socket{zmq.REQ,
-    connect = "tcp://localhost:" .. port
+    connect = endpoint
   }
   bridge.conn = requester
   bridge.conn:send("a")
   assert(bridge.conn:recv() == "connected")
 end
 
+function bridge.init(transport)
+  -- Starts worker.py and connects to it
+  bridge.connect(bridge.start(transport))
+end
+
 
 function bridge.is_connected()
   bridge.conn:send("a")
@@ -135,6 +280,34 @@ function bridge.eval(code, args)
   return deserialize(bridge.conn:recv())
 end
 
+function bridge.send_call(name, ...)
+  -- Sends a call without waiting for its result, which must be taken
+  -- with bridge.recv_result before the next call. The worker runs it in
+  -- the meantime.
+  local buf = {'c', 'l' .. struct.pack('l', select('#', ...) + 1)}
+  local frames = {}
+  pack(name, buf, frames)
+  for i = 1, select('#', ...) do
+    pack(select(i, ...), buf, frames)
+  end
+  table.insert(frames, 1, table.concat(buf))
+  bridge.conn:send_all(frames)
+end
+
+function bridge.recv_result()
+  local frames = bridge.conn:recv_all()
+  frames.next = 2
+  return (unpack_value(frames[1], 1, frames))
+end
+
+function bridge.call(name, ...)
+  -- Call a function registered with @rpc.command on the python side.
+  -- Arguments are positional and sent in a single message, so each call
+  -- is one round trip without any code being parsed on either side.
+  bridge.send_call(name, ...)
+  return bridge.recv_result()
+end
+
 function bridge.exec(code, args)
   -- Evaluate python code and returns serialized result
   -- Can serialize: lists, dicts, int, float, bool, string
@@ -0,0 +1,159 @@
+"""One process serving the env workers of all Lua threads.
+
+    python3 env_server.py <port or endpoint> [--spares N] [env name ...]
+
+Started once by the first RllabBridge when --rllab_shared_server is set,
+instead of one worker.py per thread. Every client (a REQ socket of
+bridge.lua) gets its own shard: a process forked from this one on its
+first message, which runs the requests of that client with worker.handle,
+so the envs, seeds and state of each thread stay apart as with separate
+workers. Shards are forked after rllab_worker and the modules of the
+named envs are imported, so the interpreter, numpy, rllab and the
+simulator are loaded once and shared copy-on-write instead of once per
+thread. The time taken by each import is printed at startup. --spares
+shards are forked ahead, RllabBridge asks for one per thread, so threads
+that connect together do not wait for forks. Spares taken are forked
+again once no message is waiting, since a fork holds up the messages of
+every client.
+
+The server only forwards messages: a ROUTER socket faces the clients and
+a PAIR socket over ipc:// leads to each shard, both moved without copies.
+"""
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+
+import zmq
+
+import worker
+
+LUA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def preload(env_names):
+    # imported here so the shards inherit the modules, failures are left to
+    # the shards, where the client sees them as it would with worker.py
+    sys.path.append(os.path.join(LUA_DIR, 'rllab'))
+    t = time.time()
+    try:
+        import rllab_worker
+        print("env_server: imported rllab_worker in {:.2f}s".format(time.time() - t))
+        for name in env_names:
+            t = time.time()
+            rllab_worker.env_class(name)
+            print("env_server: imported {} in {:.2f}s".format(name, time.time() - t))
+    except Exception as e:
+        print("env_server: preloading failed, {}: {}".format(type(e).__name__, e))
+
+
+def run_shard(endpoint, server_pid):
+    # worker.listener for a single client, behind the server. Exits when
+    # the server is gone, even if it was killed. Exits as usual when
+    # terminated, so that the processes of --rllab_pool are stopped too.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    context = zmq.Context()
+    socket = context.socket(zmq.PAIR)
+    socket.connect(endpoint)
+    while True:
+        if not socket.poll(1000):
+            if os.getppid() != server_pid:
+                break
+            continue
+        res = worker.handle(socket.recv_multipart(copy=False))
+        if res is None:
+            break
+        socket.send_multipart(res, copy=False)
+    socket.close()
+    context.term()
+
+
+class Server(object):
+    def __init__(self, address, nspare=1):
+        self.context = zmq.Context()
+        self.frontend = self.context.socket(zmq.ROUTER)
+        self.frontend.bind(worker.bind_address(address))
+        self.poller = zmq.Poller()
+        self.poller.register(self.frontend, zmq.POLLIN)
+        self.dir = tempfile.mkdtemp(prefix='env_server')
+        self.shards = {}   # client identity -> (socket, process)
+        self.clients = {}  # shard socket -> client identity
+        self.nshards = 0
+        self.nspare = nspare
+        self.spares = [self.fork() for _ in range(nspare)]
+
+    def fork(self):
+        endpoint = 'ipc://{}/{}'.format(self.dir, self.nshards)
+        self.nshards += 1
+        socket = self.context.socket(zmq.PAIR)
+        socket.bind(endpoint)
+        p = multiprocessing.get_context('fork').Process(
+            target=run_shard, args=(endpoint, os.getpid()))
+        # not daemonic, so that a shard can start the processes of
+        # --rllab_pool; run_shard exits with the server and close stops it
+        p.start()
+        return socket, p
+
+    def shard(self, ident):
+        if ident not in self.shards:
+            if not self.spares:
+                self.spares.append(self.fork())
+            socket, p = self.shards[ident] = self.spares.pop()
+            self.clients[socket] = ident
+            self.poller.register(socket, zmq.POLLIN)
+        return self.shards[ident][0]
+
+    def serve(self):
+        print("Server is listening...")
+        while True:
+            events = self.poller.poll(0 if len(self.spares) < self.nspare else None)
+            if not events:
+                self.spares.append(self.fork())
+            for socket, _ in events:
+                frames = socket.recv_multipart(copy=False)
+                if socket is self.frontend:
+                    # [identity, empty delimiter, request...]
+                    ident = frames[0].bytes
+                    self.shard(ident).send_multipart(frames[2:], copy=False)
+                    if frames[2].bytes == b"":
+                        # the shard stops without a reply, as worker.py does
+                        self.stop(ident)
+                else:
+                    self.frontend.send_multipart(
+                        [self.clients[socket], b""] + frames, copy=False)
+
+    def stop(self, ident):
+        socket, p = self.shards.pop(ident)
+        del self.clients[socket]
+        self.poller.unregister(socket)
+        p.join()
+        socket.close()
+
+    def close(self):
+        shards = list(self.shards.values()) + self.spares
+        for socket, p in shards:
+            p.terminate()
+            socket.close()
+        for socket, p in shards:
+            p.join()
+        self.frontend.close()
+        self.context.term()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    assert len(sys.argv) >= 2
+    # rllab_worker replaces sys.argv
+    address, env_names = sys.argv[1], sys.argv[2:]
+    nspare = 1
+    if env_names[:1] == ['--spares']:
+        nspare, env_names = int(env_names[1]), env_names[2:]
+    preload(env_names)
+    server = Server(address, nspare)
+    try:
+        server.serve()
+    finally:
+        server.close()
@@ -0,0 +1,135 @@
+-- MazeBridge for games run as numpy arrays by games/maze_worker.py in a
+-- worker.py process (--maze_vec), instead of one Lua object per game.
+-- Only SPLightKey. Game options still come from the OptsHelper of the
+-- config, and the python side keeps the rules of the Lua games, see
+-- games/vec_lightkey.py. Every step is a single call returning the
+-- observations, active games, minds and rewards of the whole batch.
+local py = paths.dofile('../bridge.lua')
+
+local VecMazeBridge = torch.class('VecMazeBridge')
+
+function VecMazeBridge:__init(factory, opts, vocab, ivocab)
+    assert(opts.nagents == 1)
+    self.opts = opts
+    self.factory = factory
+    self.vocab = vocab
+    if opts.game == nil or opts.game == '' then
+        assert(factory.ngames == 1, 'maze_vec runs a single game')
+        self.gname = factory.glist[1]
+    else
+        self.gname = opts.game
+    end
+    assert(self.gname == 'SPLightKey', 'maze_vec only runs SPLightKey')
+    self.helper = factory.helpers[self.gname]
+
+    py.init(opts.rllab_transport)
+    py.exec([=[
+import sys
+sys.path.append(path)
+    ]=], {path = paths.dirname(paths.thisfile())})
+    py.exec('from maze_worker import *')
+    -- static options of the game, the ranged ones are drawn at every reset
+    py.call('init', ivocab, opts.batch_size, self.helper:generate_gameopts(),
+        opts, torch.random(2^31 - 1))
+
+    -- stands for the MazeAgent of every game, for show_map and test_action
+    self.agent = {action_names = py.call('action_names'), action_ids = {}}
+    for id, name in ipairs(self.agent.action_names) do
+        self.agent.action_ids[name] = id
+    end
+    assert(opts.nactions == #self.agent.action_names,
+        'set nactions=' .. #self.agent.action_names)
+end
+
+function VecMazeBridge:batch_init(size, layouts)
+    -- new games, or the games of layouts (see benchmarks/check_lightkey.lua)
+    assert(size == self.opts.batch_size)
+    local res
+    if layouts then
+        res = py.call('load', layouts)
+    else
+        local sizes = torch.Tensor(size, 4)
+        for i = 1, size do
+            local gopts = self.helper:generate_gameopts()
+            sizes[i][1] = gopts.map_height
+            sizes[i][2] = gopts.map_width
+            sizes[i][3] = gopts.nblocks
+            sizes[i][4] = gopts.nwater
+        end
+        res = py.call('reset', sizes)
+    end
+    local test = res[4]
+    local batch = {}
+    for i = 1, size do
+        batch[i] = {
+            type = test[i] == 1 and 'test_task' or 'self_play',
+            sp_mode = self.opts.sp_mode,
+            vocab = self.vocab,
+            agents = {self.agent},
+            map = {print_ascii = function() print(py.call('ascii', i)) end},
+        }
+    end
+    self:update(batch, res)
+    return batch
+end
+
+function VecMazeBridge:replay(actions, draws)
+    -- random Alice actions and torch.uniform draws of Lua games for the
+    -- next step (see benchmarks/check_lightkey.lua)
+    py.call('replay', actions, draws)
+end
+
+function VecMazeBridge:update(batch, res)
+    local obs, active, mind = unpack(res)
+    self.obs = obs
+    self.active = active
+    self.reward = res[5]
+    for i, g in pairs(batch) do
+        g.current_mind = mind[i]
+    end
+end
+
+function VecMazeBridge:batch_input(batch)
+    return self.obs
+end
+
+function VecMazeBridge:batch_act(batch, action, active)
+    self:update(batch, py.call('step', action:view(-1), active))
+end
+
+function VecMazeBridge:batch_update(batch, active)
+end
+
+function VecMazeBridge:batch_reward(batch, active)
+    return torch.Tensor(#batch):copy(self.reward)
+end
+
+function VecMazeBridge:batch_active(batch)
+    return torch.Tensor(#batch):copy(self.active)
+end
+
+function VecMazeBridge:batch_terminal_reward(batch)
+    local res = py.call('finish_episode')
+    for i, g in pairs(batch) do
+        g.reward_terminal_mind = {}
+        g.get_terminal_reward_mind = function(self, m)
+            return self.reward_terminal_mind[m]
+        end
+        for m = 1, res.reward_mind:size(2) do
+            g.reward_terminal_mind[m] = res.reward_mind[i][m]
+        end
+        g.stat = res.stat[i]
+        g.success = res.success[i] == 1
+    end
+    return torch.Tensor(#batch):copy(res.reward)
+end
+
+function VecMazeBridge:batch_success(batch)
+    local success = torch.Tensor(#batch):fill(0)
+    for i, g in pairs(batch) do
+        if g.success then
+            success[i] = 1
+        end
+    end
+    return success
+end
@@ -0,0 +1,83 @@
+"""Commands of the numpy MazeBase games, called by games/VecMazeBridge.lua
+in a worker.py process. The batch of games is one VecSPLightKey.
+"""
+import numpy as np
+from rpc import command
+
+from vec_lightkey import ACTIONS, VecSPLightKey
+
+
+@command
+def init(ivocab, size, game_opts, opts, seed=None):
+    global games
+    games = VecSPLightKey(opts, game_opts, list(ivocab), int(size), seed)
+
+
+def result():
+    # what VecMazeBridge keeps after a reset or a step
+    return (games.get_obs(), (~games.finished).astype('float32'),
+            games.current_mind, games.test_mode)
+
+
+@command
+def reset(sizes):
+    # new games, sizes are rows of [map_height, map_width, nblocks, nwater]
+    games.reset(sizes)
+    return result()
+
+
+@command
+def load(layouts):
+    # games from the layouts of Lua games, with 1-based locations, see
+    # benchmarks/check_lightkey.lua
+    def loc(l):
+        return tuple(int(v) - 1 for v in l[:2]) + tuple(int(v) for v in l[2:])
+    res = []
+    for l in layouts:
+        l = dict(l)
+        for key in ['blocks', 'water', 'swamps']:
+            l[key] = [loc(v) for v in l.get(key) or []]
+        for key in ['door', 'goal', 'agent', 'switch', 'lamp']:
+            if l.get(key) is not None:
+                l[key] = loc(l[key])
+        res.append(l)
+    games.load(res)
+    return result()
+
+
+@command
+def replay(actions, draws):
+    # the next steps take the actions of a random Alice and the draws of
+    # VecSPLightKey.uniform by game from here, those of the Lua games in
+    # benchmarks/check_lightkey.lua
+    actions = np.asarray(actions, dtype='int64')
+    draws = np.asarray(draws)
+    games.random_actions = lambda k: actions[k]
+    games.uniform = lambda k: draws[k]
+
+
+@command
+def step(action, active):
+    reward = games.step(action, active)
+    return result() + (reward,)
+
+
+@command
+def finish_episode():
+    # terminal rewards, per-mind terminal rewards, success and stats of the
+    # finished episode
+    success = games.is_success(np.arange(games.size))
+    reward_mind = np.stack([games.terminal_reward_mind(m + 1)
+                            for m in range(games.nminds)], 1)
+    return dict(reward=games.terminal_reward(success), reward_mind=reward_mind,
+                success=success, stat=games.get_stat())
+
+
+@command
+def action_names():
+    return ACTIONS
+
+
+@command
+def ascii(i):
+    return games.ascii(int(i) - 1)
@@ -0,0 +1,453 @@
+"""SPLightKey games (SPLightKey.lua over SPBase and MazeBase) for a whole
+batch, in numpy.
+
+The rules are those of the Lua games: a wall with a door, a switch that
+locks the door, a lamp that hides everything but the agent, the lamp and
+the corners when off, and the self-play modes reverse, repeat and
+compete. Every game is a row of integer arrays, and every cell holds the
+words its items show (the attributes of MazeItem:to_sentence) as bits, so
+observations and the state snapshots of SPBase are windows of these cells
+around the agents, taken for all games at once. Only layouts are
+generated one game at a time, at reset.
+
+Observations are those of MazeBridge:batch_input, as LookupTable indices
+with --encoder_lut or one-hot otherwise. Words of a cell are listed in a
+fixed order rather than in the order Lua walks the attributes of items,
+which the summed LookupTable does not see. benchmarks/check_lightkey.lua
+runs both on the same layouts and compares them.
+"""
+import numpy as np
+
+# actions of MazeAgent, ids from 1, stop switches to Bob (SPBase)
+ACTIONS = ['up', 'down', 'left', 'right', 'stop', 'toggle']
+MOVES = [(1, -1, 0), (2, 1, 0), (3, 0, -1), (4, 0, 1)]
+STOP = 5
+TOGGLE = 6
+
+# words items show in a cell, one bit each. 'time' is the time word of the
+# agent, time1, time2, ...
+WORDS = ['agent', 'agent1', 'time', 'perform_task', 'goal', 'block', 'water',
+         'swamp', 'corner', 'door', 'open', 'switch', 'lamp', 'color1', 'color2']
+BIT = dict((w, 1 << i) for i, w in enumerate(WORDS))
+TIME = WORDS.index('time')
+
+
+def color_bit(c):
+    return np.where(c == 1, BIT['color1'], BIT['color2'])
+
+
+class VecSPLightKey(object):
+    def __init__(self, opts, game_opts, ivocab, size, seed=None):
+        # opts are the options of main.lua, game_opts the StaticOpts of the
+        # game config, ivocab the words of games/init.lua by index
+        self.opts = opts
+        self.size = size
+        self.rng = np.random.RandomState(seed)
+        self.vocab = dict((w, i + 1) for i, w in enumerate(ivocab))
+        self.nwords = len(ivocab)
+        self.word_ids = np.array([self.vocab.get(w, 0) for w in WORDS])
+        missing = [w for w, i in zip(WORDS, self.word_ids) if i == 0 and w != 'time']
+        if missing:
+            raise KeyError('not found in dict: ' + ', '.join(missing))
+
+        g = self.game = dict(game_opts)
+        assert int(opts['nagents']) == 1
+        assert not g.get('push_block_door'), 'push_block_door is not supported'
+        assert not g.get('return_loc_only'), 'return_loc_only is not supported'
+        assert int(g.get('enable_boundary', 0)) == 0, 'enable_boundary is not supported'
+        assert int(g.get('crumb_action', 0)) == 0 and int(g.get('push_action', 0)) == 0
+        if g.get('with_switch') or g.get('with_lamp'):
+            assert g.get('with_wall')
+        self.sp_mode = opts['sp_mode']
+        self.reward_bob_step = bool(opts['sp_reward_bob_step'])
+        self.rand_alice = int(opts.get('sp_rand_alice', 0)) == 1
+        self.max_steps = int(opts['max_steps'])
+        self.nminds = max(2, int(opts['nminds']))
+
+        self.visibility = int(opts['visibility'])
+        self.max_info = int(opts['max_info'])
+        self.lut = bool(opts['encoder_lut'])
+        self.lut_size = int(opts['encoder_lut_size'])
+        # as Agent:build_encoder
+        self.lut_nil = ((2 * self.visibility + 1) ** 2 + self.max_info) * self.nwords + 1
+
+    # layouts
+
+    def generate(self, height, width, nblocks, nwater):
+        # A new game, placed as SPLightKey:init_env does, with 0-based
+        # locations. Items other than corners take a cell of their own.
+        rng = self.rng
+        g = self.game
+        occupied = np.zeros((height, width), dtype='bool')
+
+        def empty():
+            for _ in range(100):
+                y, x = rng.randint(height), rng.randint(width)
+                if not occupied[y, x]:
+                    return y, x
+            raise RuntimeError('failed 100 times to find empty location')
+
+        def place(loc):
+            occupied[loc] = True
+            return loc
+
+        test = rng.uniform() < g['test_rate']
+        fixed = test and g.get('test_rand_init') is False
+        layout = dict(height=height, width=width, test_mode=test,
+                      blocks=[], water=[], swamps=[],
+                      corners=int(g.get('enable_corners', 0)) == 1)
+        if g.get('with_wall'):
+            vertical = rng.uniform() < 0.5
+            if vertical:
+                door = (rng.randint(height), rng.randint(1, width - 1))
+                wall = [(y, door[1]) for y in range(height) if y != door[0]]
+            else:
+                door = (rng.randint(1, height - 1), rng.randint(width))
+                wall = [(door[0], x) for x in range(width) if x != door[1]]
+            layout['blocks'] += [place(loc) for loc in wall]
+            layout['door'] = place(door)
+
+            def opposite(goal):
+                # a cell on the other side of the wall from goal
+                a = 1 if vertical else 0
+                while True:
+                    loc = empty()
+                    if (loc[a] - door[a]) * (goal[a] - door[a]) < 0:
+                        return loc
+
+        if test:
+            layout['goal'] = place(empty())
+        if g.get('with_switch'):
+            loc = opposite(layout['goal']) if fixed else empty()
+            c = 1 if fixed else rng.randint(1, 3)
+            layout['switch'] = place(loc) + (c,)
+        if g.get('with_lamp'):
+            loc = opposite(layout['goal']) if fixed else empty()
+            c = 2
+            if fixed or rng.uniform() < g['lamp_off_prob']:
+                c = 1
+            layout['lamp'] = place(loc) + (c,)
+        if fixed and g.get('with_wall'):
+            layout['agent'] = place(opposite(layout['goal']))
+        else:
+            layout['agent'] = place(empty())
+        layout['blocks'] += [place(empty()) for _ in range(nblocks)]
+        layout['water'] = [place(empty()) for _ in range(nwater)]
+        layout['swamps'] = [place(empty()) for _ in range(int(g.get('nswamp', 0)))]
+        layout['rand_switch_t'] = rng.randint(1, self.max_steps // 2 + 1)
+        return layout
+
+    def reset(self, sizes):
+        # sizes are rows of [map_height, map_width, nblocks, nwater]
+        sizes = np.asarray(sizes, dtype='int64')
+        self.load([self.generate(*s) for s in sizes])
+
+    def load(self, layouts):
+        # games from layouts, see generate
+        n = self.size
+        assert len(layouts) == n
+        self.height = np.array([l['height'] for l in layouts])
+        self.width = np.array([l['width'] for l in layouts])
+        self.hm, self.wm = self.height.max(), self.width.max()
+        self.static = np.zeros((n, self.hm, self.wm), dtype='int32')
+        self.agent = np.zeros((n, 2), dtype='int64')
+        self.goal = np.zeros((n, 2), dtype='int64')
+        self.door = np.zeros((n, 2), dtype='int64')
+        self.switch = np.zeros((n, 2), dtype='int64')
+        self.lamp = np.zeros((n, 2), dtype='int64')
+        self.switch_c0 = np.ones(n, dtype='int64')
+        self.lamp_c0 = np.ones(n, dtype='int64')
+        self.rand_switch_t = np.zeros(n, dtype='int64')
+        for name in ['test_mode', 'has_goal', 'has_door', 'has_switch', 'has_lamp']:
+            setattr(self, name, np.zeros(n, dtype='bool'))
+        for i, l in enumerate(layouts):
+            for key, bit in [('blocks', 'block'), ('water', 'water'), ('swamps', 'swamp')]:
+                for y, x in l.get(key) or []:
+                    self.static[i, y, x] |= BIT[bit]
+            if l.get('corners'):
+                h, w = l['height'] - 1, l['width'] - 1
+                self.static[i, [0, h, 0, h], [0, 0, w, w]] |= BIT['corner']
+            for key in ['goal', 'door']:
+                if l.get(key) is not None:
+                    getattr(self, 'has_' + key)[i] = True
+                    getattr(self, key)[i] = l[key]
+            for key in ['switch', 'lamp']:
+                if l.get(key) is not None:
+                    getattr(self, 'has_' + key)[i] = True
+                    getattr(self, key)[i] = l[key][:2]
+                    getattr(self, key + '_c0')[i] = l[key][2]
+            self.agent[i] = l['agent']
+            self.test_mode[i] = l['test_mode']
+            self.rand_switch_t[i] = l['rand_switch_t']
+
+        self.agent0 = self.agent.copy()
+        self.switch_c = self.switch_c0.copy()
+        self.lamp_c = self.lamp_c0.copy()
+        self.door_open = np.ones(n, dtype='bool')
+        self.lit = np.ones(n, dtype='bool')
+        self.t = np.zeros(n, dtype='int64')
+        self.finished = np.zeros(n, dtype='bool')
+        self.switch_done = np.zeros(n, dtype='bool')
+        self.switch_t = np.zeros(n, dtype='int64')
+        self.perform_task = np.zeros(n, dtype='bool')
+        self.current_mind = np.where(
+            self.test_mode, 3 if self.game.get('test_mind_separate') else 2, 1)
+        self.stat = dict((k, np.zeros(n, dtype='int64')) for k in
+                         ['switch_dist', 'lock', 'lamp', 'door_cross', 'swamp'])
+        all = np.arange(n)
+        self.update_states(all)
+        self.target = self.snapshot(all)
+
+    # cells and observations
+
+    def cells(self, idx, agent_words=True):
+        # the words of every cell of games idx as bits, (len(idx), hm, wm)
+        lit = self.lit[idx]
+        grid = self.static[idx] & np.where(lit, -1, BIT['corner'])[:, None, None]
+
+        def put(loc, mask, bits):
+            k = np.nonzero(mask)[0]
+            bits = np.broadcast_to(bits, mask.shape)[k]
+            grid[k, loc[idx[k], 0], loc[idx[k], 1]] |= bits
+
+        put(self.goal, lit & self.has_goal[idx], BIT['goal'])
+        put(self.door, lit & self.has_door[idx],
+            BIT['door'] | np.where(self.door_open[idx], BIT['open'], 0))
+        put(self.switch, lit & self.has_switch[idx],
+            BIT['switch'] | BIT['door'] | color_bit(self.switch_c[idx]))
+        put(self.lamp, self.has_lamp[idx],
+            BIT['switch'] | BIT['lamp'] | color_bit(self.lamp_c[idx]))
+        bits = BIT['agent'] | BIT['agent1']
+        if agent_words:
+            # the time word appears with the first update
+            bits = bits | np.where(self.t[idx] > 0, BIT['time'], 0) \
+                | np.where(self.perform_task[idx], BIT['perform_task'], 0)
+        put(self.agent, np.ones(len(idx), dtype='bool'), bits)
+        return grid
+
+    def window(self, grid, idx, v):
+        # cells within v of the agents of games idx, (len(idx), 2v+1, 2v+1),
+        # empty outside the maps
+        pad = np.zeros((len(idx), self.hm + 2 * v, self.wm + 2 * v), dtype=grid.dtype)
+        pad[:, v:v + self.hm, v:v + self.wm] = grid
+        r = np.arange(2 * v + 1)
+        ys = self.agent[idx, 0, None] + r
+        xs = self.agent[idx, 1, None] + r
+        return pad[np.arange(len(idx))[:, None, None], ys[:, :, None], xs[:, None, :]]
+
+    def snapshot(self, idx):
+        # SPBase:get_state_snapshot, the whole map around the agent without
+        # its time and sp_mode
+        v = max(self.hm, self.wm) - 1
+        return self.window(self.cells(idx, False), idx, v)
+
+    def time_ids(self):
+        ids = np.zeros(self.size, dtype='int64')
+        for i in np.nonzero(self.t > 0)[0]:
+            word = 'time{}'.format(self.t[i])
+            if word not in self.vocab:
+                raise KeyError('not found in dict: ' + word)
+            ids[i] = self.vocab[word]
+        return ids
+
+    def get_obs(self):
+        # MazeBridge:batch_input for all games
+        n = self.size
+        s = 2 * self.visibility + 1
+        all = np.arange(n)
+        win = self.window(self.cells(all), all, self.visibility).reshape(n, s * s)
+        words = np.tile(self.word_ids, (n, 1))
+        words[:, TIME] = self.time_ids()
+        has = ((win[:, :, None] >> np.arange(len(WORDS))) & 1).astype('bool')
+        if self.lut:
+            cell = np.arange(s * s)[None, :, None] * self.nwords
+            value = (cell + words[:, None, :]).reshape(n, -1)
+            has = has.reshape(n, -1)
+            count = has.sum(1)
+            if count.max() > self.lut_size:
+                raise RuntimeError('increase encoder_lut_size!')
+            rows, cols = np.nonzero(has)
+            pos = np.arange(len(rows)) - np.repeat(np.cumsum(count) - count, count)
+            obs = np.full((n, self.lut_size), self.lut_nil, dtype='float32')
+            obs[rows, pos] = value[rows, cols]
+            return obs
+        obs = np.zeros((n, s * s + self.max_info, self.nwords), dtype='float32')
+        k, p, f = np.nonzero(has)
+        obs[k, p, words[k, f] - 1] = 1
+        return obs.reshape(n, -1)
+
+    # steps
+
+    def step(self, action, active):
+        # MazeBridge:batch_act, batch_update and batch_reward for the games
+        # that are active
+        k = np.nonzero(np.asarray(active) == 1)[0]
+        self.act(k, np.asarray(action, dtype='int64').reshape(-1)[k])
+        self.update(k)
+        reward = np.zeros(self.size)
+        if self.reward_bob_step:
+            bob = ~self.test_mode[k] & (self.current_mind[k] == 2)
+            reward[k[bob]] = -0.1
+        return reward
+
+    def act(self, k, action):
+        if self.rand_alice:
+            # SPBase: a random Alice that stops at rand_switch_t
+            alice = self.current_mind[k] == 1
+            a = self.random_actions(k)
+            a[self.t[k] + 1 == self.rand_switch_t[k]] = STOP
+            action = np.where(alice, a, action)
+
+        for a, dy, dx in MOVES:
+            m = k[action == a]
+            if len(m) == 0:
+                continue
+            y, x = self.agent[m, 0], self.agent[m, 1]
+            swamp = (self.static[m, y, x] & BIT['swamp']) != 0
+            if swamp.any():
+                stuck = np.zeros(len(m), dtype='bool')
+                stuck[swamp] = self.uniform(m[swamp]) < self.game['swamp_stuck_prob']
+                self.stat['swamp'][m[stuck & (self.current_mind[m] == 1)]] = 1
+                m, y, x = m[~stuck], y[~stuck], x[~stuck]
+            y, x = y + dy, x + dx
+            ok = (y >= 0) & (y < self.height[m]) & (x >= 0) & (x < self.width[m])
+            m, y, x = m[ok], y[ok], x[ok]
+            ok = (self.static[m, y, x] & BIT['block']) == 0
+            at_door = self.has_door[m] & (self.door[m, 0] == y) & (self.door[m, 1] == x)
+            ok &= ~at_door | self.door_open[m]
+            self.agent[m[ok], 0] = y[ok]
+            self.agent[m[ok], 1] = x[ok]
+
+        s = k[action == STOP]
+        self.switch_agent(s[~self.switch_done[s]])
+
+        t = k[action == TOGGLE]
+        on_switch = self.has_switch[t] & (self.switch[t] == self.agent[t]).all(1)
+        on_lamp = self.has_lamp[t] & (self.lamp[t] == self.agent[t]).all(1)
+        alice = self.current_mind[t] == 1
+        self.stat['lock'][t[alice & on_switch]] = 1
+        self.stat['lamp'][t[alice & ~on_switch & on_lamp]] = 1
+        self.switch_c[t[on_switch]] = self.switch_c[t[on_switch]] % 2 + 1
+        self.lamp_c[t[on_lamp]] = self.lamp_c[t[on_lamp]] % 2 + 1
+
+    def random_actions(self, k):
+        # actions of a random Alice in games k, any but stop
+        a = self.rng.randint(1, len(ACTIONS), size=len(k))
+        a[a >= STOP] += 1
+        return a
+
+    def uniform(self, k):
+        # a draw for each of games k, where a Lua game calls torch.uniform:
+        # a move out of a swamp and a switch in compete mode, at most one a
+        # step. benchmarks/check_lightkey.lua replaces both methods to
+        # replay the draws of the Lua games.
+        return self.rng.uniform(size=len(k))
+
+    def switch_agent(self, s):
+        self.switch_done[s] = True
+        self.current_mind[s] = 2
+        self.switch_t[s] = self.t[s] + 1
+        self.stat['switch_dist'][s] = np.abs(self.agent[s] - self.agent0[s]).sum(1)
+        if self.sp_mode == 'reverse':
+            pass
+        elif self.sp_mode == 'repeat':
+            self.target[s] = self.snapshot(s)
+            # SPLightKey:reset, the door and the lamp are left as they are
+            # until the next update_states
+            self.agent[s] = self.agent0[s]
+            self.switch_c[s] = self.switch_c0[s]
+            self.lamp_c[s] = self.lamp_c0[s]
+        elif self.sp_mode == 'compete':
+            self.current_mind[s[self.uniform(s) < 0.5]] = 1
+            self.perform_task[s] = True
+        else:
+            raise RuntimeError('wrong mode')
+
+    def update(self, k):
+        # SPLightKey:update, success is checked before the states follow
+        # the switches
+        self.t[k] += 1
+        s = k[self.switch_done[k]]
+        self.finished[s] |= self.is_success(s)
+        self.update_states(k)
+        d = k[~self.test_mode[k] & self.has_door[k] & (self.current_mind[k] == 1)]
+        self.stat['door_cross'][d[(self.door[d] == self.agent[d]).all(1)]] = 1
+
+    def update_states(self, k):
+        sw = k[self.has_switch[k]]
+        self.door_open[sw] = self.switch_c[sw] == 2
+        lamp = k[self.has_lamp[k]]
+        self.lit[lamp] = self.lamp_c[lamp] != 1
+
+    def is_success(self, idx):
+        at_goal = self.has_goal[idx] & (self.goal[idx] == self.agent[idx]).all(1)
+        same = self.switch_done[idx] & (
+            self.snapshot(idx) == self.target[idx]).all((1, 2))
+        return np.where(self.test_mode[idx], at_goal, same)
+
+    # end of an episode
+
+    def terminal_reward(self, success):
+        t = self.t * 0.1
+        return np.where(self.test_mode, np.where(success, 1 - t, -t), 0)
+
+    def terminal_reward_mind(self, m):
+        # SPBase:get_terminal_reward_mind for all games
+        t, st = self.t, self.switch_t
+        bob = self.current_mind == 2
+        if m == 1 and self.sp_mode == 'compete':
+            r = np.where(self.switch_done, np.where(bob, 0.1, -0.1) * (t - st), 0)
+        elif m == 1:
+            r = np.where(bob, np.maximum(0, (t - st * 2) * 0.1), 0)
+        elif m == 2 and not self.reward_bob_step:
+            r = np.where(bob, -(t - st) * 0.1, 0)
+        else:
+            r = np.zeros(self.size)
+        return np.where(self.test_mode, 0, r)
+
+    def get_stat(self):
+        # the stat of every game, with alice_actions as
+        # SPLightKey:get_terminal_reward leaves it
+        stat = self.stat
+        stats = []
+        for i in range(self.size):
+            s = dict(test_task_count=1) if self.test_mode[i] else dict(self_play_count=1)
+            if self.switch_done[i]:
+                s['switch_t'] = int(self.switch_t[i])
+                s['switch_dist'] = int(stat['switch_dist'][i])
+            for k in ['lock', 'lamp', 'door_cross', 'swamp']:
+                if stat[k][i]:
+                    s[k] = 1
+            door, lamp, lock = stat['door_cross'][i], stat['lamp'][i], stat['lock'][i]
+            cases = [door and lamp and lock, door and lamp, door and lock,
+                     lamp and lock, door, lock, lamp, True]
+            s['alice_actions'] = np.zeros(8, dtype='float32')
+            s['alice_actions'][[bool(c) for c in cases].index(True)] = 1
+            stats.append(s)
+        return stats
+
+    def ascii(self, i):
+        # MazeMap:print_ascii of game i, without colors
+        lines = ['|' + '--' * self.width[i] + '|']
+        grid = self.cells(np.array([i]))[0]
+        for y in range(self.height[i]):
+            line = '|'
+            for x in range(self.width[i]):
+                b = grid[y, x]
+                s = '  '
+                if self.static[i, y, x] & BIT['block']:
+                    s = '[]'
+                elif b & BIT['goal']:
+                    s = '$$'
+                elif b & BIT['lamp']:
+                    s = 'l{}'.format(self.lamp_c[i])
+                elif b & BIT['switch']:
+                    s = 'd{}'.format(self.switch_c[i])
+                elif self.has_door[i] and (self.door[i] == (y, x)).all():
+                    s = 'DO' if self.door_open[i] else 'DC'
+                if b & BIT['agent']:
+                    s = '@@'
+                line += s
+            lines.append(line + '|')
+        lines.append(lines[0])
+        return '\n'.join(lines)
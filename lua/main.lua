@@ -28,6 +28,7 @@ cmd:option('--games_config_path', 'games/config/find.lua', 'configuration file f
 cmd:option('--game', '', 'can specify a single game')
 cmd:option('--visibility', 1, 'vision range of agents. Does not apply to MemNN')
 cmd:option('--max_info', 0, 'max number of info items allowed')
+cmd:option('--maze_vec', false, 'run the games as numpy arrays in a worker.py process (SPLightKey only), see games/VecMazeBridge.lua')
 -- training parameters
 cmd:option('--mode', 'pg', 'actor-critic or policy-grad: ac | pg')
 cmd:option('--ac_freq', 1, 'how often to boostrap in AC')
@@ -38,6 +39,8 @@ cmd:option('--epochs', 100, 'the number of training epochs')
 cmd:option('--nbatches', 10, 'the number of mini-batches in one epoch')
 cmd:option('--batch_size', 16, 'size of mini-batch (the number of parallel games) in each thread')
 cmd:option('--nworker', 16, 'the number of threads used for training')
+cmd:option('--async_staleness', -1, 'if >= 0, train without a barrier on parameters at most this many updates old (-1 = synchronous)')
+cmd:option('--grad_reduce', 'main', 'how gradients of the threads are averaged: main (by the main thread) | shard (by all threads, see benchmarks/bench_reduce.lua)')
 cmd:option('--entropy_reg', 0, 'entropy regularization for action probs')
 cmd:option('--entropy_reg_decay', 0, 'decay rate')
 cmd:option('--constant_baseline', -1, 'if in (0,1) use a scalar baseline instead of nn model')
@@ -55,12 +58,21 @@ cmd:option('--rllab', false, 'use rllab')
 cmd:option('--rllab_env', 'MountainCar')
 cmd:option('--rllab_in_dim', 2)
 cmd:option('--rllab_reward_coeff', 1)
-cmd:option('--rllab_steps', 1, 'rllab steps between actions (i.e. skip frame)')
+cmd:option('--rllab_steps', 1, 'rllab steps between actions (i.e. skip frame), rewards are summed over them')
 cmd:option('--rllab_cont_action', false, 'convert to contineous action')
 cmd:option('--rllab_cont_limit', 1, 'action value is between [-x, x]')
 cmd:option('--rllab_normalize', false, 'normalize input')
 cmd:option('--rllab_normalize_rllab', false, 'normalize input by RLLab')
 cmd:option('--rllab_save_image', '', 'path to save rendered image')
+cmd:option('--rllab_transport', 'ipc', 'how to reach the env workers: ipc or tcp')
+cmd:option('--rllab_pool', 0, 'step envs in this many child processes (0 = in the worker itself)')
+cmd:option('--rllab_pipeline', false, 'step one half of the batch while the model runs on the other')
+cmd:option('--rllab_rollout', false, 'run whole episodes in the env workers with a numpy copy of the model (feed-forward only), and only replay them here')
+cmd:option('--rllab_prereset', false, 'reset the envs in the background as soon as an episode is finished')
+cmd:option('--rllab_shared_server', false, 'serve the envs of all threads from one env_server.py instead of a worker.py each')
+cmd:option('--rllab_record', '', 'directory to record all episodes of the env workers to, as .npy files')
+cmd:option('--rllab_record_episodes', 1000, 'episodes in each set of recorded files')
+cmd:option('--rllab_profile', false, 'time the commands of the env workers and show them every epoch')
 -- starcraft
 cmd:option('--sc', false, 'use starcraft')
 cmd:option('--sc_game', 'sp_econ', 'game type')
@@ -149,12 +161,6 @@ if opts.debug then
     dbg = require'debugger'
 end
 
-if opts.rllab then
-    if opts.nminds > 1 then
-        assert(opts.rllab_steps == 1, 'to correct switch action')
-    end
-end
-
 trainer = Trainer(opts)
 if opts.load ~= '' then
 	trainer:load(opts.load)
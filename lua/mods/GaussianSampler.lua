@@ -10,6 +10,11 @@ end
 function GaussianSampler:updateOutput(input)
     self.output = self.output or input.new()
     self.output:resize(input:size(1), 1)
+    if self.replay then
+        -- taken by the env workers, see Agent:forward
+        self.output:copy(self.replay)
+        return self.output
+    end
     for i = 1, input:size(1) do
         self.output[i][1] = torch.normal() * math.exp(input[i][2]) + input[i][1]
     end
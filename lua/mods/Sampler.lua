@@ -21,7 +21,12 @@ end
 -- input must be log(prob)
 function Sampler:updateOutput(input)
     assert(input:dim() == 2)
-    self.output = sample_multinomial(torch.exp(input))
+    if self.replay then
+        -- replayed actions, see Agent:forward
+        self.output = self.replay:long()
+    else
+        self.output = sample_multinomial(torch.exp(input))
+    end
     if self.output_fixed then
         for i = 1, self.output_fixed:size(1) do
             if self.output_fixed[i][1] > 0 then
@@ -4,14 +4,30 @@ local py = paths.dofile('../bridge.lua')
 local RllabBridge = torch.class('RllabBridge')
 
 function RllabBridge:__init(opts)
-    py.init()
+    if opts.rllab_shared_server then
+        -- the first bridge, of the main thread, starts the server and the
+        -- threads get its endpoint with opts. Each connection has its own
+        -- shard of envs there, forked with the env modules already
+        -- imported, see env_server.py. The threads connect together, so a
+        -- spare shard is kept for each.
+        if not opts.rllab_server_endpoint then
+            opts.rllab_server_endpoint = py.start(opts.rllab_transport,
+                'env_server.py', '--spares ' .. opts.nworker .. ' ' .. opts.rllab_env)
+        end
+        py.connect(opts.rllab_server_endpoint)
+    else
+        py.init(opts.rllab_transport)
+    end
     py.exec([=[
 import sys
 sys.path.append(path)
     ]=], {path = paths.dirname(paths.thisfile())})
     py.exec('from rllab_worker import *')
-    py.eval('init(env_name, size, opts)', {
-        env_name = opts.rllab_env, size = opts.batch_size, opts = opts})
+    -- seeds the python envs from the thread's torch generator
+    py.call('init', opts.rllab_env, opts.batch_size, opts, torch.random(2^31 - 1))
+    if opts.rllab_profile then
+        py.call('profile_start')
+    end
 
     self.opts = opts
     assert(self.opts.nagents == 1)
@@ -22,9 +38,11 @@ end
 function RllabBridge:batch_init(size)
     assert(self.size == size)
     local batch = {}
-    local obs = py.eval('reset()')
+    local obs, mind = unpack(py.call('reset'))
+    self.obs = obs
+    self.replay = nil
     for i = 1, size do
-        batch[i] = {obs = obs[i], done = false, t = 0}
+        batch[i] = {done = false, t = 0}
     end
 
     if not self.opts.rllab_cont_action and self.opts.nactions > 1 then
@@ -33,7 +51,6 @@ function RllabBridge:batch_init(size)
     end
 
     if self.opts.nminds > 1 then
-        local mind = py.eval('current_mind()')
         for i, g in pairs(batch) do
             g.current_mind = mind[i]
         end
@@ -43,13 +60,10 @@ function RllabBridge:batch_init(size)
 end
 
 function RllabBridge:batch_input(batch)
-    local input = torch.Tensor(self.size, self.opts.rllab_in_dim)
-    for i, g in pairs(batch) do
-        assert(self.opts.rllab_in_dim == g.obs:size(1), "set input dim to " .. g.obs:size(1))
-        input[i]:copy(g.obs)
-    end
-    input = input:view(#batch, -1)
+    return self:normalize(self.obs)
+end
 
+function RllabBridge:normalize(input)
     if self.opts.rllab_normalize then
         self.obs_max = self.obs_max or torch.zeros(1, self.opts.rllab_in_dim):fill(0.01)
         self.obs_min = self.obs_min or torch.zeros(1, self.opts.rllab_in_dim):fill(-0.01)
@@ -64,6 +78,38 @@ function RllabBridge:batch_input(batch)
 end
 
 function RllabBridge:batch_act(batch, action, active)
+    if self.replay then
+        -- the step was already taken by batch_rollout
+        local r = self.replay
+        r.t = r.t + 1
+        self:update(batch, active, {r.obs[r.t], r.reward[r.t], r.done[r.t], r.mind[r.t]})
+        return
+    end
+    self:update(batch, active, py.call('step',
+        self:rllab_action(action), active, self.opts.rllab_steps))
+end
+
+function RllabBridge:batch_rollout(batch, agent)
+    -- Runs the whole episode in the env workers with a numpy copy of the
+    -- model of agent (see rollout in rllab_worker.py), in a single call.
+    -- The episode then goes through batch_act as usual, which replays the
+    -- steps, and the actions to replay in agent:forward are returned, as
+    -- a table of the action heads for every step.
+    local res = py.call('rollout', agent:rollout_params(), self.opts.rllab_steps,
+        self.opts.max_steps, self.obs_min, self.obs_max)
+    res.t = 0
+    self.replay = res
+    local actions = {}
+    for t = 1, self.opts.max_steps do
+        actions[t] = {}
+        for k = 1, self.opts.naction_heads do
+            actions[t][k] = res.action[t]:narrow(2, k, 1)
+        end
+    end
+    return actions
+end
+
+function RllabBridge:rllab_action(action)
     if type(action) ~= 'table' then
         action = {action}
     end
@@ -85,16 +131,20 @@ function RllabBridge:batch_act(batch, action, active)
             end
         end
     end
+    return rllab_action
+end
 
-    local obs, reward, done, info = unpack(py.eval('step(action, active, steps)',
-        {action = rllab_action, active = active, steps = self.opts.rllab_steps}))
+function RllabBridge:update(batch, active, res)
+    -- apply the results of a step
+    local obs, reward, done, mind = unpack(res)
+    -- rows of inactive games keep their last observation
+    self.obs = obs
+    self.reward = reward
     for i, g in pairs(batch) do
         if active[i] == 1 then
-            g.obs = obs[i]
-            g.reward = reward[i]
-            g.done = done[i]
+            g.done = done[i] == 1
             if self.opts.nminds > 1 then
-                g.current_mind = info[i].current_mind
+                g.current_mind = mind[i]
             end
             g.t = g.t + 1
         end
@@ -102,63 +152,38 @@ function RllabBridge:batch_act(batch, action, active)
 end
 
 function RllabBridge:batch_reward(batch, active)
-    local reward = torch.Tensor(#batch):zero()
-    for i, g in pairs(batch) do
-        if active[i] == 1 then
-            reward[i] = g.reward
-        end
-    end
+    local reward = torch.Tensor(#batch):copy(self.reward)
+    reward:cmul(active)
     reward:mul(self.opts.rllab_reward_coeff)
     return reward
 end
 
 function RllabBridge:batch_terminal_reward(batch)
-    local reward = torch.Tensor(#batch):zero()
-    local r = py.eval('reward_terminal()')
-    for i = 1, #batch do
-        reward[i] = r[i]
-    end
+    local res = py.call('finish_episode')
+    local reward = torch.Tensor(#batch):copy(res.reward)
     reward:mul(self.opts.rllab_reward_coeff)
 
     if self.opts.nminds > 1 then
+        res.reward_mind:mul(self.opts.rllab_reward_coeff)
         for i, g in pairs(batch) do
             g.reward_terminal_mind = {}
             g.get_terminal_reward_mind = function(self, m)
                 return self.reward_terminal_mind[m]
             end
-        end
-        for m = 1, self.opts.nminds do
-            local mind = torch.Tensor(self.size):fill(m)
-            local r = py.eval('reward_terminal_mind(mind)', {mind = mind})
-            for i, g in pairs(batch) do
-                g.reward_terminal_mind[m] = r[i] * self.opts.rllab_reward_coeff
+            for m = 1, self.opts.nminds do
+                g.reward_terminal_mind[m] = res.reward_mind[i][m]
             end
         end
     end
 
-    local stat = py.eval('get_stat()')
     for i, g in pairs(batch) do
-        g.stat = stat[i]
+        g.stat = res.stat[i]
         g.type = g.stat.type
         g.stat.type = nil
-        if g.stat.test_pos or g.stat.switch_pos then
-            if __threadid == nil or __threadid == 1 then
-                local x = torch.zeros(1, 6)
-                if g.stat.test_pos then
-                    x:narrow(2,1,2):copy(g.stat.test_pos)
-                end
-                if g.stat.switch_pos then
-                    x:narrow(2,3,2):copy(g.stat.switch_pos)
-                    x:narrow(2,5,2):copy(g.stat.final_pos)
-                end
-                g.stat.position = {op = 'join', data = x}
-            end
-            g.stat.switch_pos = nil
-            g.stat.test_pos = nil
-            g.stat.final_pos = nil
+        if res.has_position[i] == 1 and (__threadid == nil or __threadid == 1) then
+            g.stat.position = {op = 'join', data = res.position:narrow(1, i, 1):float()}
         end
-        g.success = g.stat.success
-        g.stat.success = nil
+        g.success = res.success[i] == 1
     end
 
     return reward
@@ -167,6 +192,27 @@ end
 function RllabBridge:batch_update(batch, active)
 end
 
+function RllabBridge:lanes(n)
+    -- Splits the batch into n lanes that are stepped asynchronously, see
+    -- RllabLane. Results of a lane are taken by batch_sync.
+    local lanes = {}
+    for l = 1, n do
+        local lo = math.floor(self.size * (l - 1) / n)
+        local hi = math.floor(self.size * l / n)
+        lanes[l] = RllabLane(self, lo, hi - lo)
+    end
+    return lanes
+end
+
+function RllabBridge:batch_sync()
+    -- waits for the step sent by a lane, if any
+    local lane = self.pending
+    if lane then
+        self.pending = nil
+        lane:update(lane.batch, lane.active, py.recv_result())
+    end
+end
+
 function RllabBridge:batch_active(batch)
     local active = torch.Tensor(#batch):zero()
     for i, g in pairs(batch) do
@@ -188,18 +234,67 @@ function RllabBridge:batch_success(batch)
 end
 
 function RllabBridge:render()
-    py.exec('render()')
+    py.call('render')
 end
 
 -- to make video
 -- ffmpeg -framerate 15 -i swim_%d.png -c:v libx264 -profile:v high -crf 20 -pix_fmt yuv420p out.mp4
 function RllabBridge:save_image(g, path)
-    local img = py.eval('render(True)')
-    img = img:permute(3, 1, 2):div(256)
+    local img = py.call('render', true)
+    img = img:permute(3, 1, 2):float():div(256)
     image.save(path .. '_' .. g.t .. '.png', img)
 end
 
+function RllabBridge:get_profile()
+    -- per-command counts and times of the env worker since the last call,
+    -- see Profile in worker.py
+    return py.call('profile_stats')
+end
+
 function RllabBridge:get_nactions()
     assert(self.opts.rllab_cont_action == false)
-    return py.eval('num_actions()')
+    return py.call('num_actions')
+end
+
+
+-- Rows [lo, lo + size) of the batch of an RllabBridge. batch_act only
+-- sends the step, so the model can run on another lane while the envs of
+-- this one are stepped. One step is in flight at a time: sending waits
+-- for the previous one, and batch_sync must be called before using the
+-- results of a lane.
+local RllabLane = torch.class('RllabLane', 'RllabBridge')
+
+function RllabLane:__init(bridge, lo, size)
+    self.bridge = bridge
+    self.opts = bridge.opts
+    self.lo = lo
+    self.size = size
+end
+
+function RllabLane:batch_init(batch)
+    self.batch = {}
+    for i = 1, self.size do
+        self.batch[i] = batch[self.lo + i]
+    end
+    self.obs = self.bridge.obs:narrow(1, self.lo + 1, self.size)
+    return self.batch
+end
+
+function RllabLane:normalize(input)
+    -- normalization statistics are shared by all lanes
+    return self.bridge:normalize(input)
+end
+
+function RllabLane:batch_act(batch, action, active)
+    self.bridge:batch_sync()
+    self.active = active
+    py.send_call('step', self:rllab_action(action), active,
+        self.opts.rllab_steps, self.lo, self.lo + self.size)
+    self.bridge.pending = self
+end
+
+function RllabLane:batch_sync()
+    if self.bridge.pending == self then
+        self.bridge:batch_sync()
+    end
 end
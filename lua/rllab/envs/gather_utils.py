@@ -0,0 +1,126 @@
+import math
+
+import numpy as np
+
+APPLE = 0
+BOMB = 1
+
+
+def sensor_readings(objects, robot_xy, ori, n_bins, sensor_range,
+                    sensor_span=math.pi):
+    """Apple and bomb sensor readings of a gather robot.
+
+    objects is an (N, 3) array of (x, y, type) rows, robot_xy its (2,)
+    position and ori its orientation. Each object within range and span
+    lights the bin of its angle with intensity 1 - dist / sensor_range,
+    and the closest object of a type wins the bin.
+
+    All envs of a batch can be done at once by giving (E, N, 3) objects,
+    (E, 2) positions and (E,) orientations, padding the object lists with
+    rows of type -1. The result is (n_bins,) apple and bomb readings, or
+    (E, n_bins) of each for a batch.
+    """
+    objects = np.asarray(objects, dtype='float64')
+    robot_xy = np.asarray(robot_xy, dtype='float64')
+    batch_shape = robot_xy.shape[:-1]
+    robot_xy = robot_xy.reshape(-1, 1, 2)
+    nenv = robot_xy.shape[0]
+    objects = objects.reshape((nenv,) + objects.shape[-2:])
+    ori = np.asarray(ori, dtype='float64').reshape(-1, 1)
+
+    readings = np.zeros(nenv * 2 * n_bins)
+    if objects.shape[1] > 0:
+        dx = objects[:, :, 0] - robot_xy[:, :, 0]
+        dy = objects[:, :, 1] - robot_xy[:, :, 1]
+        typ = objects[:, :, 2].astype(int)
+        dist = np.sqrt(dx * dx + dy * dy)
+        angle = (np.arctan2(dy, dx) - ori) % (2 * math.pi)
+        angle[angle > math.pi] -= 2 * math.pi
+        half_span = sensor_span * 0.5
+        bin_res = sensor_span / n_bins
+        # only include readings for objects within range and span, the
+        # others (and padding) get intensity 0 which never lights a bin
+        seen = (dist <= sensor_range) & (np.abs(angle) <= half_span) & (typ >= 0)
+        intensity = np.where(seen, 1.0 - dist / sensor_range, 0.)
+        bins = ((angle + half_span) / bin_res).astype(int)
+        bins = np.maximum(np.minimum(bins, n_bins - 1), 0)
+        idx = (np.arange(nenv)[:, None] * 2 + np.maximum(typ, 0)) * n_bins + bins
+        # closer objects occlude the farther ones in the same bin
+        np.maximum.at(readings, idx.ravel(), intensity.ravel())
+
+    readings = readings.reshape(batch_shape + (2, n_bins))
+    return readings[..., APPLE, :], readings[..., BOMB, :]
+
+
+def sensor_readings_loop(objects, robot_xy, ori, n_bins, sensor_range,
+                         sensor_span=math.pi):
+    """sensor_readings of a single robot, as a loop over its objects from
+    the farthest to the closest. With the few objects of an env this is
+    cheaper than the vectorized form, which is mostly numpy call overhead
+    there, and it gives the same readings to the bit."""
+    robot_x, robot_y = float(robot_xy[0]), float(robot_xy[1])
+    ori = float(np.ravel(ori)[0])
+    readings = [[0.] * n_bins, [0.] * n_bins]
+    half_span = sensor_span * 0.5
+    bin_res = sensor_span / n_bins
+    objects = sorted(np.asarray(objects).tolist(), key=lambda o:
+                     (o[0] - robot_x) ** 2 + (o[1] - robot_y) ** 2, reverse=True)
+    for ox, oy, typ in objects:
+        dx, dy = ox - robot_x, oy - robot_y
+        dist = math.sqrt(dx * dx + dy * dy)
+        if dist > sensor_range:
+            continue
+        angle = (math.atan2(dy, dx) - ori) % (2 * math.pi)
+        if angle > math.pi:
+            angle -= 2 * math.pi
+        if abs(angle) > half_span:
+            continue
+        b = max(min(int((angle + half_span) / bin_res), n_bins - 1), 0)
+        # closer objects come later and occlude the farther ones
+        readings[int(typ)][b] = 1.0 - dist / sensor_range
+    return np.array(readings[APPLE]), np.array(readings[BOMB])
+
+
+def pad_objects(objects_list):
+    """Stacks the (N_i, 3) object arrays of several envs into (E, N, 3)
+    for sensor_readings, padding with rows of type -1."""
+    n = max([len(o) for o in objects_list] + [0])
+    out = np.zeros((len(objects_list), n, 3))
+    out[:, :, 2] = -1
+    for i, o in enumerate(objects_list):
+        out[i, :len(o)] = o
+    return out
+
+
+_SPAWN_CELLS = {}
+
+
+def spawn_cells(activity_range, robot_object_spacing):
+    """(M, 2) grid cells objects can be placed on: even coordinates in
+    [-activity_range, activity_range) that are at least
+    robot_object_spacing away from the robot's initial position. Computed
+    once per config and shared by all envs of the process."""
+    key = (activity_range, robot_object_spacing)
+    if key not in _SPAWN_CELLS:
+        r = np.arange(int(-activity_range / 2), int(activity_range / 2)) * 2
+        x, y = [c.ravel() for c in np.meshgrid(r, r, indexing='ij')]
+        far = x ** 2 + y ** 2 >= robot_object_spacing ** 2
+        cells = np.stack([x[far], y[far]], axis=1).astype('float64')
+        cells.setflags(write=False)
+        _SPAWN_CELLS[key] = cells
+    return _SPAWN_CELLS[key]
+
+
+def spawn_layouts(cells, n_apples, n_bombs, count, rng=np.random):
+    """count layouts of (n_apples + n_bombs, 3) objects, apples first, on
+    distinct cells drawn uniformly with rng."""
+    n = n_apples + n_bombs
+    assert n <= len(cells), \
+        'only {} cells to place {} objects'.format(len(cells), n)
+    # the first n of a random permutation of the cells, for each layout
+    pick = np.argsort(rng.uniform(size=(count, len(cells))), axis=1)[:, :n]
+    layouts = np.empty((count, n, 3))
+    layouts[:, :, :2] = cells[pick]
+    layouts[:, :n_apples, 2] = APPLE
+    layouts[:, n_apples:, 2] = BOMB
+    return layouts
@@ -0,0 +1,239 @@
+import numpy as np
+
+
+def with_global_rng(rng, f, *args):
+    # Calls f, library code drawing from np.random, with the state of rng,
+    # which then keeps the state f leaves.
+    np.random.set_state(rng.get_state())
+    try:
+        return f(*args)
+    finally:
+        rng.set_state(np.random.get_state())
+
+
+class SelfPlay(object):
+    """Self-play rules of the rllab envs for a batch of envs, held as
+    arrays by env: the choice between test task and self-play episodes,
+    Alice switching to Bob, Bob's success at reaching the target state,
+    the per-mind terminal rewards and the stats.
+
+    Envs only simulate. The controller is given, for every env, the state
+    Bob has to reach (sp_state, compared after multiplying by
+    state_coeffs) and a position for the stats, of which the first
+    dist_dims make switch_dist. It adds [mode, time, target] to the
+    observations of the envs. Bob starts again from the initial state of
+    the episode in repeat mode, and always with repeat_only. Test tasks
+    end after sp_test_max_steps only with test_max_steps, as the gather
+    envs do. Random draws come from rngs, one per env. Methods taking idx
+    concern those envs only.
+    """
+
+    def __init__(self, opts, rngs, state_coeffs, dist_dims=2, repeat_only=False,
+                 test_max_steps=False):
+        self.opts = opts
+        self.rngs = rngs
+        self.size = size = len(rngs)
+        self.state_coeffs = np.asarray(state_coeffs, dtype='float64')
+        self.dist_dims = dist_dims
+        self.repeat = repeat_only or opts['sp_mode'] == 'repeat'
+        self.max_test_steps = opts['sp_test_max_steps'] if test_max_steps else 0
+        self.max_steps = opts['max_steps']
+        self.total_step_count = np.zeros(size, dtype='int64')
+        self.total_step_count_test = np.zeros(size, dtype='int64')
+
+    def choose(self):
+        # Picks test task or self-play for the next episodes, before the
+        # envs are reset. Returns test_mode.
+        size = self.size
+        if int(self.opts['nminds']) == 1:
+            self.test_mode = np.ones(size, dtype='bool')
+        elif self.opts['sp_test_rate_bysteps']:
+            self.test_mode = self.total_step_count_test < \
+                self.total_step_count * self.opts['sp_test_rate']
+        else:
+            self.test_mode = np.array([rng.uniform() for rng in self.rngs]) \
+                < self.opts['sp_test_rate']
+        self.current_mind = np.where(self.test_mode, 2, 1)
+        self.current_time = np.zeros(size, dtype='int64')
+        self.switch_t = np.zeros(size, dtype='int64')
+        self.switch_count = np.zeros(size, dtype='int64')
+        self.switch_dist = np.zeros(size)
+        self.switch_pos = np.zeros((size, 2))
+        self.success = np.zeros(size, dtype='bool')
+        return self.test_mode
+
+    def start(self, state, pos):
+        # sp_state and positions of the envs once reset
+        self.target = np.array(state, dtype='float64')
+        self.initial_pos = np.array(pos, dtype='float64')
+
+    def observe(self, obs, idx=slice(None)):
+        # observations of envs idx with [mode, time, target] added
+        test = self.test_mode[idx]
+        extra = np.zeros((len(test), 2 + self.target.shape[1]))
+        extra[:, 0] = np.where(test, 1, -1)
+        extra[:, 1] = np.where(test, 0, self.current_time[idx] / self.max_steps)
+        extra[:, 2:] = np.where(test[:, None], 0, self.target[idx])
+        return np.concatenate([np.asarray(obs).reshape(len(test), -1), extra], 1)
+
+    def step(self, idx, switch, state, pos, reward, done, success):
+        # Applies the rules to envs idx after a step of their simulation.
+        # switch is Alice's switch action, state and pos as for start, and
+        # reward, done and success are those of the test task; for self-play
+        # done means the env cannot go on. Returns the reward and done of
+        # the step, and which of the envs must go back to their initial
+        # state.
+        self.current_time[idx] += 1
+        self.total_step_count[idx] += 1
+        test = self.test_mode[idx]
+        self.total_step_count_test[idx[test]] += 1
+        reward = np.where(test, reward, 0).astype('float64')
+        done = np.array(done, dtype='bool')
+        success = np.where(test, success, False)
+        if self.max_test_steps > 0:
+            over = test & (self.current_time[idx] > self.max_test_steps)
+            done |= over
+            success &= ~over
+
+        rest = ~test & ~done
+        mind = self.current_mind[idx]
+        alice = rest & (mind == 1) & (np.asarray(switch) == 1)
+        bob = rest & (mind == 2)
+        state = np.asarray(state, dtype='float64')
+        dist = np.sqrt((((self.target[idx] - state) * self.state_coeffs) ** 2).sum(1))
+        success[bob] = dist[bob] < self.opts['sp_state_thres']
+        done[bob] = success[bob]
+        if self.opts['sp_reward_bob_step']:
+            reward[bob] = -self.opts['sp_reward_coeff']
+        self.success[idx] = success
+
+        k = idx[alice]
+        pos = np.asarray(pos, dtype='float64')[alice]
+        d = self.dist_dims
+        self.current_mind[k] = 2
+        self.switch_pos[k] = pos
+        self.switch_t[k] = self.current_time[k]
+        self.switch_dist[k] = np.sqrt(((pos[:, :d] - self.initial_pos[k, :d]) ** 2).sum(1))
+        self.switch_count[k] = 1
+        if not self.repeat:
+            return reward, done, np.zeros(len(idx), dtype='bool')
+        self.target[k] = state[alice]
+        return reward, done, alice
+
+    def reward_terminal(self):
+        return np.zeros(self.size)
+
+    def reward_terminal_mind(self, mind):
+        # per env, for mind (an int or an array by env)
+        coeff = self.opts['sp_reward_coeff']
+        alice = np.where(self.current_mind == 2,
+                         coeff * np.maximum(0, self.current_time - 2 * self.switch_t), 0)
+        bob = coeff * (self.switch_t - self.current_time)
+        if self.opts['sp_reward_bob_step']:
+            bob = np.zeros(self.size)
+        return np.where(self.test_mode, 0, np.where(np.asarray(mind) == 1, alice, bob))
+
+    def get_stat(self, pos):
+        # list of the stats of every env, pos are their current positions
+        stats = []
+        for i in range(self.size):
+            stat = dict(switch_t=int(self.switch_t[i]),
+                        switch_count=int(self.switch_count[i]),
+                        switch_dist=float(self.switch_dist[i]))
+            if self.test_mode[i]:
+                stat.update(type='test_task', test_task_count=1,
+                            test_pos=np.array(pos[i], dtype='float64'),
+                            test_steps=int(self.current_time[i]))
+            else:
+                stat.update(type='self_play', self_play_count=1,
+                            return_t=int(self.current_time[i] - self.switch_t[i]),
+                            switch_pos=self.switch_pos[i].copy(),
+                            final_pos=np.array(pos[i], dtype='float64'))
+            stat['success'] = bool(self.success[i])
+            stats.append(stat)
+        return stats
+
+
+class SelfPlayEnvs(object):
+    """A batch of self-play envs whose simulation is one PHYSICS object per
+    env (Box2D or MuJoCo), stepped one by one, under the rules of a
+    SelfPlay for all of them. Batched like VecSPMountainCarEnv, see
+    BatchRunner in rllab_worker.py.
+
+    PHYSICS(opts, rng) has reset(test_mode) and restart(), which return
+    its observation, step(action) returning the observation and the
+    reward, done and success of the test task, sp_state(), position(),
+    sp_state_coeffs and the DIST_DIMS, REPEAT_ONLY and TEST_MAX_STEPS of
+    SelfPlay. A PHYSICS with a static batch_obs(envs) returns None as
+    observation, and batch_obs gives those of all the envs reset or
+    stepped in one call. Each env draws from rng, a RandomState of its
+    own seed, so results do not depend on how the batch is split. A
+    physics calls library code whose np.random draws matter through
+    with_global_rng; the action and observation noise Box2D and MuJoCo
+    draw at every step is scaled by 0 in these envs, so steps are left on
+    np.random.
+    """
+    batched = True
+    PHYSICS = None
+
+    def __init__(self, opts, seeds):
+        self.rngs = [np.random.RandomState(seed) for seed in seeds]
+        self.envs = [self.PHYSICS(opts, rng) for rng in self.rngs]
+        env = self.envs[0]
+        self.sp = SelfPlay(opts, self.rngs, env.sp_state_coeffs,
+                           env.DIST_DIMS, env.REPEAT_ONLY, env.TEST_MAX_STEPS)
+
+    def states(self, idx):
+        return np.array([self.envs[i].sp_state() for i in idx])
+
+    def positions(self, idx):
+        return np.array([self.envs[i].position() for i in idx])
+
+    def reset(self):
+        test = self.sp.choose()
+        obs = [env.reset(test[i]) for i, env in enumerate(self.envs)]
+        idx = np.arange(len(self.envs))
+        obs = self.physics_obs(idx, obs)
+        self.sp.start(self.states(idx), self.positions(idx))
+        return self.sp.observe(obs), self.sp.current_mind.copy()
+
+    def step(self, action, idx):
+        # Steps envs idx with action (len(idx), naction_heads) and returns
+        # their obs, reward, done and current mind. The last action head is
+        # Alice's switch.
+        action = np.asarray(action)
+        res = [self.envs[i].step(a) for i, a in zip(idx, action)]
+        obs = [r[0] for r in res]
+        reward, done, success = [np.array([r[j] for r in res]) for j in [1, 2, 3]]
+        reward, done, restart = self.sp.step(
+            idx, action[:, -1], self.states(idx), self.positions(idx),
+            reward, done, success)
+        # Bob takes over from the initial state
+        for j in np.nonzero(restart)[0]:
+            obs[j] = self.envs[idx[j]].restart()
+        obs = self.physics_obs(idx, obs)
+        return self.sp.observe(obs, idx), reward, done, self.sp.current_mind[idx].copy()
+
+    def physics_obs(self, idx, obs):
+        # observations of envs idx, obs as their physics returned them
+        batch_obs = getattr(self.PHYSICS, 'batch_obs', None)
+        if batch_obs is None:
+            return obs
+        return batch_obs([self.envs[i] for i in idx])
+
+    def reward_terminal(self):
+        return self.sp.reward_terminal()
+
+    def reward_terminal_mind(self, mind):
+        return self.sp.reward_terminal_mind(mind)
+
+    def get_stat(self):
+        return self.sp.get_stat(self.positions(range(len(self.envs))))
+
+    def render(self, get_image):
+        # the first env only
+        env = self.envs[0]
+        env.render()
+        if get_image:
+            data, w, h = env.get_viewer().get_image()
+            return np.fromstring(data, dtype='uint8').reshape(h, w, 3)[::-1, :, :]
@@ -28,34 +28,97 @@
 # SOFTWARE.
 
 import math
+import os
 import os.path as osp
 import tempfile
 import xml.etree.ElementTree as ET
-from ctypes import byref
+from multiprocessing.util import Finalize
 
 import numpy as np
-import theano
 
 from rllab import spaces
 from rllab.core.serializable import Serializable
-from rllab.envs.base import Env, Step
-from rllab.envs.mujoco.gather.embedded_viewer import EmbeddedViewer
+from rllab.envs.base import Env
 from rllab.envs.mujoco.mujoco_env import BIG
 from rllab.misc import autoargs
 from rllab.misc.overrides import overrides
-from rllab.mujoco_py import MjViewer, MjModel, mjcore, mjlib, \
-    mjextra, glfw
 
-from rllab.envs.mujoco.gather.gather_env import GatherViewer
-
-APPLE = 0
-BOMB = 1
+from .gather_utils import APPLE, BOMB, sensor_readings, sensor_readings_loop, \
+    pad_objects, spawn_cells, spawn_layouts
+from .self_play import with_global_rng
 
 MODEL_DIR = osp.abspath(osp.dirname(__file__))
 
+# model files with walls, by (MODEL_CLASS, activity_range)
+_MODEL_FILES = {}
+
+
+def _remove_model_files(pid):
+    for file_path, owner in list(_MODEL_FILES.values()):
+        if owner == pid and osp.exists(file_path):
+            os.remove(file_path)
+
+
+def model_file(model_cls, activity_range):
+    # Writes the model of model_cls walled in at activity_range, once per
+    # process and config. Files are removed when the process that wrote
+    # them exits, forked env pool workers included.
+    key = (model_cls, activity_range)
+    if key in _MODEL_FILES:
+        return _MODEL_FILES[key][0]
+    xml_path = osp.join(MODEL_DIR, model_cls.FILE)
+    tree = ET.parse(xml_path)
+    worldbody = tree.find(".//worldbody")
+    attrs = dict(
+        type="box", conaffinity="1", rgba="0.8 0.9 0.8 1", condim="3"
+    )
+    walldist = activity_range + 1
+    ET.SubElement(
+        worldbody, "geom", dict(
+            attrs,
+            name="wall1",
+            pos="0 -%d 0" % walldist,
+            size="%d.5 0.5 1" % walldist))
+    ET.SubElement(
+        worldbody, "geom", dict(
+            attrs,
+            name="wall2",
+            pos="0 %d 0" % walldist,
+            size="%d.5 0.5 1" % walldist))
+    ET.SubElement(
+        worldbody, "geom", dict(
+            attrs,
+            name="wall3",
+            pos="-%d 0 0" % walldist,
+            size="0.5 %d.5 1" % walldist))
+    ET.SubElement(
+        worldbody, "geom", dict(
+            attrs,
+            name="wall4",
+            pos="%d 0 0" % walldist,
+            size="0.5 %d.5 1" % walldist))
+    fd, file_path = tempfile.mkstemp(suffix='.xml', text=True)
+    os.close(fd)
+    tree.write(file_path)
+    pid = os.getpid()
+    if not any(owner == pid for _, owner in _MODEL_FILES.values()):
+        # multiprocessing runs these at exit of the main process and of
+        # its children, and drops inherited ones on fork
+        Finalize(None, _remove_model_files, args=(pid,), exitpriority=0)
+    _MODEL_FILES[key] = (file_path, pid)
+    return file_path
+
+
 class SPGatherEnv(Env, Serializable):
+    # Physics of the self-play gather envs, the rules are in SelfPlay.
+    # Observations are taken with batch_obs, for all the envs stepped.
     MODEL_CLASS = None
     ORI_IND = None
+    DIST_DIMS = 2
+    REPEAT_ONLY = False
+    TEST_MAX_STEPS = True
+    # number of object layouts generated at once for test episodes
+    LAYOUT_RESERVOIR = 64
 
     @autoargs.arg('n_apples', type=int,
                   help='Number of apples in each episode')
@@ -76,7 +139,7 @@ class SPGatherEnv(Env, Serializable):
                   help='Maximum sensor span (how wide it can span), in '
                        'radians')
     def __init__(
-            self, opts,
+            self, opts, rng,
             n_apples=8,
             n_bombs=8,
             activity_range=6.,
@@ -88,6 +151,7 @@ class SPGatherEnv(Env, Serializable):
             *args, **kwargs
     ):
         self.opts = opts
+        self.rng = rng
         self.sp_state_coeffs = np.ones(13)
         if self.opts['sp_loc_only']:
             self.sp_state_coeffs[2:] = 0
@@ -99,44 +163,14 @@ class SPGatherEnv(Env, Serializable):
         self.n_bins = n_bins
         self.sensor_range = sensor_range
         self.sensor_span = sensor_span
-        self.objects = []
+        # (x, y, type) rows
+        self.objects = np.zeros((0, 3))
+        self.layouts = []
         super(SPGatherEnv, self).__init__(*args, **kwargs)
         model_cls = self.__class__.MODEL_CLASS
         if model_cls is None:
             raise "MODEL_CLASS unspecified!"
-        xml_path = osp.join(MODEL_DIR, model_cls.FILE)
-        tree = ET.parse(xml_path)
-        worldbody = tree.find(".//worldbody")
-        attrs = dict(
-            type="box", conaffinity="1", rgba="0.8 0.9 0.8 1", condim="3"
-        )
-        walldist = self.activity_range + 1
-        ET.SubElement(
-            worldbody, "geom", dict(
-                attrs,
-                name="wall1",
-                pos="0 -%d 0" % walldist,
-                size="%d.5 0.5 1" % walldist))
-        ET.SubElement(
-            worldbody, "geom", dict(
-                attrs,
-                name="wall2",
-                pos="0 %d 0" % walldist,
-                size="%d.5 0.5 1" % walldist))
-        ET.SubElement(
-            worldbody, "geom", dict(
-                attrs,
-                name="wall3",
-                pos="-%d 0 0" % walldist,
-                size="0.5 %d.5 1" % walldist))
-        ET.SubElement(
-            worldbody, "geom", dict(
-                attrs,
-                name="wall4",
-                pos="%d 0 0" % walldist,
-                size="0.5 %d.5 1" % walldist))
-        _, file_path = tempfile.mkstemp(text=True)
-        tree.write(file_path)
+        file_path = model_file(model_cls, self.activity_range)
         # pylint: disable=not-callable
         inner_env = model_cls(*args, file_path=file_path, **kwargs)
         # pylint: enable=not-callable
@@ -147,224 +181,119 @@ class SPGatherEnv(Env, Serializable):
         assert self.opts['rllab_cont_action'], 'set rllab_cont_action to true'
         assert self.inner_env.action_bounds[1][0] == self.opts['rllab_cont_limit'], \
             'set rllab_cont_limit to {}'.format(self.inner_env.action_bounds[1][0])
-        self.total_step_count = 0
-        self.total_step_count_test = 0
-
-    def reset(self):
-        # self-play stuff
-        self.current_time = 0
-        self.stat = dict()
-        self.stat['switch_t'] = 0
-        self.stat['switch_count'] = 0
-        self.stat['switch_dist'] = 0
-        self.switch_pos = np.zeros(2)
-        self.test_mode = False
-        if int(self.opts['nminds']) == 1:
-            self.test_mode = True
-        elif self.opts['sp_test_rate_bysteps']:
-            if self.total_step_count_test < self.total_step_count * self.opts['sp_test_rate']:
-                self.test_mode = True
-        elif np.random.uniform() < self.opts['sp_test_rate']:
-            self.test_mode = True
+        # see cached
+        self.physics_version = 0
+        self.cache_version = -1
+        self.cache = dict()
 
-        if self.test_mode:
-            self.current_mind = 2
-            self.stat['type'] = 'test_task'
-            self.stat['test_task_count'] = 1
-        else:
-            self.current_mind = 1
-            self.stat['type'] = 'self_play'
-            self.stat['self_play_count'] = 1
+    def physics_changed(self, obs=None):
+        # Called whenever the state of inner_env changes (step, reset or a
+        # restored state). obs is the observation inner_env returned for the
+        # new state, if any.
+        self.physics_version += 1
+        if obs is not None:
+            self.cached('self_obs', lambda: obs)
+
+    def cached(self, key, compute):
+        # Value of compute() for the current state of inner_env, computed
+        # once per state. Quantities that also depend on the objects must be
+        # dropped from self.cache when they change.
+        if self.cache_version != self.physics_version:
+            self.cache = dict()
+            self.cache_version = self.physics_version
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key]
+
+    def self_obs(self):
+        return self.cached('self_obs', self.inner_env.get_current_obs)
+
+    def torso_pos(self):
+        return self.cached('torso_pos', lambda: self.inner_env.get_body_com("torso")[:2].copy())
 
-        # super(GatherMDP, self).reset()
-        self.objects = []
+    def reset(self, test_mode=True):
+        self.test_mode = test_mode
         if self.test_mode:
-            existing = set()
-            while len(self.objects) < self.n_apples:
-                x = np.random.randint(-self.activity_range / 2,
-                                      self.activity_range / 2) * 2
-                y = np.random.randint(-self.activity_range / 2,
-                                      self.activity_range / 2) * 2
-                # regenerate, since it is too close to the robot's initial position
-                if x ** 2 + y ** 2 < self.robot_object_spacing ** 2:
-                    continue
-                if (x, y) in existing:
-                    continue
-                typ = APPLE
-                self.objects.append((x, y, typ))
-                existing.add((x, y))
-            while len(self.objects) < self.n_apples + self.n_bombs:
-                x = np.random.randint(-self.activity_range / 2,
-                                      self.activity_range / 2) * 2
-                y = np.random.randint(-self.activity_range / 2,
-                                      self.activity_range / 2) * 2
-                # regenerate, since it is too close to the robot's initial position
-                if x ** 2 + y ** 2 < self.robot_object_spacing ** 2:
-                    continue
-                if (x, y) in existing:
-                    continue
-                typ = BOMB
-                self.objects.append((x, y, typ))
-                existing.add((x, y))
-
-        self.inner_env.reset()
-        self.target_obs = self.inner_env.get_current_obs()
-        self.initial_pos = self.inner_env.get_current_obs().flat[:2].copy()
+            self.objects = self.next_layout()
+        else:
+            self.objects = np.zeros((0, 3))
+        # the initial noise of MuJoCo envs comes from np.random
+        self.physics_changed(with_global_rng(self.rng, self.inner_env.reset))
         self.init_full_state = self.inner_env._full_state.copy()
-        return self.get_current_obs()
+
+    def restart(self):
+        self.physics_changed(self.inner_env.reset(init_state=self.init_full_state))
+
+    def next_layout(self):
+        # Layouts are drawn in bulk on the precomputed spawn grid, which
+        # keeps rejection sampling out of reset.
+        if len(self.layouts) == 0:
+            cells = spawn_cells(self.activity_range, self.robot_object_spacing)
+            self.layouts = list(spawn_layouts(
+                cells, self.n_apples, self.n_bombs, self.LAYOUT_RESERVOIR, self.rng))
+        return self.layouts.pop()
 
     def step(self, action_all):
-        self.current_time += 1
-        action = action_all[:2]
-        _, _, done, info = self.inner_env.step(action)
-        if done:
-            assert False
-            return Step(self.get_current_obs(), -10, done, **info)
-        com = self.inner_env.get_body_com("torso")
-        x, y = com[:2]
+        # the test task ends once all objects are caught
+        obs, _, done, _ = self.inner_env.step(action_all[:2])
+        self.physics_changed(obs)
+        assert not done
+        x, y = self.torso_pos()
         reward = 0
-        self.total_step_count += 1
+        done = False
         if self.test_mode:
-            self.total_step_count_test += 1
-            new_objs = []
-            for obj in self.objects:
-                ox, oy, typ = obj
-                # object within zone!
-                if (ox - x) ** 2 + (oy - y) ** 2 < self.catch_range ** 2:
-                    if typ == APPLE:
-                        reward = reward + 1
-                    else:
-                        reward = reward - 1
-                else:
-                    new_objs.append(obj)
-            self.objects = new_objs
+            # objects within zone!
+            caught = (self.objects[:, 0] - x) ** 2 + (self.objects[:, 1] - y) ** 2 \
+                < self.catch_range ** 2
+            if caught.any():
+                typ = self.objects[caught, 2]
+                reward = int(np.sum(typ == APPLE)) - int(np.sum(typ != APPLE))
+                self.objects = self.objects[~caught]
+                self.cache.pop('readings', None)
             done = len(self.objects) == 0
-            self.success = done
-            if self.opts['sp_test_max_steps'] > 0:
-                if self.current_time > self.opts['sp_test_max_steps']:
-                    done = True
-                    self.success = False
-        else:
-            reward = 0
-            done = False
-            self.success = False
-            if self.current_mind == 1:
-                if action_all[2] == 1:
-                    self.switch_mind()
-            else:
-                target_state = np.multiply(self.sp_state_coeffs, self.target_obs)
-                current_state = np.multiply(self.sp_state_coeffs, self.inner_env.get_current_obs())
-                self.target_dist = np.linalg.norm(target_state - current_state)
-                self.success = bool(self.target_dist < self.opts['sp_state_thres'])
-                done = self.success
-                if self.opts['sp_reward_bob_step']:
-                    reward = -self.opts['sp_reward_coeff']
-
-        return Step(self.get_current_obs(), reward, done, info=dict(current_mind = self.current_mind))
-
-    def switch_mind(self):
-        self.current_mind = 2
-        self.switch_pos = self.inner_env.get_current_obs().flat[:2].copy()
-        self.stat['switch_t'] = self.current_time
-        self.stat['switch_dist'] = np.linalg.norm(self.switch_pos - self.initial_pos)
-        self.stat['switch_count'] = 1
-        if self.opts['sp_mode'] == 'repeat':
-            self.target_obs = self.inner_env.get_current_obs()
-            self.inner_env.reset(init_state=self.init_full_state)
+        return None, reward, done, done
+
+    def sp_state(self):
+        return self.self_obs()
+
+    def position(self):
+        return self.self_obs().flat[:2].copy()
 
     def get_readings(self):
-        # compute sensor readings
-        # first, obtain current orientation
-        apple_readings = np.zeros(self.n_bins)
-        bomb_readings = np.zeros(self.n_bins)
-        robot_x, robot_y = self.inner_env.get_body_com("torso")[:2]
-        # sort objects by distance to the robot, so that farther objects'
-        # signals will be occluded by the closer ones'
-        sorted_objects = sorted(
-            self.objects, key=lambda o:
-            (o[0] - robot_x) ** 2 + (o[1] - robot_y) ** 2)[::-1]
-        # fill the readings
-        bin_res = self.sensor_span / self.n_bins
-        ori = self.get_ori()
-        # print ori*180/math.pi
-        for ox, oy, typ in sorted_objects:
-            # compute distance between object and robot
-            dist = ((oy - robot_y) ** 2 + (ox - robot_x) ** 2) ** 0.5
-            # only include readings for objects within range
-            if dist > self.sensor_range:
-                continue
-            angle = math.atan2(oy - robot_y, ox - robot_x) - ori
-            if math.isnan(angle):
-                import ipdb
-                ipdb.set_trace()
-            angle = angle % (2 * math.pi)
-            if angle > math.pi:
-                angle = angle - 2 * math.pi
-            if angle < -math.pi:
-                angle = angle + 2 * math.pi
-            # outside of sensor span - skip this
-            half_span = self.sensor_span * 0.5
-            if abs(angle) > half_span:
-                continue
-            bin_number = int((angle + half_span) / bin_res)
-            #    ((angle + half_span) +
-            #     ori) % (2 * math.pi) / bin_res)
-            intensity = 1.0 - dist / self.sensor_range
-            if typ == APPLE:
-                apple_readings[bin_number] = intensity
-            else:
-                bomb_readings[bin_number] = intensity
-        return apple_readings, bomb_readings
+        # compute sensor readings, closer objects' signals occlude the
+        # farther ones'
+        return self.cached('readings', lambda: sensor_readings_loop(
+            self.objects, self.torso_pos(),
+            self.get_ori(), self.n_bins, self.sensor_range, self.sensor_span))
+
+    @staticmethod
+    def batch_readings(envs):
+        # get_readings of several envs with the same sensor in one call
+        env = envs[0]
+        return sensor_readings(
+            pad_objects([e.objects for e in envs]),
+            [e.torso_pos() for e in envs],
+            [e.get_ori() for e in envs],
+            env.n_bins, env.sensor_range, env.sensor_span)
 
     def get_current_obs(self):
         # return sensor data along with data about itself
-        self_obs = self.inner_env.get_current_obs()
         apple_readings, bomb_readings = self.get_readings()
+        return np.concatenate([self.self_obs(), apple_readings, bomb_readings])
 
-        if self.test_mode:
-            mode = 1
-            target = np.zeros(13)
-            time = 0
-        else:
-            mode = -1
-            target = self.target_obs
-            time = self.current_time/self.opts['max_steps']
-
-        return np.concatenate([self_obs, apple_readings, bomb_readings, [mode, time], target])
-
-    def reward_terminal(self):
-        if not self.test_mode:
-            return 0
-        # return self.inner_env.get_body_com("torso")[0]
-        return 0
-
-    def reward_terminal_mind(self, mind):
-        if self.test_mode:
-            return 0
-        if mind == 1:
-            if self.current_mind == 2:
-                return self.opts['sp_reward_coeff'] * max(0, (self.current_time - 2 * self.stat['switch_t']))
-            else:
-                return 0
-        else:
-            if self.opts['sp_reward_bob_step']:
-                return 0
-            else:
-                return self.opts['sp_reward_coeff'] * (self.stat['switch_t'] - self.current_time)
-
-    def get_stat(self):
-        if self.test_mode:
-            self.stat['test_pos'] = self.inner_env.get_current_obs().flat[:2].copy()
-            self.stat['test_steps'] = self.current_time
-        else:
-            self.stat['return_t'] = self.current_time - self.stat['switch_t']
-            self.stat['switch_pos'] = self.switch_pos
-            self.stat['final_pos'] = self.inner_env.get_current_obs().flat[:2].copy()
-        self.stat['success'] = self.success
-        return self.stat
+    @staticmethod
+    def batch_obs(envs):
+        # get_current_obs of several envs, with their readings in one call
+        if len(envs) == 1:
+            return envs[0].get_current_obs()[None]
+        apple_readings, bomb_readings = SPGatherEnv.batch_readings(envs)
+        self_obs = np.array([e.self_obs() for e in envs])
+        return np.concatenate([self_obs, apple_readings, bomb_readings], 1)
 
     def get_viewer(self):
         if self.inner_env.viewer is None:
+            # imported on first use, it loads glfw and OpenGL
+            from rllab.envs.mujoco.gather.gather_env import GatherViewer
             self.inner_env.viewer = GatherViewer(self)
             self.inner_env.viewer.start()
             self.inner_env.viewer.set_model(self.inner_env.model)
@@ -399,4 +328,4 @@ class SPGatherEnv(Env, Serializable):
         self.inner_env.render()
 
     def get_ori(self): # get orientation
-        return self.inner_env.model.data.qpos[self.__class__.ORI_IND]
+        return self.cached('ori', lambda: self.inner_env.model.data.qpos[self.__class__.ORI_IND])
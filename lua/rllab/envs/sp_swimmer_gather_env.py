@@ -28,6 +28,7 @@
 # SOFTWARE.
 
 
+from .self_play import SelfPlayEnvs
 from .sp_gather_env import SPGatherEnv
 from .sp_swimmer_env import SPSwimmerEnv
 
@@ -36,3 +37,7 @@ class SPSwimmerGatherEnv(SPGatherEnv):
 
     MODEL_CLASS = SPSwimmerEnv
     ORI_IND = 2
+
+
+class SPSwimmerGatherEnvs(SelfPlayEnvs):
+    PHYSICS = SPSwimmerGatherEnv
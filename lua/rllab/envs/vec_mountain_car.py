@@ -0,0 +1,179 @@
+import numpy as np
+
+from .self_play import SelfPlay
+
+
+class VecSPMountainCarEnv(object):
+    """SPMountainCarEnv for a whole batch of carts, in numpy.
+
+    Same observations ([xpos, xvel, mode, time, target]) and rewards as
+    SPMountainCarEnvs, without Box2D, and the same SelfPlay rules and
+    stats. The cart is the box of mountain_car.xml.mako, which rests with
+    both bottom corners on the track y = height * (1 - cos(2 pi x /
+    width)). That leaves it one degree of freedom, q, the x of its rear
+    corner, over which its centre and angle are tabulated (see track).
+    It moves under gravity and the force along the box as Box2D moves it:
+    velocity first, then position, then the velocity is projected on the
+    track at the new position. Box2D also loses energy in the contacts
+    with the segments of the track, which is a drag of DRAG *
+    tanh(speed / DRAG_SPEED) here, fitted to the Box2D env.
+    benchmarks/bench_mountain_car.py compares both envs.
+
+    Envs are rows of arrays. step only moves the rows it is given, so
+    rllab_worker can step the active envs of a batch in one call, see
+    BatchRunner. Each env draws its random numbers from its own seed, in
+    the order SPMountainCarEnvs draws them, so results do not depend on
+    how the batch is split.
+    """
+    batched = True
+
+    DT = 0.05
+    GRAVITY = 10.  # of a default Box2D world
+    BOX = (0.2, 0.1)  # half extents
+    MASS = 5 * 0.4 * 0.2  # density * box area
+    INERTIA = MASS * (0.4 ** 2 + 0.2 ** 2) / 12
+    SKIN = 0.01  # Box2D keeps polygons this far apart
+    TRACK_HEIGHT = 1.
+    TRACK_WIDTH = 4.
+    INITIAL_POS = 0.
+    DRAG = 0.4
+    DRAG_SPEED = 1.
+
+    _track = None
+    # rendered area, (x, y) of its bottom left and top right corners
+    VIEW = ((-2.2, -0.2), (2.2, 2.2))
+
+    def __init__(self, opts, seeds, goal_cart_pos=0.6):
+        self.opts = opts
+        self.size = size = len(seeds)
+        self.rngs = [np.random.RandomState(seed) for seed in seeds]
+        self.max_cart_pos = 2
+        self.goal_cart_pos = goal_cart_pos
+        self.q = np.zeros(size)
+        self.qvel = np.zeros(size)
+        self.screen = None
+        # as SPMountainCarEnv
+        self.sp = SelfPlay(opts, self.rngs, np.ones(2), dist_dims=1, repeat_only=True)
+
+    @classmethod
+    def track(cls):
+        # Pose of the box over q on a grid: q, centre x and y, angle, their
+        # derivatives by q and the mass matrix m |dcentre/dq|^2 + I
+        # dangle/dq^2. Computed once per process.
+        if cls._track is None:
+            q = np.linspace(-2.6, 2.4, 50001)
+            k = 2 * np.pi / cls.TRACK_WIDTH
+            y = lambda x: cls.TRACK_HEIGHT * (1 - np.cos(k * x))
+            width = 2 * cls.BOX[0]
+            # front corner on the track, width away from the rear one
+            b = q + width
+            for _ in range(20):
+                dx, dy = b - q, y(b) - y(q)
+                dist = np.sqrt(dx * dx + dy * dy)
+                b -= (dist - width) * dist / (dx + dy * cls.TRACK_HEIGHT * k * np.sin(k * b))
+            angle = np.arctan2(y(b) - y(q), b - q)
+            up = cls.BOX[1] + cls.SKIN
+            x = (q + b) / 2 - up * np.sin(angle)
+            cy = (y(q) + y(b)) / 2 + up * np.cos(angle)
+            d = [np.gradient(v, q) for v in (x, cy, angle)]
+            mass = cls.MASS * (d[0] ** 2 + d[1] ** 2) + cls.INERTIA * d[2] ** 2
+            cls._track = (q, x, cy, angle) + tuple(d) + (mass,)
+        return cls._track
+
+    def pose(self, q):
+        # x, y, angle, their derivatives by q and the mass matrix at q
+        track = self.track()
+        return [np.interp(q, track[0], v) for v in track[1:]]
+
+    def xpos(self, idx=slice(None)):
+        return np.interp(self.q[idx], self.track()[0], self.track()[1])
+
+    def xvel(self, idx=slice(None)):
+        return np.interp(self.q[idx], self.track()[0], self.track()[4]) * self.qvel[idx]
+
+    def set_cart(self, idx, x, xvel):
+        track = self.track()
+        self.q[idx] = np.interp(x, track[1], track[0])
+        self.qvel[idx] = xvel / np.interp(self.q[idx], track[0], track[4])
+
+    def position(self, idx=slice(None)):
+        # also the state Bob has to reach
+        return np.stack([self.xpos(idx), self.xvel(idx)], 1)
+
+    def reset(self):
+        self.sp.choose()
+        self.set_cart(slice(None), self.INITIAL_POS,
+                      [rng.uniform(-1, 1) for rng in self.rngs])
+        self.initial_vel = self.xvel()
+        pos = self.position()
+        self.sp.start(pos, pos)
+        return self.sp.observe(pos), self.sp.current_mind.copy()
+
+    def step(self, action, idx):
+        # Steps envs idx with action (len(idx), 2) and returns their obs,
+        # reward, done and current mind
+        action = np.asarray(action)
+        force = np.clip(action[:, 0], -1, 1)
+        q, qvel = self.q[idx], self.qvel[idx]
+        _, _, angle, dx, dy, dangle, mass = self.pose(q)
+        # generalized force of the push and gravity, and the drag
+        f = force * (np.cos(angle) * dx + np.sin(angle) * dy) \
+            - self.MASS * self.GRAVITY * dy
+        qvel = qvel + self.DT * f / mass
+        path = np.sqrt(dx * dx + dy * dy)
+        drag = self.DRAG * np.tanh(np.abs(qvel) * path / self.DRAG_SPEED)
+        qvel = np.sign(qvel) * np.maximum(np.abs(qvel) - self.DT * drag * path / mass, 0)
+        q = q + self.DT * qvel
+        # only the part of the velocity along the track at q is kept
+        _, _, _, dx1, dy1, dangle1, mass1 = self.pose(q)
+        qvel *= (self.MASS * (dx * dx1 + dy * dy1) + self.INERTIA * dangle * dangle1) / mass1
+        self.q[idx], self.qvel[idx] = q, qvel
+        x = self.xpos(idx)
+        at_goal = x >= self.goal_cart_pos
+        pos = self.position(idx)
+        reward, done, restart = self.sp.step(
+            idx, action[:, 1], pos, pos, at_goal.astype('float64'),
+            at_goal | (np.abs(x) >= self.max_cart_pos), at_goal)
+        # Bob takes over from the initial state
+        restart = idx[restart]
+        self.set_cart(restart, self.INITIAL_POS, self.initial_vel[restart])
+        return self.sp.observe(self.position(idx), idx), reward, done, \
+            self.sp.current_mind[idx].copy()
+
+    def reward_terminal(self):
+        return self.sp.reward_terminal()
+
+    def reward_terminal_mind(self, mind):
+        return self.sp.reward_terminal_mind(mind)
+
+    def get_stat(self):
+        return self.sp.get_stat(self.position())
+
+    def image(self, height=240, width=440):
+        # (height, width, 3) uint8 picture of the first env: the track, the
+        # cart and the goal
+        (x0, y0), (x1, y1) = self.VIEW
+        x = np.linspace(x0, x1, width)[None, :]
+        y = np.linspace(y1, y0, height)[:, None]
+        img = np.full((height, width, 3), 255, dtype='uint8')
+        k = 2 * np.pi / self.TRACK_WIDTH
+        img[y <= self.TRACK_HEIGHT * (1 - np.cos(k * x))] = 160
+        img[:, np.abs(x[0] - self.goal_cart_pos) < (x1 - x0) / width] = (0, 160, 0)
+        cx, cy, angle = self.pose(self.q[:1])[:3]
+        c, s = np.cos(angle[0]), np.sin(angle[0])
+        u = (x - cx[0]) * c + (y - cy[0]) * s
+        v = (y - cy[0]) * c - (x - cx[0]) * s
+        img[(np.abs(u) <= self.BOX[0]) & (np.abs(v) <= self.BOX[1])] = (200, 40, 40)
+        return img
+
+    def render(self, get_image):
+        # the first env only, in a pygame window unless get_image
+        img = self.image()
+        if get_image:
+            return img
+        import pygame
+        if self.screen is None:
+            pygame.init()
+            self.screen = pygame.display.set_mode(img.shape[1::-1])
+        self.screen.blit(pygame.surfarray.make_surface(img.swapaxes(0, 1)), (0, 0))
+        pygame.display.flip()
@@ -1,103 +1,713 @@
+import importlib
+import os
 import sys
+import traceback
+import multiprocessing
+import threading
 import numpy as np
-from rllab.envs.normalized_env import NormalizedEnv
+from rpc import command
 
 sys.argv = []
 sys.argv.append("RLLab")
 
-def init(env_name, size, opts):
-    global envs
-    envs = []
-    for i in range(int(size)):
-        if env_name == 'SPSwimmer':
-            from envs.sp_swimmer_env import SPSwimmerEnv
-            envs.append(SPSwimmerEnv())
-        elif env_name == 'SPSwimmerGather':
-            from envs.sp_swimmer_gather_env import SPSwimmerGatherEnv
-            envs.append(SPSwimmerGatherEnv(opts))
-        elif env_name == 'SPMountainCar':
-            from envs.sp_mountain_car import SPMountainCarEnv
-            envs.append(SPMountainCarEnv(opts))
-        elif env_name == 'Swimmer':
-            from rllab.envs.mujoco.swimmer_env import SwimmerEnv
-            envs.append(SwimmerEnv())
-        else:
-            raise RuntimeError("wrong env name")
+# module, class and whether the constructor takes opts, by env name. The
+# modules are imported on first use, so a worker only loads the simulator
+# of its env, and env_server.py can load it ahead of time. The self-play
+# envs are batched (see BatchRunner), with their rules in envs/self_play.py.
+ENV_CLASSES = {
+    'SPSwimmer': ('envs.sp_swimmer_env', 'SPSwimmerEnv', False),
+    'SPSwimmerGather': ('envs.sp_swimmer_gather_env', 'SPSwimmerGatherEnvs', True),
+    'SPMountainCar': ('envs.sp_mountain_car', 'SPMountainCarEnvs', True),
+    'Swimmer': ('rllab.envs.mujoco.swimmer_env', 'SwimmerEnv', False),
+    'SPMountainCarVec': ('envs.vec_mountain_car', 'VecSPMountainCarEnv', True),
+}
+
+def env_class(env_name):
+    if env_name not in ENV_CLASSES:
+        raise RuntimeError("wrong env name")
+    module, name, _ = ENV_CLASSES[env_name]
+    return getattr(importlib.import_module(module), name)
+
+def make_env(env_name, opts, cls=None):
+    cls = cls or env_class(env_name)
+    env = cls(opts) if ENV_CLASSES[env_name][2] else cls()
+    if opts['rllab_normalize_rllab']:
+        from rllab.envs.normalized_env import NormalizedEnv
+        env = NormalizedEnv(env=env, normalize_obs=True)
+    return env
+
+def new_array(shape, dtype, shared):
+    # shared arrays are inherited by the pool processes forked after them
+    if not shared:
+        return np.zeros(shape, dtype=dtype)
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    buf = multiprocessing.RawArray('b', max(nbytes, 1))
+    return np.frombuffer(buf, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+class Buffers(object):
+    # per-env inputs and results of a step, indexed by env
+    def __init__(self, size, obs_dim, naction_heads, nminds, shared=False):
+        self.action = new_array((size, naction_heads), 'float64', shared)
+        self.active = new_array((size,), 'float64', shared)
+        self.obs = new_array((size, obs_dim), 'float32', shared)
+        self.reward = new_array((size,), 'float64', shared)
+        self.done = new_array((size,), 'bool', shared)
+        self.mind = new_array((size,), 'int64', shared)
+        # end of episode results, see finish_episode
+        self.reward_terminal = new_array((size,), 'float64', shared)
+        self.reward_mind = new_array((size, nminds), 'float64', shared)
+        self.success = new_array((size,), 'bool', shared)
+        self.position = new_array((size, 6), 'float64', shared)
+        self.has_position = new_array((size,), 'bool', shared)
+
+class EnvRunner(object):
+    # Runs envs [lo, lo + len(seeds)) of the batch. Each env has its own
+    # random state, swapped into np.random around every call, so results
+    # only depend on the seeds and not on how the batch is split.
+    def __init__(self, env_name, opts, lo, seeds, buf):
+        self.lo = lo
+        self.buf = buf
+        self.envs = []
+        self.rng_states = []
+        cls = env_class(env_name)
+        for seed in seeds:
+            np.random.seed(seed)
+            self.envs.append(make_env(env_name, opts, cls))
+            self.rng_states.append(np.random.get_state())
+        self.obs_dim = buf.obs.shape[1]
+
+    def call(self, name, *args):
+        return getattr(self, name)(*args)
+
+    def run(self, i, f, *args):
+        np.random.set_state(self.rng_states[i])
+        try:
+            return f(*args)
+        finally:
+            self.rng_states[i] = np.random.get_state()
+
+    def write_obs(self, k, obs):
+        assert obs.shape[0] == self.obs_dim, \
+            "set input dim to {}".format(obs.shape[0])
+        self.buf.obs[k] = obs
+
+    def reset(self):
+        for i, env in enumerate(self.envs):
+            k = self.lo + i
+            self.write_obs(k, self.run(i, env.reset))
+            self.buf.done[k] = False
+            self.buf.mind[k] = getattr(env, 'current_mind', 0)
+
+    def step(self, steps, lo, hi):
+        buf = self.buf
+        for k in range(max(lo, self.lo), min(hi, self.lo + len(self.envs))):
+            i = k - self.lo
+            env = self.envs[i]
+            if int(buf.active[k]) == 0:
+                buf.reward[k] = 0
+                buf.done[k] = True
+                continue
+            obs, buf.reward[k], buf.done[k], buf.mind[k] = self.run(
+                i, self.repeat, env, buf.action[k], int(steps), buf.mind[k])
+            self.write_obs(k, obs)
+
+    def repeat(self, env, action, steps, mind):
+        # Applies action for up to steps frames, summing their rewards. Stops
+        # at the end of the episode, and when the env switches to another
+        # mind so the new mind picks its own action.
+        reward = 0
+        for _ in range(steps):
+            obs, r, done, info = env.step(action)
+            reward += r
+            info = info.get('info', info)
+            if done or info.get('current_mind', 0) != mind:
+                break
+        return obs, reward, done, info.get('current_mind', 0)
+
+    def reward_terminal(self):
+        return [self.reward_terminal_env(i) for i in range(len(self.envs))]
+
+    def reward_terminal_mind(self, mind):
+        return [self.reward_terminal_mind_env(i, mind[self.lo + i])
+                for i in range(len(self.envs))]
+
+    def get_stat(self):
+        return [self.run(i, env.get_stat) if hasattr(env, 'get_stat') else dict()
+                for i, env in enumerate(self.envs)]
+
+    def finish_episode(self):
+        # Everything batch_terminal_reward needs, in a single pass over the
+        # envs. Positions are taken out of the stats into rows of
+        # [test_pos, switch_pos, final_pos].
+        buf = self.buf
+        stats = []
+        for i, env in enumerate(self.envs):
+            k = self.lo + i
+            buf.reward_terminal[k] = self.reward_terminal_env(i)
+            for m in range(buf.reward_mind.shape[1]):
+                buf.reward_mind[k, m] = self.reward_terminal_mind_env(i, m + 1)
+            stat = self.run(i, env.get_stat) if hasattr(env, 'get_stat') else dict()
+            stats.append(self.write_stat(k, stat))
+        return stats
+
+    def write_stat(self, k, stat):
+        # success and positions of env k go to the buffers, the rest of its
+        # stats is returned
+        buf = self.buf
+        stat = dict(stat)
+        buf.success[k] = bool(stat.pop('success', False))
+        buf.position[k] = 0
+        buf.has_position[k] = 'test_pos' in stat or 'switch_pos' in stat
+        if 'test_pos' in stat:
+            buf.position[k, 0:2] = stat.pop('test_pos')
+        if 'switch_pos' in stat:
+            buf.position[k, 2:4] = stat.pop('switch_pos')
+            buf.position[k, 4:6] = stat.pop('final_pos')
+        return stat
+
+    def reward_terminal_env(self, i):
+        env = self.envs[i]
+        if hasattr(env, 'reward_terminal'):
+            return self.run(i, env.reward_terminal)
+        return 0
+
+    def reward_terminal_mind_env(self, i, mind):
+        env = self.envs[i]
+        if hasattr(env, 'reward_terminal_mind'):
+            return self.run(i, env.reward_terminal_mind, mind)
+        return 0
+
+    # below only concern the first env of the batch
+
+    def render(self, get_image):
+        if self.lo > 0:
+            return []
+        self.envs[0].render()
+        if get_image:
+            data, w, h = self.envs[0].get_viewer().get_image()
+            return [np.fromstring(data, dtype='uint8').reshape(h, w, 3)[::-1, :, :]]
+        return [None]
+
+    def obs_shape(self):
+        return [self.envs[0].observation_space.shape] if self.lo == 0 else []
+
+    def num_actions(self):
+        return [self.envs[0].action_space.n] if self.lo == 0 else []
+
+class ObsNormalizer(object):
+    # Running mean and variance of the observations of each env, updated
+    # with every observation as NormalizedEnv(normalize_obs=True) of rllab
+    # does, for the batched envs it cannot wrap.
+    ALPHA = 0.001
+
+    def __init__(self, size, obs_dim):
+        self.mean = np.zeros((size, obs_dim))
+        self.var = np.ones((size, obs_dim))
+
+    def __call__(self, obs, rows):
+        a = self.ALPHA
+        self.mean[rows] = (1 - a) * self.mean[rows] + a * obs
+        self.var[rows] = (1 - a) * self.var[rows] + a * np.square(obs - self.mean[rows])
+        return (obs - self.mean[rows]) / (np.sqrt(self.var[rows]) + 1e-8)
+
+class BatchRunner(EnvRunner):
+    # Runs envs [lo, lo + len(seeds)) of the batch with a single env class
+    # that simulates all of them as arrays (batched = True).
+    def __init__(self, env_name, opts, lo, seeds, buf):
+        self.lo = lo
+        self.buf = buf
+        self.env = env_class(env_name)(opts, seeds)
+        self.size = len(seeds)
+        self.obs_dim = buf.obs.shape[1]
+        self.normalizer = None
         if opts['rllab_normalize_rllab']:
-            envs[-1] = NormalizedEnv(env=envs[-1], normalize_obs=True)
+            self.normalizer = ObsNormalizer(self.size, self.obs_dim)
 
-def reset():
-    obs = []
-    for i in range(len(envs)):
-        obs.append(envs[i].reset())
-    return obs
-
-def step(action, active, steps):
-    state, reward, done, info = [], [], [], []
-    for i in range(len(envs)):
-        if int(active[i]) == 0:
-            state.append(0)
-            reward.append(0)
-            done.append(True)
-            info.append(dict())
-        else:
-            s, r, d, f = None, None, None, None
-            for s in range(int(steps)):
-                s, r, d, f = envs[i].step(action[i])
-                if d:
-                    break
-            state.append(s)
-            reward.append(r)
-            done.append(d)
-            if 'info' in f:
-                info.append(f['info'])
+    def normalize(self, obs, rows):
+        # rows of the envs in this runner
+        if self.normalizer is None:
+            return obs
+        return self.normalizer(obs, rows)
+
+    def reset(self):
+        obs, mind = self.env.reset()
+        assert obs.shape[1] == self.obs_dim, \
+            "set input dim to {}".format(obs.shape[1])
+        rows = slice(self.lo, self.lo + self.size)
+        self.buf.obs[rows] = self.normalize(obs, slice(None))
+        self.buf.done[rows] = False
+        self.buf.mind[rows] = mind
+
+    def step(self, steps, lo, hi):
+        buf = self.buf
+        lo, hi = max(lo, self.lo), min(hi, self.lo + self.size)
+        if hi <= lo:
+            return
+        k = np.arange(lo, hi)
+        active = buf.active[k] != 0
+        buf.reward[k[~active]] = 0
+        buf.done[k[~active]] = True
+        # as EnvRunner.repeat, for all active envs at once
+        k = k[active]
+        mind = buf.mind[k].copy()
+        reward = np.zeros(len(k))
+        running = np.ones(len(k), dtype='bool')
+        for _ in range(int(steps)):
+            if not running.any():
+                break
+            r = np.nonzero(running)[0]
+            obs, rew, done, new_mind = self.env.step(buf.action[k[r]], k[r] - self.lo)
+            reward[r] += rew
+            buf.obs[k[r]] = self.normalize(obs, k[r] - self.lo)
+            buf.done[k[r]] = done
+            buf.mind[k[r]] = new_mind
+            running[r] = ~done & (new_mind == mind[r])
+        buf.reward[k] = reward
+
+    def reward_terminal(self):
+        return list(self.env.reward_terminal())
+
+    def reward_terminal_mind(self, mind):
+        return list(self.env.reward_terminal_mind(
+            np.asarray(mind)[self.lo:self.lo + self.size]))
+
+    def get_stat(self):
+        return self.env.get_stat()
+
+    def finish_episode(self):
+        buf = self.buf
+        rows = slice(self.lo, self.lo + self.size)
+        buf.reward_terminal[rows] = self.env.reward_terminal()
+        for m in range(buf.reward_mind.shape[1]):
+            buf.reward_mind[rows, m] = self.env.reward_terminal_mind(m + 1)
+        return [self.write_stat(self.lo + i, stat)
+                for i, stat in enumerate(self.env.get_stat())]
+
+    def render(self, get_image):
+        if self.lo > 0:
+            return []
+        if not hasattr(self.env, 'render'):
+            raise NotImplementedError("{} is not rendered".format(type(self.env).__name__))
+        return [self.env.render(get_image)]
+
+    def obs_shape(self):
+        return [(self.obs_dim,)] if self.lo == 0 else []
+
+def make_runner(env_name, opts, lo, seeds, buf):
+    if getattr(env_class(env_name), 'batched', False):
+        return BatchRunner(env_name, opts, lo, seeds, buf)
+    return EnvRunner(env_name, opts, lo, seeds, buf)
+
+def pool_worker(conn, env_name, opts, lo, seeds, buf):
+    try:
+        runner = make_runner(env_name, opts, lo, seeds, buf)
+    except:
+        conn.send((False, traceback.format_exc()))
+        return
+    conn.send((True, None))
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        try:
+            conn.send((True, runner.call(*msg)))
+        except:
+            conn.send((False, traceback.format_exc()))
+
+class EnvPool(object):
+    # Splits the batch into contiguous slices, each stepped by an EnvRunner
+    # in its own process. Results of step and reset go through the shared
+    # buffers, everything else through pipes. The processes are forked
+    # whatever the default start method, to inherit the shared buffers.
+    def __init__(self, nproc, env_name, opts, seeds, buf):
+        self.conns = []
+        self.procs = []
+        ctx = multiprocessing.get_context('fork')
+        bounds = np.linspace(0, len(seeds), min(nproc, len(seeds)) + 1).astype(int)
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            conn, child_conn = ctx.Pipe()
+            p = ctx.Process(target=pool_worker, args=(
+                child_conn, env_name, opts, lo, seeds[lo:hi], buf))
+            p.daemon = True
+            p.start()
+            self.conns.append(conn)
+            self.procs.append(p)
+        try:
+            self.wait()
+        except:
+            for p in self.procs:
+                p.terminate()
+            raise
+
+    def wait(self):
+        res = []
+        for conn in self.conns:
+            ok, r = conn.recv()
+            if not ok:
+                raise RuntimeError("env pool worker failed:\n" + r)
+            if r is not None:
+                res.extend(r)
+        return res
+
+    def call(self, name, *args):
+        for conn in self.conns:
+            conn.send((name,) + args)
+        return self.wait()
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+            conn.close()
+        for p in self.procs:
+            p.join()
+        self.conns = []
+        self.procs = []
+
+class BackgroundReset(object):
+    # Resets the envs of a runner or EnvPool in a thread as soon as an
+    # episode is finished, while Lua trains on it, so the reset that starts
+    # the next episode only has to wait for what is left of it. Every call
+    # waits for the reset first. Each env draws from its own random state
+    # and nothing else draws in between, so episodes are the same as when
+    # the reset is done on demand.
+    def __init__(self, envs):
+        self.envs = envs
+        self.thread = None
+        self.ready = False
+
+    def call(self, name, *args):
+        self.wait()
+        if name == 'reset' and self.ready:
+            self.ready = False
+            return None
+        if name in ('reset', 'step'):
+            self.ready = False
+        return self.envs.call(name, *args)
+
+    def start(self):
+        self.wait()
+        self.error = None
+        self.thread = threading.Thread(target=self.reset)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def reset(self):
+        try:
+            self.envs.call('reset')
+        except:
+            self.error = traceback.format_exc()
+
+    def wait(self):
+        if self.thread is None:
+            return
+        self.thread.join()
+        self.thread = None
+        if self.error is not None:
+            raise RuntimeError("background reset failed:\n" + self.error)
+        self.ready = True
+
+    def close(self):
+        self.wait()
+        if isinstance(self.envs, EnvPool):
+            self.envs.close()
+
+class Recorder(object):
+    # Appends every episode of the batch to memory-mapped .npy files, one
+    # row per episode, so they can be studied offline with
+    # np.load(..., mmap_mode='r'). The files of a shard are preallocated
+    # for nepisodes episodes of up to max_steps steps, in a directory
+    # <path>/<pid>-<shard>, and a new shard is started when one is full.
+    # Unused rows and steps are left as zeros. Times count agent steps,
+    # each of --rllab_steps frames: length is the number of steps
+    # recorded, obs[:, t] and mind[:, t] are seen before step t, and
+    # switch_t is the first t where mind changes, -1 for episodes without
+    # a switch within the recorded steps.
+    def __init__(self, path, nepisodes, buf, max_steps):
+        self.path = path
+        self.nepisodes = nepisodes
+        self.buf = buf
+        self.max_steps = max_steps
+        size, obs_dim = buf.obs.shape
+        assert nepisodes >= size, "rllab_record_episodes must be >= batch_size"
+        self.fields = dict(
+            obs=((max_steps + 1, obs_dim), 'float32'),
+            mind=((max_steps + 1,), 'int8'),
+            action=((max_steps, buf.action.shape[1]), 'float32'),
+            reward=((max_steps,), 'float32'),
+            length=((), 'int32'),
+            success=((), 'bool'),
+            test=((), 'bool'),
+            switch_t=((), 'int32'),
+            reward_terminal=((), 'float32'),
+            reward_mind=((buf.reward_mind.shape[1],), 'float32'),
+            position=((6,), 'float32'))
+        self.shard = 0
+        self.files = None
+        self.t = np.zeros(size, dtype='int64')
+        self.mind = np.zeros(size, dtype='int64')
+        self.switch_t = np.zeros(size, dtype='int64')
+
+    def rotate(self):
+        self.close()
+        shard = os.path.join(self.path, '{}-{:05d}'.format(os.getpid(), self.shard))
+        os.makedirs(shard)
+        self.files = dict(
+            (name, np.lib.format.open_memmap(
+                os.path.join(shard, name + '.npy'), mode='w+', dtype=dtype,
+                shape=(self.nepisodes,) + shape))
+            for name, (shape, dtype) in self.fields.items())
+        self.shard += 1
+        self.row = 0
+
+    def reset(self):
+        size = len(self.t)
+        if self.files is None or self.row + size > self.nepisodes:
+            self.rotate()
+        self.rows = np.arange(self.row, self.row + size)
+        self.row += size
+        self.t[:] = 0
+        self.mind[:] = self.buf.mind
+        self.switch_t[:] = -1
+        self.files['obs'][self.rows, 0] = self.buf.obs
+        self.files['mind'][self.rows, 0] = self.buf.mind
+
+    def step(self, lo, hi):
+        buf = self.buf
+        k = np.arange(lo, hi)[(buf.active[lo:hi] == 1) & (self.t[lo:hi] < self.max_steps)]
+        rows, t = self.rows[k], self.t[k]
+        self.files['action'][rows, t] = buf.action[k]
+        self.files['reward'][rows, t] = buf.reward[k]
+        self.files['obs'][rows, t + 1] = buf.obs[k]
+        self.files['mind'][rows, t + 1] = buf.mind[k]
+        self.t[k] += 1
+        switched = k[(self.switch_t[k] < 0) & (buf.mind[k] != self.mind[k])]
+        self.switch_t[switched] = self.t[switched]
+        self.mind[k] = buf.mind[k]
+
+    def finish_episode(self, stats):
+        buf, f, rows = self.buf, self.files, self.rows
+        f['length'][rows] = self.t
+        f['success'][rows] = buf.success
+        f['reward_terminal'][rows] = buf.reward_terminal
+        f['reward_mind'][rows] = buf.reward_mind
+        f['position'][rows] = buf.position
+        f['test'][rows] = [s.get('type') == 'test_task' for s in stats]
+        f['switch_t'][rows] = self.switch_t
+
+    def close(self):
+        if self.files is not None:
+            for f in self.files.values():
+                f.flush()
+            self.files = None
+
+NONLINS = {
+    'tanh': np.tanh,
+    'relu': lambda x: np.maximum(x, 0),
+    'none': lambda x: x,
+}
+
+class Policy(object):
+    # The feed-forward model of Agent.lua (nminds 1) or MultiMindAgent.lua
+    # for rllab envs, run with numpy on the whole batch by rollout. Weights
+    # of every mind come from Agent:rollout_params as [weight, bias] pairs
+    # of nn.Linear. Actions are sampled as nn.Sampler and nn.GaussianSampler
+    # do, and made into env actions as RllabBridge:rllab_action does.
+    # Observations are normalized as RllabBridge:normalize does, from the
+    # statistics Lua has before the episode.
+    def __init__(self, opts, seed):
+        self.opts = opts
+        self.nonlin = NONLINS[opts['nonlin']]
+        self.names = list(opts['action_names'])
+        self.nactions = [int(opts['nactions_byname'][name]) for name in self.names]
+        self.nminds = int(opts['nminds'])
+        self.rng = np.random.RandomState(seed)
+
+    def load(self, params, obs_min=None, obs_max=None):
+        def linear(p):
+            return np.asarray(p[0], 'float64'), np.asarray(p[1], 'float64')
+        self.minds = []
+        for p in params:
+            layers = [linear(p['enc'])] + [linear(l) for l in p['layers'] or []]
+            self.minds.append((layers, [linear(h) for h in p['heads']]))
+        dim = int(self.opts['rllab_in_dim'])
+        self.obs_min = np.full(dim, -0.01) if obs_min is None else np.ravel(obs_min)
+        self.obs_max = np.full(dim, 0.01) if obs_max is None else np.ravel(obs_max)
+
+    def normalize(self, obs):
+        if not self.opts['rllab_normalize']:
+            return obs
+        self.obs_max = np.maximum(self.obs_max, obs.max(0))
+        self.obs_min = np.minimum(self.obs_min, obs.min(0))
+        return (obs - self.obs_min) / (self.obs_max - self.obs_min) * 2 - 1
+
+    def heads(self, obs, mind):
+        # outputs of the action heads, from the mind of every row
+        x = self.normalize(obs)
+        out = None
+        for m, (layers, heads) in enumerate(self.minds):
+            h = x
+            for w, b in layers:
+                h = self.nonlin(h.dot(w.T) + b)
+            y = [h.dot(w.T) + b for w, b in heads]
+            if out is None:
+                out = y
+            else:
+                rows = mind == m + 1
+                for k in range(len(y)):
+                    out[k][rows] = y[k][rows]
+        return out
+
+    def act(self, obs, mind):
+        # sampled actions, and the env actions made of them
+        size = len(obs)
+        sample = np.zeros((size, len(self.names)), 'float32')
+        action = np.zeros((size, len(self.names)))
+        limit = float(self.opts['rllab_cont_limit'])
+        last = len(self.names) - 1
+        for k, y in enumerate(self.heads(obs, mind)):
+            n = self.nactions[k]
+            if n == 1 and self.nminds == 1:
+                a = self.rng.randn(size) * np.exp(y[:, 1]) + y[:, 0]
             else:
-                info.append(f)
-    return (state, reward, done, info)
+                p = np.exp(y - y.max(1, keepdims=True))
+                p = p.cumsum(1)
+                u = self.rng.uniform(size=(size, 1)) * p[:, -1:]
+                a = np.minimum((p < u).sum(1), n - 1) + 1
+            sample[:, k] = a
+            if self.opts['rllab_cont_action'] and (self.nminds == 1 or k < last):
+                action[:, k] = np.linspace(-limit, limit, n)[a.astype(int) - 1]
+            else:
+                if n == 1:
+                    a = np.clip(a, -limit, limit)
+                action[:, k] = a - 1
+        return sample, action
+
+envs = buf = recorder = policy = None
+
+@command
+def init(env_name, size, opts, seed=None):
+    # the globals are set once everything is built, they stay None if
+    # something fails
+    global envs, buf, recorder, policy
+    if isinstance(envs, (EnvPool, BackgroundReset)):
+        envs.close()
+    if recorder is not None:
+        recorder.close()
+    envs = buf = recorder = policy = None
+    size = int(size)
+    if seed is None:
+        seed = np.random.randint(2 ** 31)
+    seeds = [(int(seed) + i) % 2 ** 32 for i in range(size)]
+    npool = int(opts.get('rllab_pool', 0))
+    new_buf = Buffers(size, int(opts['rllab_in_dim']), int(opts['naction_heads']),
+                      int(opts['nminds']), shared=npool > 0)
+    if npool > 0:
+        new_envs = EnvPool(npool, env_name, opts, seeds, new_buf)
+    else:
+        new_envs = make_runner(env_name, opts, 0, seeds, new_buf)
+    if opts.get('rllab_prereset'):
+        new_envs = BackgroundReset(new_envs)
+    new_recorder = None
+    if opts.get('rllab_record'):
+        new_recorder = Recorder(opts['rllab_record'], int(opts['rllab_record_episodes']),
+                                new_buf, int(opts['max_steps']))
+    new_policy = None
+    if opts.get('rllab_rollout'):
+        new_policy = Policy(opts, (int(seed) + size) % 2 ** 32)
+    envs, buf, recorder, policy = new_envs, new_buf, new_recorder, new_policy
+
+@command
+def reset():
+    envs.call('reset')
+    if recorder is not None:
+        recorder.reset()
+    return (buf.obs, buf.mind)
+
+@command
+def step(action, active, steps, lo=0, hi=None):
+    # Steps envs [lo, hi) of the batch, so Lua can run the model on one
+    # part of the batch while the other is stepped. Results are returned
+    # in the same buffers every step, rows of inactive envs are left
+    # untouched.
+    if hi is None:
+        hi = len(buf.active)
+    buf.action[lo:hi] = action
+    buf.active[lo:hi] = active
+    envs.call('step', steps, lo, hi)
+    if recorder is not None:
+        recorder.step(lo, hi)
+    return (buf.obs[lo:hi], buf.reward[lo:hi], buf.done[lo:hi], buf.mind[lo:hi])
+
+@command
+def rollout(params, steps, max_steps, obs_min=None, obs_max=None):
+    # Runs the episode started by reset to its end with the model of params,
+    # see Policy, so it costs one call instead of one per step. Returns the
+    # sampled actions and the results of every step, for
+    # RllabBridge:batch_rollout to replay. obs_min and obs_max are the
+    # statistics of RllabBridge:normalize, nil before the first episode.
+    policy.load(params, obs_min, obs_max)
+    size, nheads = buf.action.shape
+    max_steps = int(max_steps)
+    res = dict(action=np.zeros((max_steps, size, nheads), 'float32'),
+               obs=np.zeros((max_steps,) + buf.obs.shape, 'float32'),
+               reward=np.zeros((max_steps, size)),
+               done=np.zeros((max_steps, size), 'bool'),
+               mind=np.zeros((max_steps, size), 'int64'))
+    for t in range(max_steps):
+        active = ~buf.done
+        res['action'][t], action = policy.act(buf.obs, buf.mind)
+        # once all envs are done, the results are only masked on the Lua side
+        if active.any():
+            step(action, active, steps)
+        res['obs'][t] = buf.obs
+        res['reward'][t] = buf.reward
+        res['done'][t] = buf.done
+        res['mind'][t] = buf.mind
+    return res
+
+@command
+def finish_episode():
+    # terminal rewards, per-mind terminal rewards, success and stats of the
+    # finished episode, for all envs in a single call
+    stat = envs.call('finish_episode')
+    if recorder is not None:
+        recorder.finish_episode(stat)
+    if isinstance(envs, BackgroundReset):
+        # only obs, done and mind of the buffers change until reset
+        envs.start()
+    return dict(reward=buf.reward_terminal, reward_mind=buf.reward_mind,
+                success=buf.success, position=buf.position,
+                has_position=buf.has_position, stat=stat)
 
+@command
 def reward_terminal():
-    reward = []
-    for i in range(len(envs)):
-        if hasattr(envs[i], 'reward_terminal'):
-            reward.append(envs[i].reward_terminal())
-        else:
-            reward.append(0)
-    return reward
+    return envs.call('reward_terminal')
 
+@command
 def render(get_image = False):
-    envs[0].render()
-    if get_image:
-        data, w, h = envs[0].get_viewer().get_image()
-        return np.fromstring(data, dtype='uint8').reshape(h, w, 3)[::-1, :, :]
+    return envs.call('render', get_image)[0]
 
+@command
 def obs_shape():
-    return envs[0].observation_space.shape
+    return envs.call('obs_shape')[0]
 
+@command
 def num_actions():
-    return envs[0].action_space.n
+    return envs.call('num_actions')[0]
 
+@command
 def get_stat():
-    stat = []
-    for i in range(len(envs)):
-        if hasattr(envs[i], 'get_stat'):
-            stat.append(envs[i].get_stat())
-        else:
-            stat.append(dict())
-    return stat
+    return envs.call('get_stat')
 
 # below for self-play training only
 
+@command
 def reward_terminal_mind(mind):
-    reward = []
-    for i in range(len(envs)):
-        if hasattr(envs[i], 'reward_terminal_mind'):
-            reward.append(envs[i].reward_terminal_mind(mind[i]))
-        else:
-            reward.append(0)
-    return reward
+    return envs.call('reward_terminal_mind', mind)
 
+@command
 def current_mind():
-    mind = []
-    for i in range(len(envs)):
-        mind.append(envs[i].current_mind)
-    return mind
+    if isinstance(envs, BackgroundReset):
+        # the reset in the background writes mind
+        envs.wait()
+    return buf.mind.tolist()
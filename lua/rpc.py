@@ -0,0 +1,161 @@
+import struct
+import numbers
+import numpy as np
+import six
+from six.moves import collections_abc
+
+# Commands that can be called from Lua by name with bridge.call().
+# Modules loaded into the worker register their entry points with @command.
+COMMANDS = {}
+
+
+def command(f):
+    COMMANDS[f.__name__] = f
+    return f
+
+
+# Every value is a one byte tag followed by its payload:
+#   n             nil
+#   T, F          booleans
+#   i <q>         integer
+#   d <d>         double
+#   s <q> bytes   string
+#   l <q> values  list
+#   m <q> pairs   map
+#   t <c> <q> <q>*ndim       tensor of dtype <c> with ndim and shape
+# The header holding these is the first frame of a multipart message and
+# the data of each tensor follows as its own frame, in order, so arrays
+# are neither converted nor copied into the header.
+_DTYPES = {
+    np.dtype('float32'): b'f',
+    np.dtype('float64'): b'd',
+    np.dtype('uint8'): b'B',
+    np.dtype('int8'): b'b',
+    np.dtype('int16'): b'h',
+    np.dtype('int32'): b'i',
+    np.dtype('int64'): b'q',
+}
+_CODES = dict((v, k) for k, v in _DTYPES.items())
+_INT = struct.Struct('q')
+_DOUBLE = struct.Struct('d')
+
+
+def _encode(x, out):
+    # out[0] collects the header, tensors are appended as extra frames
+    # exact type checks first, the abstract ones below are much slower
+    t = type(x)
+    if t is np.ndarray and x.ndim > 0:
+        if x.dtype == np.bool_:
+            x = x.view('uint8')
+        elif x.dtype not in _DTYPES:
+            x = x.astype('double')
+        x = np.ascontiguousarray(x)
+        out[0].append(b't' + _DTYPES[x.dtype] +
+                      struct.pack('q' * (x.ndim + 1), x.ndim, *x.shape))
+        out.append(x)
+    elif t is float:
+        out[0].append(b'd' + _DOUBLE.pack(x))
+    elif t is bool:
+        out[0].append(b'T' if x else b'F')
+    elif t is int:
+        out[0].append(b'i' + _INT.pack(x))
+    elif t is list or t is tuple:
+        out[0].append(b'l' + _INT.pack(len(x)))
+        for v in x:
+            _encode(v, out)
+    elif t is dict:
+        out[0].append(b'm' + _INT.pack(len(x)))
+        for k, v in x.items():
+            _encode(k, out)
+            _encode(v, out)
+    elif x is None:
+        out[0].append(b'n')
+    elif isinstance(x, (bool, np.bool_)):
+        out[0].append(b'T' if x else b'F')
+    elif isinstance(x, numbers.Integral):
+        out[0].append(b'i' + _INT.pack(int(x)))
+    elif isinstance(x, numbers.Number):
+        out[0].append(b'd' + _DOUBLE.pack(float(x)))
+    elif isinstance(x, six.string_types):
+        x = x.encode()
+        out[0].append(b's' + _INT.pack(len(x)))
+        out[0].append(x)
+    elif isinstance(x, np.ndarray):
+        _encode(x.item(), out)
+    elif isinstance(x, collections_abc.Mapping):
+        _encode(dict(x), out)
+    elif isinstance(x, collections_abc.Iterable):
+        _encode(list(x), out)
+    else:
+        raise Exception("Cannot serialize variable of type {0}".format(type(x)))
+
+
+def encode(x):
+    # returns the frames of a multipart message
+    out = [[]]
+    _encode(x, out)
+    out[0] = b''.join(out[0])
+    return out
+
+
+def _decode(buf, pos, frames):
+    tag = buf[pos:pos+1]
+    pos += 1
+    if tag == b'n':
+        return None, pos
+    elif tag == b'T':
+        return True, pos
+    elif tag == b'F':
+        return False, pos
+    elif tag == b'i':
+        return _INT.unpack_from(buf, pos)[0], pos + 8
+    elif tag == b'd':
+        return _DOUBLE.unpack_from(buf, pos)[0], pos + 8
+    elif tag == b's':
+        n = _INT.unpack_from(buf, pos)[0]
+        pos += 8
+        return bytes(buf[pos:pos+n]).decode(), pos + n
+    elif tag == b'l':
+        n = _INT.unpack_from(buf, pos)[0]
+        pos += 8
+        lst = []
+        for _ in range(n):
+            v, pos = _decode(buf, pos, frames)
+            lst.append(v)
+        return lst, pos
+    elif tag == b'm':
+        n = _INT.unpack_from(buf, pos)[0]
+        pos += 8
+        tbl = {}
+        for _ in range(n):
+            k, pos = _decode(buf, pos, frames)
+            v, pos = _decode(buf, pos, frames)
+            tbl[k] = v
+        return tbl, pos
+    elif tag == b't':
+        dtype = _CODES[buf[pos:pos+1]]
+        ndim = _INT.unpack_from(buf, pos + 1)[0]
+        shape = struct.unpack_from('q' * ndim, buf, pos + 9)
+        data = next(frames)
+        if hasattr(data, 'buffer'):
+            data = data.buffer
+        arr = np.frombuffer(data, dtype=dtype).reshape(shape)
+        return arr, pos + 9 + 8 * ndim
+    else:
+        raise Exception("Cannot deserialize tag {0}".format(tag))
+
+
+def decode(frames, pos=0):
+    # frames can be bytes or zmq.Frame, the tensors returned are read-only
+    # views into them
+    frames = iter(frames)
+    buf = next(frames)
+    if hasattr(buf, 'bytes'):
+        buf = buf.bytes
+    return _decode(buf, pos, frames)[0]
+
+
+def call(frames, pos=0):
+    # a call is a list of the command name followed by its arguments
+    args = decode(frames, pos)
+    return COMMANDS[args[0]](*args[1:])
@@ -4,6 +4,7 @@ paths.dofile('SCEnv.lua')
 paths.dofile('SCBattleEnv.lua')
 paths.dofile('SCEconEnv.lua')
 paths.dofile('SCSPEconEnv.lua')
+paths.dofile('StateCounts.lua')
 
 local SCBridge = torch.class('SCBridge')
 local DEBUG = 0
@@ -150,11 +150,8 @@ function SCEconEnv:get_reward(agent_ind)
     if self.opts.sc_count_alpha > 0 then
         local s = self:get_state_snapshot()
         local r = self.opts.sc_count_alpha
-        local n = self.state_counts[s.ore+1][s.scvs+1][s.barracks+1][s.depots+1][s.marines+1]
-        if agent_ind == 1 then
-	    n = n + 1
-            self.state_counts[s.ore+1][s.scvs+1][s.barracks+1][s.depots+1][s.marines+1] = n
-        end
+        local n = self.state_counts:add({s.ore, s.scvs, s.barracks, s.depots, s.marines},
+            agent_ind == 1 and 1 or 0)
         r = r / math.sqrt(n)
         return r
     else
@@ -0,0 +1,189 @@
+-- Visit counts of discrete states, for count-based exploration. States
+-- are lists of small non-negative integers, packed into one key of
+-- `bits` bits per value, and counted in an open-addressing hash table,
+-- so memory grows with the states actually visited.
+--
+-- The table is split into segments, each probed linearly on its own and
+-- guarded by its own mutex when shared by threads. The tensors are
+-- shared by threads.sharedserialize, the mutexes by their ids. Segments
+-- cannot grow while threads use them: the trainer calls grow between
+-- batches, and sends the new table to the threads. Until then, states
+-- that find their segment full are not counted.
+local StateCounts = torch.class('StateCounts')
+
+-- mutexes of this thread, by id
+local mutexes = {}
+
+function StateCounts:__init(opts)
+    opts = opts or {}
+    self.bits = opts.bits or 10
+    self.nsegments = opts.nsegments or 16
+    self.segment_size = opts.segment_size or 1024
+    self.keys = torch.DoubleTensor(self.nsegments * self.segment_size):fill(-1)
+    self.counts = torch.IntTensor(self.nsegments * self.segment_size):zero()
+    if opts.shared then
+        local threads = require('threads')
+        self.mutex_ids = {}
+        for s = 1, self.nsegments do
+            local m = threads.Mutex()
+            mutexes[m:id()] = m
+            self.mutex_ids[s] = m:id()
+        end
+    end
+end
+
+function StateCounts:key(state)
+    -- keys are exact in a double up to 2^53
+    assert(#state * self.bits <= 53, 'too many values in a state')
+    local key = 0
+    local base = 2^self.bits
+    for i = #state, 1, -1 do
+        assert(state[i] >= 0 and state[i] < base, 'state value out of range')
+        key = key * base + state[i]
+    end
+    return key
+end
+
+function StateCounts:find(key)
+    -- segment and first slot of a key, products stay below 2^53
+    local h = (key % 2147483629) * 48271 % 2147483647
+    local s = h % self.nsegments + 1
+    local first = (s - 1) * self.segment_size + 1
+    return s, first + math.floor(h / self.nsegments) % self.segment_size
+end
+
+function StateCounts:lock(s)
+    if self.mutex_ids then
+        local id = self.mutex_ids[s]
+        if not mutexes[id] then
+            mutexes[id] = require('threads').Mutex(id)
+        end
+        mutexes[id]:lock()
+        return mutexes[id]
+    end
+end
+
+function StateCounts:add(state, n)
+    -- Adds n to the count of state and returns it. A state that was never
+    -- seen is only inserted if n > 0.
+    local key = self:key(state)
+    local s, slot = self:find(key)
+    local first = (s - 1) * self.segment_size + 1
+    local keys = self.keys:data()
+    local counts = self.counts:data()
+    local mutex = self:lock(s)
+    -- the count of a state seen for the first time, or that finds its
+    -- segment full
+    local count = n
+    for _ = 1, self.segment_size do
+        local k = keys[slot - 1]
+        if k == key then
+            counts[slot - 1] = counts[slot - 1] + n
+            count = counts[slot - 1]
+            break
+        elseif k == -1 then
+            if n > 0 then
+                keys[slot - 1] = key
+                counts[slot - 1] = n
+            end
+            break
+        end
+        slot = slot + 1
+        if slot == first + self.segment_size then
+            slot = first
+        end
+    end
+    if mutex then mutex:unlock() end
+    return count
+end
+
+function StateCounts:get(state)
+    return self:add(state, 0)
+end
+
+function StateCounts:size()
+    return self.keys:ne(-1):sum()
+end
+
+function StateCounts:needs_grow()
+    -- when the fullest segment is half full
+    local used = self.keys:ne(-1):int():view(self.nsegments, self.segment_size):sum(2)
+    return used:max() * 2 > self.segment_size
+end
+
+function StateCounts:grow()
+    -- Doubles the segments and reinserts every state, in place. Threads
+    -- must not use the table meanwhile, and need the new tensors after.
+    local keys, counts = self:compact()
+    self.segment_size = self.segment_size * 2
+    self.keys = torch.DoubleTensor(self.nsegments * self.segment_size):fill(-1)
+    self.counts = torch.IntTensor(self.nsegments * self.segment_size):zero()
+    self:insert(keys, counts)
+end
+
+function StateCounts:insert(keys, counts)
+    local kd = self.keys:data()
+    local cd = self.counts:data()
+    for i = 1, keys:nElement() do
+        local key = keys[i]
+        local s, slot = self:find(key)
+        local first = (s - 1) * self.segment_size + 1
+        while kd[slot - 1] ~= -1 and kd[slot - 1] ~= key do
+            slot = slot + 1
+            if slot == first + self.segment_size then
+                slot = first
+            end
+        end
+        kd[slot - 1] = key
+        cd[slot - 1] = cd[slot - 1] + counts[i]
+    end
+end
+
+function StateCounts:compact()
+    -- keys and counts of the visited states
+    local used = self.keys:ne(-1)
+    if self:size() == 0 then
+        return torch.DoubleTensor(0), torch.IntTensor(0)
+    end
+    return self.keys[used], self.counts[used]
+end
+
+function StateCounts:state()
+    -- compact form for checkpoints, see load
+    local keys, counts = self:compact()
+    return {bits = self.bits, keys = keys, counts = counts}
+end
+
+function StateCounts:load(f)
+    -- Takes the counts of a checkpoint, in the form of state or as the
+    -- dense tensor of older checkpoints, indexed by state values + 1.
+    local keys, counts
+    if torch.isTensor(f) then
+        local n = f:ne(0):sum()
+        local idx = n > 0 and f:nonzero() or nil
+        keys = torch.DoubleTensor(n)
+        counts = torch.IntTensor(n)
+        for i = 1, n do
+            local state = {}
+            for d = 1, idx:size(2) do
+                state[d] = idx[i][d] - 1
+            end
+            keys[i] = self:key(state)
+            counts[i] = f[idx[i]:totable()]
+        end
+    else
+        assert(f.bits == self.bits, 'state counts saved with different bits')
+        keys, counts = f.keys, f.counts
+    end
+    self.keys:fill(-1)
+    self.counts:zero()
+    while keys:nElement() * 2 > self.nsegments * self.segment_size do
+        self.segment_size = self.segment_size * 2
+        self.keys = torch.DoubleTensor(self.nsegments * self.segment_size):fill(-1)
+        self.counts = torch.IntTensor(self.nsegments * self.segment_size):zero()
+    end
+    self:insert(keys, counts)
+    while self:needs_grow() do
+        self:grow()
+    end
+end
@@ -35,6 +35,28 @@ function merge_stat(stat, s)
     end
 end
 
+function reduce_shard(grads, out, w, n)
+    -- Shard w of n of the average of the gradient lists grads, written to
+    -- out, with its squared norm. The shard is rows of every parameter, so
+    -- n threads together cover all of out.
+    local sq = 0
+    for i = 1, #out do
+        local rows = out[i]:size(1)
+        local lo = math.floor(rows * (w - 1) / n)
+        local hi = math.floor(rows * w / n)
+        if hi > lo then
+            local dst = out[i]:narrow(1, lo + 1, hi - lo)
+            dst:copy(grads[1][i]:narrow(1, lo + 1, hi - lo))
+            for v = 2, #grads do
+                dst:add(grads[v][i]:narrow(1, lo + 1, hi - lo))
+            end
+            dst:div(#grads)
+            sq = sq + dst:dot(dst)
+        end
+    end
+    return sq
+end
+
 function sample_multinomial(p)
     -- for some reason multinomial fails sometimes
     local s, sample = pcall(
@@ -156,7 +178,7 @@ end
 
 function plot_switch_pos(s, opts)
     local x = torch.zeros(s:size(1) + 2, 2)
-    if opts.rllab_env == 'SPMountainCar' then
+    if opts.rllab_env == 'SPMountainCar' or opts.rllab_env == 'SPMountainCarVec' then
         x[1][1] = -1
         x[1][2] = -1
         x[-1][1] = 1
@@ -1,25 +1,33 @@
 import numpy as np
-import collections
 import numbers
 import zmq
 import sys
 import six
 import traceback
 import struct
+import time
+from six.moves import collections_abc
+import rpc
+
+# Profile of the listener, only kept after profile_start
+PROFILE = None
 
 
 def parseTensors(bytes):
     key = b"TENSOR_BYTES"
     out = []
     tensorlst = []
+    view = memoryview(bytes)
+    pos = 0
     while True:
-        ind = bytes.find(key)
+        ind = bytes.find(key, pos)
         if ind == -1: break
-        out.append(bytes[:ind])
-        length = struct.unpack('q', bytes[ind+len(key) : ind+len(key)+8])[0]
-        tensorlst.append(byte2np(bytes[ind+len(key)+8:ind+len(key)+8+length]))
-        bytes = bytes[ind+len(key)+8+length:]
-    out.append(bytes)
+        out.append(bytes[pos:ind])
+        pos = ind + len(key) + 8
+        length = struct.unpack_from('q', bytes, ind + len(key))[0]
+        tensorlst.append(byte2np(view[pos:pos+length]))
+        pos += length
+    out.append(bytes[pos:])
     return "".join(s.decode() +
                    ("TENSORLIST[{}]".format(i) if i+1 != len(out) else "")
                    for i, s in enumerate(out)), tensorlst
@@ -43,48 +51,140 @@ def serialize(x):
     elif isinstance(x, numbers.Number):
         return str(x).encode()
     elif isinstance(x, np.ndarray):
-        arr = struct.pack('q', x.ndim)
-        for d in x.shape:
-            arr += struct.pack('q', d)
-        arr = arr + struct.pack('q', x.size) + x.astype('double').tobytes()
-        return key + struct.pack('q', len(arr)) + arr
-    elif isinstance(x, collections.Mapping):
+        arr = x.astype('double').tobytes()
+        header = struct.pack('q' * (x.ndim + 2), x.ndim, *(x.shape + (x.size,)))
+        return b''.join([key, struct.pack('q', len(header) + len(arr)),
+                         header, arr])
+    elif isinstance(x, collections_abc.Mapping):
         return b'{' + b",".join([
             b''.join([b'[', serialize(k), b']=', serialize(v)])
             for k, v in x.items()]) + b'}'
-    elif isinstance(x, collections.Iterable):
+    elif isinstance(x, collections_abc.Iterable):
         return b'{' + b",".join(map(serialize, x)) + b'}'
     else:
         print("Cannot serialize variable of type {0}".format(type(x)))
         raise Exception("Cannot serialize variable of type {0}".format(type(x)))
 
 
-def listener(port):
+class Profile(object):
+    # Per-command call counts and times of the listener, split into decoding
+    # the request, executing it and encoding the reply. Times are totals in
+    # microseconds, histograms count calls by log2 of their microseconds.
+    PHASES = ('decode', 'execute', 'encode')
+    NBINS = 24
+
+    def __init__(self):
+        self.commands = {}
+
+    def add(self, name, *times):
+        c = self.commands.get(name)
+        if c is None:
+            c = self.commands[name] = dict(count=0)
+            for p in self.PHASES:
+                c[p] = 0.
+                c[p + '_hist'] = np.zeros(self.NBINS, dtype='int64')
+        c['count'] += 1
+        for p, t in zip(self.PHASES, times):
+            us = t * 1e6
+            c[p] += us
+            c[p + '_hist'][min(int(us).bit_length(), self.NBINS - 1)] += 1
+
+    def call(self, frames):
+        # same as rpc.encode(rpc.call(frames, 1)), timed
+        t0 = time.perf_counter()
+        args = rpc.decode(frames, 1)
+        t1 = time.perf_counter()
+        res = rpc.COMMANDS[args[0]](*args[1:])
+        t2 = time.perf_counter()
+        res = rpc.encode(res)
+        self.add(args[0], t1 - t0, t2 - t1, time.perf_counter() - t2)
+        return res
+
+
+@rpc.command
+def profile_start():
+    global PROFILE
+    PROFILE = Profile()
+
+
+@rpc.command
+def profile_stats():
+    # the profile since the last query, which starts a new one
+    global PROFILE
+    if PROFILE is None:
+        return {}
+    stats = PROFILE.commands
+    PROFILE = Profile()
+    return stats
+
+
+# names defined by code run with 'x', seen by later 'e' and 'x'
+SCOPE = {}
+
+
+def handle(frames):
+    # Returns the reply frames to the frames of a request, which may be
+    # bytes or zmq.Frame. None for the empty message that stops the worker.
+    data = frames[0]
+    if hasattr(data, 'bytes'):
+        data = data.bytes
+    if data == b"":
+        return None
+    elif data[0] == ord('a'):
+        return [b"connected"]
+    elif data[0] == ord('c'):
+        frames = [data] + list(frames[1:])
+        try:
+            if PROFILE is None:
+                return rpc.encode(rpc.call(frames, 1))
+            else:
+                return PROFILE.call(frames)
+        except:
+            traceback.print_exc()
+            return rpc.encode(None)
+    else:
+        try:
+            t0 = time.perf_counter()
+            f = data[0]
+            arg = data[1:]
+            arg, SCOPE['TENSORLIST'] = parseTensors(arg)
+            t1 = time.perf_counter()
+            if f == ord('e'):
+                res = eval(arg, globals(), SCOPE)
+                t2 = time.perf_counter()
+                res = serialize(res)
+            elif f == ord('x'):
+                exec(arg, globals(), SCOPE)
+                t2 = time.perf_counter()
+                res = b'nil'
+            if PROFILE is not None:
+                PROFILE.add('eval' if f == ord('e') else 'exec',
+                            t1 - t0, t2 - t1, time.perf_counter() - t2)
+        except:
+            res = b'nil'
+            traceback.print_exc()
+        return [res]
+
+
+def bind_address(address):
+    # address is a TCP port or a zmq endpoint such as ipc:///tmp/worker.ipc
+    if '://' not in address:
+        address = "tcp://*:{}".format(address)
+    return address
+
+
+def listener(address):
+    address = bind_address(address)
     context = zmq.Context()
     socket = context.socket(zmq.REP)
-    print("binding to tcp://*:{}".format(port))
-    socket.bind("tcp://*:{}".format(port))
+    print("binding to {}".format(address))
+    socket.bind(address)
     print("Server is listening...")
     while True:
-        data = socket.recv()
-        if data == "":
+        res = handle(socket.recv_multipart(copy=False))
+        if res is None:
             break
-        elif data[0] == ord('a'):
-            res = b"connected"
-        else:
-            try:
-                f = data[0]
-                arg = data[1:]
-                arg, TENSORLIST = parseTensors(arg)
-                if f == ord('e'):
-                    res = serialize(eval(arg))
-                elif f == ord('x'):
-                    exec(arg)
-                    res = b'nil'
-            except:
-                res = b'nil'
-                traceback.print_exc()
-        socket.send(res)
+        socket.send_multipart(res, copy=False)
 
 if __name__ == "__main__":
     assert len(sys.argv) == 2